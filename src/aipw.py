@@ -0,0 +1,117 @@
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+
+
+def design_matrix(df, ord_covariates, unord_covariates):
+    """Standardized ordered covariates and dummies of the unordered ones, with an intercept column"""
+    ordered = df[ord_covariates].to_numpy(dtype=np.float64)
+    ordered = (ordered - ordered.mean(axis=0)) / np.where(ordered.std(axis=0) > 0, ordered.std(axis=0), 1)
+    dummies = pd.get_dummies(df[unord_covariates].astype('category'), drop_first=True).to_numpy(dtype=np.float64)
+    return np.hstack([np.ones((len(df), 1)), ordered, dummies])
+
+
+def fit_outcome_models(x, y, treatment, arms, ridge=1e-6):
+    """
+    Linear regressions of all outcomes on x, one per arm, as a single least squares solve per arm.
+
+    Returns:
+        numpy.ndarray: Coefficients (n_arms, n_features, n_outcomes)
+    """
+    coefs = []
+    for arm in arms:
+        x_arm, y_arm = x[treatment == arm], y[treatment == arm]
+        gram = x_arm.T @ x_arm + ridge * len(x_arm) * np.eye(x.shape[1])
+        coefs.append(np.linalg.solve(gram, x_arm.T @ y_arm))
+    return np.stack(coefs)
+
+
+def _fit_fold(x, y, treatment, arms, train, test):
+    """Nuisance predictions of the held-out rows: propensity matrix (n, n_arms) and outcome means (n, n_arms, n_outcomes)"""
+    ps_model = LogisticRegression(solver='lbfgs', max_iter=1000).fit(x[train][:, 1:], treatment[train])
+    if len(ps_model.classes_) != len(arms):
+        raise ValueError(f"Arms {sorted(set(arms) - set(ps_model.classes_))} are missing from a training fold")
+    ps = ps_model.predict_proba(x[test][:, 1:])[:, np.searchsorted(ps_model.classes_, arms)]
+    mu = np.einsum('nf,afo->nao', x[test], fit_outcome_models(x[train], y[train], treatment[train], arms))
+    return ps, mu
+
+
+def aipw_scores(y, treatment, arms, ps, mu, clip=0.01):
+    """
+    Influence function scores of the potential outcome means, (n, n_arms, n_outcomes).
+
+    AIPW: mu_d(X) + w_d (Y - mu_d(X)) with w_d = 1{D=d} / p_d(X). IPW is the Hajek estimator
+    mu_d = sum w_d Y / sum w_d, its scores mu_d + w_d (Y - mu_d) / mean(w_d) are its influence
+    function shifted by the estimate. Propensity scores are clipped to [clip, 1 - clip].
+    """
+    ps = np.clip(ps, clip, 1 - clip)
+    is_arm = (treatment[:, None] == np.asarray(arms)[None, :]).astype(np.float64)
+    weights = is_arm / ps
+    aipw = mu + weights[:, :, None] * (y[:, None, :] - mu)
+    mu_ipw = (weights.T @ y) / weights.sum(axis=0)[:, None]
+    ipw = mu_ipw + (weights / weights.mean(axis=0))[:, :, None] * (y[:, None, :] - mu_ipw)
+    return aipw, ipw
+
+
+def estimate_aipw(df, config, n_folds=5, max_workers=None, seed=42, clip=0.01):
+    """
+    Cross-fitted AIPW and IPW estimates of the ATEs of all treatment pairs on all outcomes.
+
+    The nuisance models are a multinomial logistic propensity model and linear outcome
+    regressions per arm (all outcomes in one solve). Each fold fits them on the other
+    folds and predicts its held-out rows; folds run in parallel threads (the fits are
+    numpy/lbfgs work, so threads avoid copying the data to processes). Standard errors
+    come from the influence function scores; for IPW they ignore the estimation of the
+    propensity scores.
+
+    Args:
+        df (pandas.DataFrame): The sample, e.g. the rows on the common support
+        config (Config): The model specification: treatment, covariates and outcome_variables
+        n_folds (int): Number of cross-fitting folds
+        max_workers (int): Folds fitted at the same time, defaults to the number of cores
+        seed (int): Seed of the fold split (stratified by treatment)
+        clip (float): Propensity scores are clipped to [clip, 1 - clip]
+
+    Returns:
+        pandas.DataFrame: estimator, outcome, effect (e.g. '1vs0'), ate, ate_se
+    """
+    outcomes = config.outcome_variables
+    treatment = df[config.treatment].to_numpy()
+    arms = np.unique(treatment)
+    x = design_matrix(df, config.ord_covariates, config.unord_covariates)
+    y = df[outcomes].to_numpy(dtype=np.float64)
+
+    # folds stratified by treatment, so every arm is in every training set
+    fold_of_row = np.empty(len(df), dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    for arm in arms:
+        arm_rows = np.flatnonzero(treatment == arm)
+        fold_of_row[arm_rows] = rng.permutation(len(arm_rows)) % n_folds
+    folds = [(fold_of_row != k, fold_of_row == k) for k in range(n_folds)]
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        nuisances = list(pool.map(lambda fold: _fit_fold(x, y, treatment, arms, *fold), folds))
+    ps, mu = np.empty((len(df), len(arms))), np.empty((len(df), len(arms), len(outcomes)))
+    for (_, test), (ps_fold, mu_fold) in zip(folds, nuisances):
+        ps[test], mu[test] = ps_fold, mu_fold
+
+    rows = []
+    for estimator, scores in zip(['aipw', 'ipw'], aipw_scores(y, treatment, arms, ps, mu, clip)):
+        for (c, control), (t, treated) in itertools.combinations(enumerate(arms), 2):
+            diff = scores[:, t] - scores[:, c]
+            ate, ate_se = diff.mean(axis=0), diff.std(axis=0, ddof=1) / np.sqrt(len(diff))
+            rows += [{'estimator': estimator, 'outcome': outcome, 'effect': f'{treated}vs{control}',
+                      'ate': ate[o], 'ate_se': ate_se[o]} for o, outcome in enumerate(outcomes)]
+    return pd.DataFrame(rows)
+
+
+def run_aipw(df, config, n_folds=5, path='output_data/aipw_ate.csv'):
+    """Estimate the AIPW and IPW ATEs (see estimate_aipw) and write them to path"""
+    table = estimate_aipw(df, config, n_folds)
+    table.to_csv(path, index=False)
+    print(table[table['estimator'] == 'aipw'].to_string(index=False))
+    print(f'AIPW and IPW ATEs saved to {path}')
+    return table
@@ -0,0 +1,139 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from moments import smd
+from propensity_score import propensity_matrix
+
+
+def covariate_matrix(df, ord_covariates, unord_covariates):
+    """Ordered covariates and one indicator column per level of the unordered ones (e.g. 'NATION=2'), column-major"""
+    levels = [pd.get_dummies(df[col].astype('category'), prefix=col, prefix_sep='=') for col in unord_covariates]
+    table = pd.concat([df[ord_covariates].astype('float64')] + levels, axis=1)
+    return np.asfortranarray(table.to_numpy(dtype=np.float64)), list(table.columns)
+
+
+def ipw_weights(ps, treatment, arms):
+    """Inverse probability weights 1 / P(D=d|X) of the arm d of every row (ATE weights)"""
+    column = np.searchsorted(arms, treatment)
+    return 1 / ps[np.arange(len(ps)), column]
+
+
+def _weighted_moments(x, arm, n_arms, weights, block=1 << 18):
+    """
+    Weighted means and variances per arm, (n_weightings, n_arms, n_covariates).
+
+    All weightings share one pass over x in row blocks: two matrix products per block,
+    without a squared copy of the whole matrix.
+    """
+    w = np.zeros((len(x), len(weights) * n_arms))
+    for k, weight in enumerate(weights):
+        w[np.arange(len(x)), k * n_arms + arm] = weight
+    first, second = np.zeros((w.shape[1], x.shape[1])), np.zeros((w.shape[1], x.shape[1]))
+    for start in range(0, len(x), block):
+        xb, wb = x[start:start + block], w[start:start + block]
+        first += wb.T @ xb
+        second += wb.T @ (xb * xb)
+    total = w.sum(axis=0)[:, None]
+    mean = first / total
+    var = np.maximum(second / total - mean ** 2, 0)
+    shape = (len(weights), n_arms, x.shape[1])
+    return mean.reshape(shape), var.reshape(shape)
+
+
+def _ks(x, arm, n_arms, weights, pairs, max_levels=10_000):
+    """
+    Weighted Kolmogorov-Smirnov statistic of every pair of arms, (n_weightings, n_pairs, n_covariates).
+
+    Integer-valued covariates with at most max_levels distinct values (indicators, age,
+    employment states) get the cdfs of all arms from one weighted bincount over
+    (value, arm); the others from one sort that all weightings share.
+    """
+    # every row counts with its weight as a share of its arm's total
+    weights = [w / np.bincount(arm, weights=w, minlength=n_arms)[arm] for w in weights]
+    treated, control = np.array(pairs).T
+    ks = np.empty((len(weights), len(pairs), x.shape[1]))
+    for j in range(x.shape[1]):
+        values = x[:, j]
+        low, high = values.min(), values.max()
+        if high - low < max_levels and np.array_equal(values, np.round(values)):
+            cell = (values - low).astype(np.int64) * n_arms + arm
+            size = (int(high - low) + 1) * n_arms
+            for k, w in enumerate(weights):
+                cdf = np.cumsum(np.bincount(cell, weights=w, minlength=size).reshape(-1, n_arms), axis=0)
+                ks[k, :, j] = np.abs(cdf[:, treated] - cdf[:, control]).max(axis=0)
+            continue
+        order = np.argsort(values, kind='stable')
+        sorted_values, sorted_arm = values[order], arm[order]
+        # the empirical cdfs are only compared after the last row of each tied value
+        last = np.append(sorted_values[1:] != sorted_values[:-1], True)
+        for k, w in enumerate(weights):
+            mass = np.zeros((len(values), n_arms))
+            mass[np.arange(len(values)), sorted_arm] = w[order]
+            cdf = np.cumsum(mass, axis=0)[last]
+            ks[k, :, j] = np.abs(cdf[:, treated] - cdf[:, control]).max(axis=0)
+    return ks
+
+
+def balance_diagnostics(df, covariates, weights=None):
+    """
+    Covariate balance of every pair of treatment arms, unweighted and (if given) weighted.
+
+    For every covariate (unordered ones as one indicator per level) the table has the
+    standardized mean difference, the variance ratio and the Kolmogorov-Smirnov
+    statistic. The moments of all arms come from a few matrix products over the
+    covariate matrix. The SMD always divides by the unweighted standard deviations, so
+    weighting only changes it through the means.
+
+    Args:
+        df (pandas.DataFrame): The sample
+        covariates (dict): 'treatment', 'ord_covariates' and 'unord_covariates' of parameter.json
+        weights (numpy.ndarray): Row weights, e.g. ipw_weights or matching weights; None for unweighted only
+
+    Returns:
+        pandas.DataFrame: weighting, effect (e.g. '1vs0'), covariate, smd, variance_ratio, ks
+    """
+    x, names = covariate_matrix(df, covariates['ord_covariates'], covariates['unord_covariates'])
+    arms, arm = np.unique(df[covariates['treatment']].to_numpy(), return_inverse=True)
+    pairs = [(t, c) for c, t in itertools.combinations(range(len(arms)), 2)]
+    treated, control = np.array(pairs).T
+
+    samples = {'unweighted': np.ones(len(df))}
+    if weights is not None:
+        samples['weighted'] = np.asarray(weights, dtype=np.float64)
+    mean, var = _weighted_moments(x, arm, len(arms), list(samples.values()))
+    # the KS statistic of an indicator is the difference of its shares, no cdf needed
+    n_ord = len(covariates['ord_covariates'])
+    ks = np.abs(mean[:, treated] - mean[:, control])
+    ks[:, :, :n_ord] = _ks(x[:, :n_ord], arm, len(arms), list(samples.values()), pairs)
+    raw_std = np.sqrt(var[0])
+
+    effects = [f'{arms[t]}vs{arms[c]}' for t, c in pairs]
+    tables = []
+    for k, weighting in enumerate(samples):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table = {
+                'smd': smd({'mean': mean[k, treated], 'std': raw_std[treated]},
+                           {'mean': mean[k, control], 'std': raw_std[control]}),
+                'variance_ratio': var[k, treated] / var[k, control],
+                'ks': ks[k],
+            }
+        tables.append(pd.DataFrame({
+            'weighting': weighting,
+            'effect': np.repeat(effects, len(names)),
+            'covariate': np.tile(names, len(pairs)),
+            **{key: value.ravel() for key, value in table.items()},
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+
+def run_balance(df, covariates, path='output_data/balance.csv'):
+    """Balance of the sample without and with inverse probability weights, written to path"""
+    treatment = df[covariates['treatment']].to_numpy()
+    weights = ipw_weights(propensity_matrix(df, covariates), treatment, np.unique(treatment))
+    table = balance_diagnostics(df, covariates, weights)
+    table.to_csv(path, index=False)
+    worst = table.assign(abs_smd=table['smd'].abs()).groupby('weighting')['abs_smd'].max()
+    print(f"Largest |SMD|: {', '.join(f'{key} {value:.3f}' for key, value in worst.items())}, balance saved to {path}")
+    return table
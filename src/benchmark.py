@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+
+import pandas as pd
+
+from config import load_config
+from profiling import Profiler
+from synthetic_data import write_synthetic_csv
+
+BENCHMARK_DIR = '.benchmark'
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# the treatment effect benchmark fits the forests on a subsample of the preprocessed data
+TREATMENT_EFFECT_ROWS = 2000
+
+
+def bench_convert_csv(data):
+    """Cold load: parse the csv and write its columnar cache, as the first load_data of a new file does"""
+    from data_cache import build_cache
+    build_cache(data['csv_path'], os.path.abspath('cache_entry'))
+
+
+def bench_load_data(data):
+    """Warm load: memory-map the columns from the cache prepare_data built"""
+    from main_data_preprocess import load_data, raw_columns
+    load_data(data['csv_path'], columns=raw_columns(data['csv_path']))
+
+
+def bench_preprocess_data(data):
+    from main_data_preprocess import preprocess_data
+    preprocess_data(data['raw'])
+
+
+def bench_sample_statistics(data):
+    from sample_statistics import sample_statistics
+    sample_statistics(data['preprocessed'])
+
+
+def bench_propensity_score(data):
+    from propensity_score import propensity_score
+    propensity_score(data['preprocessed'], data['covariates'])
+
+
+def bench_plots(data):
+    from plot_by_region import plot_by_region
+    from plot_ptype import plot_ptype
+    plot_ptype(data['preprocessed'])
+    plot_by_region(data['preprocessed'])
+
+
+def bench_treatment_effect(data):
+    from treatment_effect import run_treatment_effect_analysis
+    df = data['preprocessed']
+    run_treatment_effect_analysis(df.sample(min(len(df), TREATMENT_EFFECT_ROWS), random_state=0), max_workers=1)
+
+
+BENCHMARKS = {
+    'convert_csv': bench_convert_csv,
+    'load_data': bench_load_data,
+    'preprocess_data': bench_preprocess_data,
+    'sample_statistics': bench_sample_statistics,
+    'propensity_score': bench_propensity_score,
+    'plots': bench_plots,
+    'treatment_effect': bench_treatment_effect,
+}
+
+
+@contextlib.contextmanager
+def _workdir():
+    """
+    Run in an empty working directory with the parameter file, so the outputs of the stages
+    don't overwrite output_data and no cache (plots, propensity model) survives a repeat
+    """
+    root = os.getcwd()
+    workdir = os.path.join(BENCHMARK_DIR, 'run')
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(os.path.join(workdir, 'output_data'))
+    os.chdir(workdir)
+    try:
+        yield
+    finally:
+        os.chdir(root)
+
+
+def prepare_data(rows, seed=0):
+    """Synthetic csv (generated once per size and seed), the raw data and the preprocessed sample"""
+    from main_data_preprocess import load_data, preprocess_data, raw_columns
+
+    csv_path = os.path.abspath(os.path.join(BENCHMARK_DIR, 'data', f'synthetic_{rows}_{seed}.csv'))
+    if not os.path.exists(csv_path):
+        write_synthetic_csv(csv_path, rows, seed)
+    data = {'csv_path': csv_path, 'raw': load_data(csv_path, columns=raw_columns(csv_path)),
+            'covariates': load_config().covariates}
+    with _workdir(), contextlib.redirect_stdout(io.StringIO()):
+        data['preprocessed'] = preprocess_data(data['raw'])
+    return data
+
+
+def run_benchmarks(rows=(10_000,), names=None, repeat=3, seed=0):
+    """
+    Time the benchmarks on synthetic data of every size in rows.
+
+    Every repeat runs in a fresh working directory below BENCHMARK_DIR with the output of
+    the stages discarded. The best wall and CPU time of the repeats and the highest
+    peak RSS (see profiling.Profiler) are reported.
+
+    Returns:
+        dict: '<benchmark>@<rows>' -> wall_s, cpu_s, peak_rss_mb
+    """
+    names = list(BENCHMARKS) if names is None else names
+    results = {}
+    for n in rows:
+        data = prepare_data(n, seed)
+        for name in names:
+            records = []
+            for _ in range(repeat):
+                with _workdir(), Profiler(sample_interval=0.01) as profiler, contextlib.redirect_stdout(io.StringIO()):
+                    with profiler.stage(name) as record:
+                        BENCHMARKS[name](data)
+                records.append(record)
+            results[f'{name}@{n}'] = {
+                'wall_s': min(record['wall_s'] for record in records),
+                'cpu_s': min(record['cpu_s'] for record in records),
+                'peak_rss_mb': max(record['peak_rss_mb'] for record in records),
+            }
+            print(f"{name}@{n}: {results[f'{name}@{n}']['wall_s']:.3f} s", file=sys.stderr)
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    """The stored baseline: 'machine' (see save_baseline) and 'results', empty without a baseline"""
+    if not os.path.exists(path):
+        return {'machine': {}, 'results': {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    """
+    Store the results (merged into the existing baseline) together with a description of the machine.
+
+    The baseline has to cover every benchmark at every size it holds, and it is only
+    recorded on a machine with more than one core: the forests, folds and plots run in
+    parallel, so a single-core baseline says nothing about them.
+    """
+    cpus = os.cpu_count() or 1
+    if cpus < 2:
+        raise ValueError("Record the baseline on a multi-core machine, the parallel stages need more than one core")
+    stored = load_baseline(path)
+    baseline = stored['results'] if stored['machine'].get('cpus') == cpus else {}
+    baseline.update(results)
+    sizes = sorted({int(key.split('@')[1]) for key in baseline})
+    missing = [f'{name}@{n}' for n in sizes for name in BENCHMARKS if f'{name}@{n}' not in baseline]
+    if missing:
+        raise ValueError(f"The baseline would be incomplete, also run: {', '.join(missing)}")
+    machine = {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': cpus,
+               'pandas': pd.__version__}
+    with open(path, 'w') as f:
+        json.dump({'machine': machine, 'results': baseline}, f, indent=2, sort_keys=True)
+    print(f'Baseline saved to {path}')
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Table of the results against the baseline (see load_baseline); a benchmark regressed if
+    its wall time exceeds the baseline by more than tolerance (a share, 0.25 = 25%). Timings
+    of a machine with another number of cores are shown but never count as a regression.
+    """
+    comparable = baseline['machine'].get('cpus') == os.cpu_count()
+    if baseline['results'] and not comparable:
+        print(f"The baseline was recorded with {baseline['machine'].get('cpus')} cores, this machine has "
+              f"{os.cpu_count()}: no regression check", file=sys.stderr)
+    baseline = baseline['results']
+    rows = []
+    for key, result in results.items():
+        base = baseline.get(key, {}).get('wall_s')
+        ratio = result['wall_s'] / base if base else float('nan')
+        rows.append({'benchmark': key, 'wall_s': result['wall_s'], 'cpu_s': result['cpu_s'],
+                     'peak_rss_mb': result['peak_rss_mb'], 'baseline_s': base, 'ratio': ratio,
+                     'regression': comparable and bool(base) and ratio > 1 + tolerance})
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the pipeline stages on synthetic data and compare to the stored baseline')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000], help='data sizes, e.g. 10000 100000 1000000')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=None, help='run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats per benchmark, the best time counts')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.rows, args.only, args.repeat, args.seed)
+    table = compare(results, load_baseline(), args.tolerance)
+    print(table.to_string(index=False, float_format='{:.3f}'.format))
+    if args.save_baseline:
+        save_baseline(results)
+    elif table['regression'].any():
+        print(f"Slower than the baseline: {', '.join(table.loc[table['regression'], 'benchmark'])}")
+        sys.exit(1)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from propensity_score import propensity_matrix
+from sample_selection import SelectionStep, run_selection
+
+# used when parameter.json has no "common_support" entry
+DEFAULT_SUPPORT = {'rule': 'minmax', 'low': 0.01, 'high': 0.99, 'min_overlap': 0.01}
+RULES = ['minmax', 'threshold', 'overlap', 'none']
+
+
+def support_mask(ps, treatment, rule='minmax', low=0.01, high=0.99, min_overlap=0.01):
+    """
+    Mask of the rows on the common support of all treatment arms.
+
+    Args:
+        ps (numpy.ndarray): Propensity matrix (n, k), column j is P(D=j|X) (see propensity_matrix)
+        treatment (numpy.ndarray): Treatment of each row, the values 0 .. k-1
+        rule (str): 'minmax': every P(D=j|X) lies within the range of P(D=j|X) in every arm,
+            i.e. above the largest arm minimum and below the smallest arm maximum (the rule of mcf);
+            'threshold': every P(D=j|X) lies in [low, high];
+            'overlap': the generalized overlap weight 1 / sum_j 1 / P(D=j|X) is at least min_overlap;
+            'none': keep all rows
+        low, high (float): Bounds of the threshold rule
+        min_overlap (float): Bound of the overlap rule
+
+    Returns:
+        numpy.ndarray: Boolean mask of the rows to keep
+    """
+    if rule == 'none':
+        return np.ones(len(ps), dtype=bool)
+    if rule == 'threshold':
+        return ((ps >= low) & (ps <= high)).all(axis=1)
+    if rule == 'overlap':
+        with np.errstate(divide='ignore'):
+            return 1 / (1 / ps).sum(axis=1) >= min_overlap
+    if rule == 'minmax':
+        bounds = pd.DataFrame(ps).groupby(treatment).agg(['min', 'max'])
+        lower = bounds.xs('min', axis=1, level=1).max().to_numpy()
+        upper = bounds.xs('max', axis=1, level=1).min().to_numpy()
+        return ((ps >= lower) & (ps <= upper)).all(axis=1)
+    raise ValueError(f"Unknown common support rule '{rule}', choose from {', '.join(RULES)}")
+
+
+def trim_common_support(df, covariates, support=None, path='output_data/common_support.txt'):
+    """
+    Keep the rows of df on the common support of the propensity scores.
+
+    The sample sizes before and after trimming and the rows removed per treatment arm are
+    written to their own report (in the format of sample_sizes.txt), which is rewritten on
+    every run.
+
+    Args:
+        df (pandas.DataFrame): The preprocessed sample
+        covariates (dict): 'treatment', 'ord_covariates' and 'unord_covariates' of parameter.json
+        support (dict): 'rule', 'low', 'high' and 'min_overlap' (see support_mask),
+            missing entries are taken from DEFAULT_SUPPORT
+
+    Returns:
+        pandas.DataFrame: The rows on the common support
+    """
+    support = {**DEFAULT_SUPPORT, **(support or {})}
+    ps = propensity_matrix(df, covariates)
+    treatment = df[covariates['treatment']].to_numpy()
+    label = f"After trimming to common support ({support['rule']})"
+    trimmed, ledger = run_selection(df, [SelectionStep(
+        label, lambda df, alive, columns: support_mask(ps, treatment, support['rule'], support['low'],
+                                                       support['high'], support['min_overlap']))])
+
+    removed = pd.Series(treatment[~ledger.alive()]).value_counts().reindex(np.unique(treatment), fill_value=0)
+    per_arm = ', '.join(f'{arm}: {n}' for arm, n in removed.items())
+    ledger.write(path)
+    with open(path, 'a') as f:
+        f.write(f"Removed off support per {covariates['treatment']}: {per_arm}\n")
+    print(f'{len(df) - len(trimmed)} of {len(df)} rows are off the common support ({per_arm}), '
+          f'sample sizes saved to {path}')
+    return trimmed
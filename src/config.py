@@ -0,0 +1,123 @@
+import functools
+import json
+import os
+from dataclasses import dataclass, field
+
+from outcomes import panel_columns
+from plot_summary import PTYPE_BOX_COLUMNS, PTYPE_COUNT_COLUMNS, REGION_MEAN_COLUMNS
+from regional_imputation import REGIONAL_COLUMNS
+
+# parameter.json is looked up next to the modules, so the pipeline can run with any working directory (see main.py --output-dir)
+PARAMETER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parameter.json')
+
+# raw columns the preprocessing needs besides the model variables: the sample selection filters,
+# the distribution check, the regional imputation and the panels the outcomes are computed from
+PREPROCESS_COLUMNS = (['PERS', 'PTYPE', 'C_T1', 'C_T2', 'C_T3', 'C_T4', 'AGE', 'VOC_DEG', 'SCHOOL', 'SEX', 'REGION']
+                      + REGIONAL_COLUMNS + panel_columns('EARNX') + panel_columns('EMPLX'))
+# columns of the descriptive stages that are not model variables; the model stages use the
+# treatment, covariates, Z variables and outcomes, sample_statistics describes every column it gets
+STAGE_COLUMNS = {
+    'plot_ptype': ['PTYPE', 'REGION'] + PTYPE_COUNT_COLUMNS + PTYPE_BOX_COLUMNS,
+    'plot_by_region': ['REGION'] + REGION_MEAN_COLUMNS,
+}
+MODEL_STAGES = ['propensity_score', 'common_support', 'matching', 'aipw', 'balance', 'treatment_effect']
+
+# optional sections of parameter.json and the entries they may set
+OPTIONAL_SECTIONS = {
+    'common_support': {'rule', 'low', 'high', 'min_overlap'},
+    'matching': {'metric', 'method', 'n_neighbors', 'caliper', 'replace'},
+}
+
+
+def _names(value):
+    return [value] if isinstance(value, str) else list(value)
+
+
+@dataclass
+class Config:
+    """The model specification of parameter.json, validated (see Config.from_dict)"""
+    treatment: str
+    ord_covariates: list
+    unord_covariates: list
+    ord_z: list
+    unord_z: list
+    outcome_variables: list
+    common_support: dict = field(default_factory=dict)
+    matching: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, parameter):
+        """
+        Check the entries of a parameter dict and build the Config.
+
+        The variable entries must be column names (unord_Z may be a single name) and the
+        optional sections may only set the entries their stage knows; every problem is
+        reported in one ValueError.
+        """
+        errors = []
+        for key in ['treatment', 'ord_covariates', 'unord_covariates', 'ord_Z', 'unord_Z', 'outcome_variables']:
+            value = parameter.get(key)
+            single = key == 'treatment' or (key == 'unord_Z' and isinstance(value, str))
+            if value is None:
+                errors.append(f"'{key}' is missing")
+            elif single and not (isinstance(value, str) and value):
+                errors.append(f"'{key}' must be a column name")
+            elif not single and not (isinstance(value, list) and all(isinstance(v, str) and v for v in value)):
+                errors.append(f"'{key}' must be a list of column names")
+        for key, allowed in OPTIONAL_SECTIONS.items():
+            section = parameter.get(key, {})
+            if not isinstance(section, dict):
+                errors.append(f"'{key}' must be an object")
+            elif set(section) - allowed:
+                errors.append(f"'{key}' has unknown entries {sorted(set(section) - allowed)}, "
+                              f"choose from {', '.join(sorted(allowed))}")
+        unknown = set(parameter) - {'treatment', 'ord_covariates', 'unord_covariates', 'ord_Z', 'unord_Z',
+                                    'outcome_variables'} - set(OPTIONAL_SECTIONS)
+        if unknown:
+            errors.append(f"unknown entries {sorted(unknown)}")
+        if errors:
+            raise ValueError(f"Invalid parameter.json: {'; '.join(errors)}")
+
+        return cls(treatment=parameter['treatment'], ord_covariates=list(parameter['ord_covariates']),
+                   unord_covariates=list(parameter['unord_covariates']), ord_z=list(parameter['ord_Z']),
+                   unord_z=_names(parameter['unord_Z']), outcome_variables=list(parameter['outcome_variables']),
+                   common_support=dict(parameter.get('common_support', {})),
+                   matching=dict(parameter.get('matching', {})))
+
+    @property
+    def covariates(self):
+        """'treatment', 'ord_covariates' and 'unord_covariates', as taken by propensity_matrix and the stages after it"""
+        return {'treatment': self.treatment, 'ord_covariates': self.ord_covariates,
+                'unord_covariates': self.unord_covariates}
+
+    @property
+    def x(self):
+        """All covariates"""
+        return self.ord_covariates + self.unord_covariates
+
+    @property
+    def z(self):
+        """All Z variables (the GATE variables)"""
+        return self.ord_z + self.unord_z
+
+    def columns(self, stages=None):
+        """
+        The columns the preprocessing and the given stages (None for all of them) need, in a stable order.
+
+        Model variables that are computed during preprocessing (the outcomes, EARNX1 and
+        EARNX2) are included, so callers intersect the list with the columns of the file.
+        """
+        stages = list(STAGE_COLUMNS) + MODEL_STAGES if stages is None else stages
+        columns = list(PREPROCESS_COLUMNS)
+        if any(stage in MODEL_STAGES for stage in stages):
+            columns += [self.treatment] + self.x + self.z + self.outcome_variables
+        for stage in stages:
+            columns += STAGE_COLUMNS.get(stage, [])
+        return list(dict.fromkeys(columns))
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(path=PARAMETER_PATH):
+    """The validated Config of parameter.json, read once per process"""
+    with open(path, 'r') as f:
+        return Config.from_dict(json.load(f))
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# explicit compact dtypes for the raw register columns,
+# everything else keeps the dtype pandas infers from the csv
+INT8_PATTERN = re.compile(r'^(EMPLX\d_\d|PTYPE)$')
+INT16_PATTERN = re.compile(r'^REGION$')
+FLOAT32_PATTERN = re.compile(r'^(EARN_X0|EARNX\d_\d)$')
+
+CACHE_VERSION = 1
+
+
+def target_dtype(col):
+    """Return the compact dtype a raw column is stored with, or None to keep the parsed dtype"""
+    if INT8_PATTERN.match(col):
+        return np.int8
+    if INT16_PATTERN.match(col):
+        return np.int16
+    if FLOAT32_PATTERN.match(col):
+        return np.float32
+    return None
+
+
+def default_cache_dir(csv_path):
+    """The cache lives in a .cache folder next to the csv"""
+    return os.path.join(os.path.dirname(csv_path), '.cache')
+
+
+def file_hash(csv_path, cache_dir=None):
+    """
+    Return the sha256 of the csv content.
+
+    The hash is remembered in cache_dir/index.json together with the file size and
+    mtime, so an unchanged file is only hashed once.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir(csv_path)
+    stat = os.stat(csv_path)
+    index_path = os.path.join(cache_dir, 'index.json')
+    key = os.path.realpath(csv_path)
+
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    entry = index.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    sha = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    index[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    return digest
+
+
+def csv_columns(csv_path):
+    """The header of a csv, without parsing any rows"""
+    return list(pd.read_csv(csv_path, nrows=0).columns)
+
+
+def _compact(series, dtype):
+    """
+    Convert a parsed column to its compact dtype.
+
+    Returns (values, mask) where mask marks missing entries (None if there are none).
+    Integer targets fall back to the parsed dtype when the values are not whole
+    numbers or do not fit.
+    """
+    mask = series.isna().to_numpy()
+    has_nan = bool(mask.any())
+    if dtype is None or not pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(), None
+
+    if np.issubdtype(dtype, np.integer):
+        values = series.to_numpy(dtype=np.float64, na_value=0)
+        info = np.iinfo(dtype)
+        if np.any(values != np.round(values)) or values.min(initial=0) < info.min or values.max(initial=0) > info.max:
+            return series.to_numpy(), None
+        return values.astype(dtype), (mask if has_nan else None)
+
+    return series.to_numpy(dtype=dtype, na_value=np.nan), None
+
+
+def build_cache(csv_path, entry_dir):
+    """Parse the csv once and write one .npy file per column (plus a null mask where needed) to entry_dir"""
+    df = pd.read_csv(csv_path)
+
+    tmp_dir = entry_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    meta = {'version': CACHE_VERSION, 'n_rows': len(df), 'columns': {}}
+    for i, col in enumerate(df.columns):
+        values, mask = _compact(df[col], target_dtype(col))
+        file_name = f'{i:03d}'
+        np.save(os.path.join(tmp_dir, file_name + '.npy'), values, allow_pickle=values.dtype == object)
+        if mask is not None:
+            np.save(os.path.join(tmp_dir, file_name + '.mask.npy'), mask)
+        meta['columns'][col] = {'file': file_name, 'dtype': values.dtype.str, 'nullable': mask is not None}
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    # publish atomically so a crashed conversion never leaves a half-written entry behind
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def read_cache(entry_dir, columns=None):
+    """
+    Load the requested columns of a cache entry as memory-mapped arrays.
+
+    Integer columns with missing values come back as pandas nullable integers
+    (Int8/Int16) backed by the memory-mapped values and mask.
+    """
+    with open(os.path.join(entry_dir, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+
+    if columns is None:
+        columns = list(meta['columns'])
+    missing = [col for col in columns if col not in meta['columns']]
+    if missing:
+        raise KeyError(f"Columns not in cached data: {missing}")
+
+    data = {}
+    for col in columns:
+        info = meta['columns'][col]
+        path = os.path.join(entry_dir, info['file'])
+        is_object = np.dtype(info['dtype']) == object
+        values = np.load(path + '.npy', mmap_mode=None if is_object else 'r', allow_pickle=is_object)
+        if info['nullable']:
+            mask = np.load(path + '.mask.npy', mmap_mode='r')
+            values = pd.arrays.IntegerArray(values, mask)
+        data[col] = values
+    # copy=False keeps one block per column backed by its memory map; the default would
+    # consolidate the columns into one block per dtype and copy everything into RAM
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def load_cached_csv(csv_path, columns=None, cache_dir=None):
+    """
+    Load a csv through the columnar cache.
+
+    The first call converts the csv into a cache entry keyed on its content hash,
+    later calls only memory-map the requested columns.
+
+    Args:
+        csv_path (str): Path to the raw csv file
+        columns (list): Columns to load, all columns if None
+        cache_dir (str): Cache location, defaults to a .cache folder next to the csv
+
+    Returns:
+        pandas.DataFrame: The requested columns in their compact dtypes
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir(csv_path)
+
+    digest = file_hash(csv_path, cache_dir)
+    entry_dir = os.path.join(cache_dir, digest)
+    if not os.path.exists(os.path.join(entry_dir, 'meta.json')):
+        print(f'Building columnar cache for {csv_path} in {entry_dir}')
+        build_cache(csv_path, entry_dir)
+    return read_cache(entry_dir, columns)
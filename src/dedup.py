@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+INDEX_PATH = 'output_data/pers_index.npz'
+CLUSTER_REPORT_PATH = 'output_data/duplicate_pers.csv'
+
+
+def as_pers(values):
+    """PERS values as an int64 array (the csv round trip of the chunked mode may turn them into floats)"""
+    return np.asarray(values, dtype=np.int64)
+
+
+class PersIndex:
+    """
+    Number of occurrences of every PERS, as sorted unique int64 keys plus counts.
+
+    Lookups are binary searches, so checking n values costs O(n log k) and the index
+    takes 16 bytes per distinct PERS. Counts of chunks or new extracts are added with
+    update; the index is saved as an .npz file.
+    """
+
+    def __init__(self, keys=None, counts=None):
+        self.keys = np.empty(0, dtype=np.int64) if keys is None else keys
+        self.counts = np.empty(0, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def from_values(cls, pers):
+        keys, counts = np.unique(as_pers(pers), return_counts=True)
+        return cls(keys, counts.astype(np.int64))
+
+    def update(self, pers):
+        """Add the occurrences of pers; returns the PERS that were unique before and are duplicated now"""
+        new = PersIndex.from_values(pers)
+        before = self.count(new.keys)
+        keys = np.union1d(self.keys, new.keys)
+        counts = np.zeros(len(keys), dtype=np.int64)
+        counts[np.searchsorted(keys, self.keys)] += self.counts
+        counts[np.searchsorted(keys, new.keys)] += new.counts
+        self.keys, self.counts = keys, counts
+        return new.keys[before == 1]
+
+    def count(self, pers):
+        """Occurrences of each value of pers in the index (0 if unknown)"""
+        pers = as_pers(pers)
+        if len(self.keys) == 0:
+            return np.zeros(len(pers), dtype=np.int64)
+        pos = np.searchsorted(self.keys, pers).clip(max=len(self.keys) - 1)
+        return np.where(self.keys[pos] == pers, self.counts[pos], 0)
+
+    def duplicated(self, pers):
+        """Mask of the values of pers that occur more than once (drop_duplicates keep=False semantics)"""
+        return self.count(pers) > 1
+
+    def clusters(self):
+        """The duplicated PERS and how often each occurs"""
+        duplicated = self.counts > 1
+        return pd.DataFrame({'PERS': self.keys[duplicated], 'count': self.counts[duplicated]})
+
+    def __len__(self):
+        return len(self.keys)
+
+    def save(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, keys=self.keys, counts=self.counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with np.load(path) as data:
+            return cls(data['keys'], data['counts'])
+
+
+def write_cluster_report(index, path=CLUSTER_REPORT_PATH):
+    """Write the duplicate clusters of the index (PERS, count) to a csv and print a summary"""
+    clusters = index.clusters()
+    clusters.to_csv(path, index=False)
+    print(f'{len(clusters)} PERS occur more than once ({int(clusters["count"].sum())} rows), '
+          f'clusters saved to {path}')
+    return clusters
@@ -0,0 +1,211 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from config import load_config
+from dedup import PersIndex, write_cluster_report
+from moments import Moments
+from outcomes import compute_outcomes
+from regional_imputation import REGIONAL_COLUMNS, impute_regional_values, merge_lookups, region_lookup, write_fill_counts
+from sample_selection import as_mask, write_sample_sizes
+from streaming import NanStatistics, _append_csv, _merge, apply_steps
+from plot_by_nan import write_nan_statistics
+from profiling import step as profile_step
+from sample_statistics import write_sample_statistics
+
+STATE_VERSION = 1
+
+
+def _load_state(state_dir):
+    """The persisted counters and statistics of all extracts appended so far, None before the first append"""
+    if not os.path.exists(os.path.join(state_dir, 'state.json')):
+        return None
+    with open(os.path.join(state_dir, 'state.json'), 'r') as f:
+        state = json.load(f)
+    if state['version'] != STATE_VERSION:
+        raise ValueError(f"Incremental state in {state_dir} has version {state['version']}, "
+                         f"expected {STATE_VERSION}; rebuild it by appending the full register to an empty state_dir")
+    with open(os.path.join(state_dir, 'moments.pkl'), 'rb') as f:
+        state['moments'] = pickle.load(f)
+    state['pers_index'] = PersIndex.load(os.path.join(state_dir, 'pers_index.npz'))
+    with np.load(os.path.join(state_dir, 'reached.npz')) as data:
+        state['reached'] = pd.Series(data['reached'], index=data['pers'])
+    return state
+
+
+def _save_state(state, state_dir):
+    os.makedirs(state_dir, exist_ok=True)
+    state['pers_index'].save(os.path.join(state_dir, 'pers_index.npz'))
+    reached = state['reached']
+    np.savez(os.path.join(state_dir, 'reached.npz'), pers=reached.index.to_numpy(np.int64), reached=reached.to_numpy(np.int8))
+    with open(os.path.join(state_dir, 'moments.pkl'), 'wb') as f:
+        pickle.dump(state['moments'], f, protocol=pickle.HIGHEST_PROTOCOL)
+    # state.json last: it marks the state as complete
+    meta = {key: state[key] for key in ['version', 'initial_size', 'labels', 'sizes', 'columns']}
+    with open(os.path.join(state_dir, 'state.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def _last_steps(chunk, steps, alive, columns):
+    """Apply the steps after the duplicate check; returns the surviving mask and how many of them each row passed"""
+    reached = np.zeros(len(chunk), dtype=np.int8)
+    for step in steps:
+        if step.report is not None:
+            step.report(chunk, alive, columns)
+        alive = alive & as_mask(step.mask(chunk, alive, columns))
+        reached += alive
+        columns = [col for col in columns if col not in step.drop_columns]
+    return alive, reached, columns
+
+
+def append_extract(csv_path, state_dir='output_data/incremental', out_path='output_data/preprocessed.csv',
+                   chunksize=100_000, distribution_columns=('AGE', 'SCHOOL', 'SEX'), config=None, columns=None):
+    """
+    Add a new register extract to the preprocessed sample without reprocessing the earlier ones.
+
+    The new rows go through the same steps as preprocess_streaming. The earlier extracts are
+    only represented by the state in state_dir: per-step sample sizes, the mergeable NaN,
+    distribution and per-PTYPE statistics, the PERS index of the duplicate check and, for
+    every PERS that passed it, how many of the later steps its row passed. A PERS of an
+    earlier extract that reappears is removed with keep=False semantics: the sample sizes
+    are corrected from the stored step count, and only if the row is in the final sample
+    out_path is filtered and its statistics are subtracted. All reports are rewritten from
+    the updated state. The first call (empty state_dir) processes the whole file.
+
+    Args:
+        csv_path (str): The new extract, with the columns of the raw csv
+        state_dir (str): Location of the persisted state
+        out_path (str): The preprocessed sample, new rows are appended
+        chunksize (int): Number of rows per chunk
+        distribution_columns (tuple): Columns compared by the distribution check
+        config (Config): The model specification, loaded from parameter.json if None
+        columns (list): Raw columns to read (see raw_columns in main_data_preprocess), all if None
+
+    Returns:
+        str: out_path
+    """
+    # imported here, main_data_preprocess imports this module for main()
+    from main_data_preprocess import selection_steps, write_distribution_comparison, write_nan_percentage
+
+    X = (config or load_config()).x
+
+    nan_stats = NanStatistics(X)
+    steps = [step for step in selection_steps(nan_report=nan_stats) if step.enabled]
+    split = next((i for i, step in enumerate(steps) if not step.row_local), None)
+    if split is None or any(not step.row_local for step in steps[split + 1:]):
+        raise ValueError("The incremental mode expects exactly one non row-local selection step (the duplicate check)")
+    first_steps, last_steps = steps[:split], steps[split + 1:]
+    labels = [step.label for step in steps]
+
+    state = _load_state(state_dir)
+    if state is None:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        state = {'version': STATE_VERSION, 'initial_size': 0, 'labels': labels, 'sizes': [0] * len(steps),
+                 'columns': None, 'moments': {}, 'pers_index': PersIndex(),
+                 'reached': pd.Series(np.empty(0, dtype=np.int8), index=np.empty(0, dtype=np.int64))}
+    elif state['labels'] != labels:
+        raise ValueError("The selection steps changed since the incremental state was built, rebuild it")
+    sizes = np.asarray(state['sizes'], dtype=np.int64)
+    moments = state['moments']
+    pers_index = state['pers_index']
+
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    survivors_path = os.path.join(state_dir, 'delta.pass1.csv')
+    os.makedirs(state_dir, exist_ok=True)
+
+    # regional values of the new extract complete the lookup table of the earlier ones
+    # (rows of earlier extracts are not imputed again)
+    with profile_step('region_lookup'):
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=['REGION'] + REGIONAL_COLUMNS):
+            moments['region_lookup'] = merge_lookups(moments.get('region_lookup'), region_lookup(chunk))
+
+    # pass 1 over the new rows: row-local steps up to the duplicate check
+    n_new = 0
+    n_survivors = 0
+    first = True
+    with profile_step('pass1') as record:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=columns):
+            n_new += len(chunk)
+            moments['raw'] = _merge(moments.get('raw'), Moments.of(chunk, list(distribution_columns)))
+            chunk = pd.concat([chunk, compute_outcomes(chunk)], axis=1)
+            counts = impute_regional_values(chunk, moments['region_lookup'])
+            moments['fill_counts'] = counts.add(moments.get('fill_counts', 0), fill_value=0)
+            alive, chunk_sizes, kept_columns = apply_steps(chunk, first_steps)
+            sizes[:split] += chunk_sizes
+            _append_csv(chunk.loc[alive, kept_columns], survivors_path, first)
+            first = False
+            n_survivors += int(alive.sum())
+        record.update(rows_in=n_new, rows_out=n_survivors)
+    state['initial_size'] += n_new
+    # a csv without rows still yields one empty chunk, so kept_columns is always set
+    final_columns = [col for col in kept_columns if not any(col in step.drop_columns for step in last_steps)]
+    if state['columns'] is not None and final_columns != state['columns']:
+        raise ValueError("The columns of the extract differ from the preprocessed sample (e.g. a changed parameter.json "
+                         "or --project-columns), rebuild the incremental state")
+    state['columns'] = final_columns
+
+    if nan_stats.nan_counts is not None:
+        moments['nan_counts'] = nan_stats.nan_counts.add(moments.get('nan_counts', 0), fill_value=0)
+        moments['nan_rows'] = moments.get('nan_rows', 0) + nan_stats.n_rows
+        moments['nan'] = _merge(moments.get('nan'), nan_stats.nan_moments)
+        moments['no_nan'] = _merge(moments.get('no_nan'), nan_stats.no_nan_moments)
+
+    # duplicate check: only the new PERS are looked up, earlier PERS seen again lose their row
+    with profile_step('duplicates'):
+        new_pers = pd.read_csv(survivors_path, usecols=['PERS'])['PERS']
+        affected = pers_index.update(new_pers)
+        reached = state['reached']
+        affected_reached = reached.reindex(affected).dropna().astype(np.int8)
+        reached = reached.drop(affected_reached.index)
+        sizes[split] -= len(affected_reached)
+        for j in range(len(last_steps)):
+            sizes[split + 1 + j] -= int((affected_reached > j).sum())
+
+        removed = affected_reached.index[affected_reached == len(last_steps)]
+        if len(removed) and os.path.exists(out_path):
+            sample = pd.read_csv(out_path)
+            drop = sample['PERS'].isin(removed)
+            moments['processed'] = moments['processed'].remove(Moments.of(sample[drop], list(distribution_columns)))
+            moments['ptype'] = moments['ptype'].remove(Moments.of(sample[drop], list(sample.columns), by='PTYPE'))
+            sample[~drop].to_csv(out_path, index=False)
+            print(f'Removed {int(drop.sum())} rows of earlier extracts whose PERS reappeared')
+
+    # pass 2 over the new survivors: drop duplicated PERS and apply the remaining steps
+    new_reached = []
+    n_added = 0
+    first = not os.path.exists(out_path)
+    with profile_step('pass2', rows_in=n_survivors) as record:
+        for chunk in pd.read_csv(survivors_path, chunksize=chunksize):
+            kept = ~pers_index.duplicated(chunk['PERS'])
+            sizes[split] += int(kept.sum())
+            alive, chunk_reached, sample_columns = _last_steps(chunk, last_steps, kept, list(chunk.columns))
+            n_added += int(alive.sum())
+            sizes[split + 1:] += [int((kept & (chunk_reached > j)).sum()) for j in range(len(last_steps))]
+            new_reached.append(pd.Series(chunk_reached[kept], index=chunk['PERS'][kept].to_numpy(np.int64)))
+            chunk = chunk.loc[alive, sample_columns]
+            _append_csv(chunk, out_path, first)
+            first = False
+            moments['processed'] = _merge(moments.get('processed'), Moments.of(chunk, list(distribution_columns)))
+            moments['ptype'] = _merge(moments.get('ptype'), Moments.of(chunk, list(chunk.columns), by='PTYPE'))
+        record['rows_out'] = n_added
+    os.remove(survivors_path)
+    state['reached'] = pd.concat([reached] + new_reached)
+    state['sizes'] = sizes.tolist()
+
+    with profile_step('reports'):
+        write_fill_counts(moments['fill_counts'])
+        write_nan_percentage(moments['nan_counts'], moments['nan_rows'])
+        write_nan_statistics(X, moments['nan'], moments['no_nan'])
+        write_sample_sizes("output_data/sample_sizes.txt", state['initial_size'], labels, state['sizes'])
+        print('Sample size information saved to output_data/sample_sizes.txt')
+        write_distribution_comparison(list(distribution_columns), moments['raw'], moments['processed'])
+        write_sample_statistics(state['columns'], moments['ptype'])
+        write_cluster_report(pers_index)
+
+        _save_state(state, state_dir)
+    print(f'Appended {n_new} rows of {csv_path}, the preprocessed sample is in {out_path}')
+    return out_path
@@ -0,0 +1,88 @@
+import argparse
+import os
+
+# pipeline stages in order, and the short names accepted by --stages
+STAGES = ['preprocess', 'sample_statistics', 'propensity_score', 'plot_ptype', 'plot_by_region', 'common_support',
+          'matching', 'aipw', 'balance', 'treatment_effect']
+STAGE_ALIASES = {
+    'stats': ['sample_statistics'],
+    'ps': ['propensity_score'],
+    'plots': ['plot_ptype', 'plot_by_region'],
+    'te': ['treatment_effect'],
+    'all': STAGES,
+}
+
+
+def parse_stages(value):
+    """Comma separated stage names or aliases, e.g. 'preprocess,stats,ps', as a list of STAGES"""
+    stages = []
+    for name in filter(None, (part.strip() for part in value.split(','))):
+        if name not in STAGES and name not in STAGE_ALIASES:
+            raise argparse.ArgumentTypeError(
+                f"unknown stage '{name}', choose from {', '.join(STAGES + list(STAGE_ALIASES))}")
+        stages += [stage for stage in STAGE_ALIASES.get(name, [name]) if stage not in stages]
+    return stages
+
+
+def parse_regions(value):
+    """Comma separated REGION values, e.g. '12,40', as a list of ints"""
+    try:
+        return [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma separated region numbers, got '{value}'")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Preprocess the register data and run the analysis stages')
+    parser.add_argument('--stages', type=parse_stages, default=None,
+                        help='comma separated stages to run, e.g. preprocess,stats,ps (aliases: stats, ps, plots, te, all; '
+                             'default: all). preprocess always runs, and common_support with matching, aipw, balance and treatment_effect, '
+                             'restored from the stage cache when unchanged')
+    parser.add_argument('--input', default='CML_public/West.csv', help='raw register csv')
+    parser.add_argument('--output-dir', default='.',
+                        help='directory that gets output_data/, the output_treatment_effect*/ folders and the stage cache')
+    parser.add_argument('--project-columns', action='store_true',
+                        help='read only the raw columns parameter.json and the stages use; the NaN check of the sample '
+                             'selection then ignores the other columns, which can keep more rows in the sample')
+    parser.add_argument('--partitions', action='store_true',
+                        help='also write the preprocessed sample as REGION partitions to output_data/partitions')
+    parser.add_argument('--regions', type=parse_regions, default=None,
+                        help='comma separated regions, e.g. 12,40: run the stages on the sample of these regions only, '
+                             'read from the partitions (written first if they are missing or out of date); '
+                             'their outputs go to regions=12,40/ in the output directory')
+    parser.add_argument('--stream', action='store_true', help='preprocess the raw csv in chunks (for data larger than RAM)')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='rows per chunk in --stream and --append mode')
+    parser.add_argument('--append', default=None, metavar='CSV',
+                        help='add a new register extract to the persisted preprocessed sample (see incremental.py)')
+    parser.add_argument('--force', action='append', default=[], choices=STAGES + ['all'], metavar='STAGE',
+                        help='recompute STAGE even if it is cached (repeatable, "all" for every stage)')
+    parser.add_argument('--no-stage-cache', action='store_true', help='run every stage without the stage cache')
+    parser.add_argument('--te-workers', type=int, default=2, help='forests (main, placebo) fitted in parallel')
+    parser.add_argument('--cores-per-forest', type=int, default=None, help='processes per forest, default: cores / te-workers')
+    parser.add_argument('--crossfit', type=int, default=None, metavar='K',
+                        help='estimate the treatment effects with K-fold cross-fitting instead of a single 50/50 split')
+    parser.add_argument('--cprofile', action='append', default=[], choices=STAGES, metavar='STAGE',
+                        help='run STAGE under cProfile, stats go to output_data/profile (repeatable)')
+    return parser
+
+
+def cli(argv=None):
+    args = build_parser().parse_args(argv)
+    # paths are resolved before changing into the output directory
+    csv_path = os.path.abspath(args.input)
+    append = os.path.abspath(args.append) if args.append is not None else None
+    os.makedirs(args.output_dir, exist_ok=True)
+    os.chdir(args.output_dir)
+
+    # pandas and the preprocessing modules are only imported once the arguments are valid,
+    # the modules of the other stages when the stage runs
+    from main_data_preprocess import main
+    main(streaming=args.stream, chunksize=args.chunksize, force=args.force, use_stage_cache=not args.no_stage_cache,
+         te_workers=args.te_workers, cores_per_forest=args.cores_per_forest, crossfit_folds=args.crossfit,
+         append=append, cprofile=args.cprofile, csv_path=csv_path, stages=args.stages,
+         project_columns=args.project_columns,
+         partitions=args.partitions, regions=args.regions)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,16 +1,31 @@
+import contextlib
+import functools
+import inspect
 import os
-import requests
+import numpy as np
 import pandas as pd
-from dotenv import load_dotenv
+from config import load_config
+from data_cache import csv_columns, file_hash, load_cached_csv
+from outcomes import compute_outcomes
+from moments import Moments, balance_table
+from dedup import PersIndex, write_cluster_report
+from regional_imputation import impute_regional_values, write_fill_counts
+from profiling import Profiler, step
+from sample_selection import SelectionStep, run_selection
 from sample_statistics import sample_statistics
-from plot_ptype import plot_ptype
-from propensity_score import propensity_score
-from plot_by_region import plot_by_region
+from streaming import preprocess_streaming
+from incremental import append_extract
+from partitions import is_current, read_partitions, regions_dir, write_partitions
+from stage_cache import StageCache
 from plot_by_nan import plot_by_nan
-from treatment_effect import run_treatment_effect_analysis
 
-def load_data(csv_path):
+def load_data(csv_path, columns=None, use_cache=True):
     """
+    Load the raw register data.
+
+    With use_cache the csv is converted once into a columnar cache with compact dtypes
+    (see data_cache.py) and only the requested columns are memory-mapped on later runs.
+
     columns:
     ['PERS', 'AGE', 'SEX', 'SCHOOL', 'VOC_DEG', 'NATION', 'REGION', 'REG_AL', 
     'REG_PRG', 'REG_SER', 'REG_PRO', 'REG_AGRI', 'SECT_AL', 'PROF_AL', 'SPECIA_CW', 
@@ -77,93 +92,73 @@ def load_data(csv_path):
     PROF_AL Unemployment rate in profession of last occupation
     PROF_XL Professional unemployment rate (variable not verified by Section XX.12 of Department
     """
-    df = pd.read_csv(csv_path)
+    if use_cache:
+        return load_cached_csv(csv_path, columns=columns)
+    df = pd.read_csv(csv_path, usecols=columns)
     return df
 
-def preprocess_data(df):
-    # shallow copy df
-    df_shallow = df.copy()
-
-    # Record initial sample size
-    initial_sample_size = len(df_shallow)
-
-    # STEP 0a: calculate the average quarterly earnings for years X1 and X2
-    df_shallow['EARNX1'] = df_shallow[['EARNX1_1', 'EARNX1_2', 'EARNX1_3', 'EARNX1_4']].mean(axis=1)
-    df_shallow['EARNX2'] = df_shallow[['EARNX2_1', 'EARNX2_2', 'EARNX2_3', 'EARNX2_4']].mean(axis=1)
-
-    def compute_salary_outcomes(df):
-        """Compute salary outcomes for each period."""
-        for period in range(3, 10):
-            earnings_cols = [f'EARNX{period}_{quarter}' for quarter in range(1, 5)]
-            df[f'SAL_{period}'] = 3 * df[earnings_cols].sum(axis=1)
-        df['SAL_AVG'] = df[[f'SAL_{period}' for period in range(3, 10)]].mean(axis=1)
-        return df
-
-    def compute_employment_outcomes(df):
-        """Compute employment outcomes including total quarters and changes."""
-        # Get all employment columns
-        empl_cols = [f'EMPLX{period}_{quarter}' 
-                    for period in range(3, 10) 
-                    for quarter in range(1, 5)]
-        
-        # Calculate total quarters of employment
-        df['EMPL_TTL'] = (df[empl_cols]==1).sum(axis=1)
-        
-        # Calculate employment changes
-        is_employed = df[empl_cols].eq(1)
-        transitions_to_employed = is_employed & ~is_employed.shift(axis=1).fillna(False)
-        transitions_from_employed = ~is_employed & is_employed.shift(axis=1).fillna(False)
-        df['EMPL_CHGE'] = transitions_to_employed.sum(axis=1) + transitions_from_employed.sum(axis=1)
-        
-        return df
-
-    # Step 0b: Compute all outcomes
-    df_shallow = compute_salary_outcomes(df_shallow)
-    df_shallow = compute_employment_outcomes(df_shallow)
+def preprocess_data(df, config=None):
+    # STEP 0a/0b: compute the average quarterly earnings for years X1 and X2 and all outcomes
+    # (see outcomes.py); attaching them creates the working copy of df
+    with step('outcomes', rows_in=len(df)):
+        df_shallow = pd.concat([df, compute_outcomes(df)], axis=1)
 
     # Compute mean SAL_AVG for each PTYPE group
     ptype_sal_avg = df_shallow.groupby('PTYPE')['SAL_AVG'].mean()
     print("\nAverage Salary by Program Type:")
     print(ptype_sal_avg)
 
-    # STEP 0c: impute We recognized that we excluded missing observations for the following three variables REG_SER, REG_PRO, and REG_AGRL. However these variables sum up to one and are equal for each region. Instead would you could try, if possible, to just infer the missing values from persons in the same region
-    # Check if any region has more than one missing value among REG_SER, REG_PRO, and REG_AGRI
-    only_one_missing = (df_shallow[['REG_SER', 'REG_PRO', 'REG_AGRI']].isna().sum(axis=1) == 1)
+    # STEP 0c: impute the regional values (sector shares, unemployment rate) from persons in the same region,
+    # see regional_imputation.py
+    with step('impute_regional_values', rows_in=len(df_shallow)):
+        write_fill_counts(impute_regional_values(df_shallow))
 
-    df_shallow['to_be_filled'] = 100 - df_shallow['REG_SER'].fillna(0) - df_shallow['REG_PRO'].fillna(0) - df_shallow['REG_AGRI'].fillna(0)
-    # Create a mask for rows where only one value is missing
-    mask = only_one_missing
-    
-    # Update the values in df_shallow using loc to ensure the changes are made in place
-    df_shallow.loc[mask, 'REG_SER'] = df_shallow.loc[mask, 'REG_SER'].fillna(df_shallow.loc[mask, 'to_be_filled'])
-    df_shallow.loc[mask, 'REG_PRO'] = df_shallow.loc[mask, 'REG_PRO'].fillna(df_shallow.loc[mask, 'to_be_filled'])
-    df_shallow.loc[mask, 'REG_AGRI'] = df_shallow.loc[mask, 'REG_AGRI'].fillna(df_shallow.loc[mask, 'to_be_filled'])
+    # STEP 1-6: sample selection, see selection_steps
+    config = config or load_config()
+    nan_report = functools.partial(record_nan_statistics, covariates=config.x)
+    steps = selection_steps(nan_report)
+    with step('selection', rows_in=len(df_shallow)) as record:
+        df_selected, ledger = run_selection(df_shallow, steps)
+        record['rows_out'] = len(df_selected)
 
-    # Drop the temporary column
-    df_shallow = df_shallow.drop(columns=['to_be_filled'])
-    
-    # STEP 1: drop all the samples that are assigned to a employment program
-    # we are only interested in the effect of training program on the outcome
-    # so we drop all the columns that are related to employement program, i.e. PTYPE=3 and PTYPE=4
-    df_shallow = df_shallow[~df_shallow['PTYPE'].isin([3, 4])]
-    after_step1_size = len(df_shallow)
-    
-    # STEP 2: drop all the samples that are assigned to a cancelled program
-    # our instruction did not talk about why and how the assigned program was cancelled
-    # so we drop all the samples that are assigned to a cancelled program
-    df_shallow = df_shallow[~((df_shallow['C_T1'] == 1) | (df_shallow['C_T2'] == 1) | (df_shallow['C_T3'] == 1) | (df_shallow['C_T4'] == 1))]
-    # afterwards, drop all the columns that are related to cancelled program
-    df_shallow = df_shallow.drop(columns=['C_T1', 'C_T2', 'C_T3', 'C_T4'])
-    after_step2_size = len(df_shallow)
-
-    # STEP 3: record the statistics and drop all the samples that have NaN values
+    # the masks are pure, so the PERS index of the duplicate check (STEP 5) and its cluster
+    # report are written here, from the rows that entered that step (see dedup.py)
+    enabled = [selection_step for selection_step in steps if selection_step.enabled]
+    dedup = next((i for i, selection_step in enumerate(enabled) if selection_step.mask is unique_pers), None)
+    if dedup is not None:
+        with step('pers_index'):
+            pers_index = PersIndex.from_values(df_shallow['PERS'][ledger.alive(dedup)])
+            pers_index.save()
+            write_cluster_report(pers_index)
+    df_shallow = df_selected
+
+    # without missing values the nullable integer columns of the cache can go back to plain numpy dtypes
+    nullable_int_cols = {col: dtype.numpy_dtype for col, dtype in df_shallow.dtypes.items()
+                         if pd.api.types.is_extension_array_dtype(dtype) and pd.api.types.is_integer_dtype(dtype)}
+    df_shallow = df_shallow.astype(nullable_int_cols)
+
+    # Save sample size information to a text file
+    ledger.write("output_data/sample_sizes.txt")
+    print('Sample size information saved to output_data/sample_sizes.txt')
+    return df_shallow    
+
+
+def record_nan_statistics(df, alive, columns, covariates=None):
+    """Write the NaN percentage of every column among the rows still in the sample and plot NaN vs no-NaN rows"""
     # Check which columns have NaN values and count them
-    nan_counts = df_shallow.isna().sum()
+    nan_counts = df.loc[alive, columns].isna().sum()
+    write_nan_percentage(nan_counts, alive.sum())
+
+    plot_by_nan(df, rows=alive, columns=columns, covariates=covariates)
+
+
+def write_nan_percentage(nan_counts, n_rows):
+    """Write the NaN percentage of the columns with at least one NaN to output_data/nan_percentage.txt"""
     # Filter to only show columns with at least one NaN value
     columns_with_nans = nan_counts[nan_counts > 0]
     
     # Calculate percentage of NaN values in each column
-    nan_percentage = round((columns_with_nans / len(df_shallow)) * 100, 2)
+    nan_percentage = round((columns_with_nans / n_rows) * 100, 2)
     # Save NaN percentage information to a text file
     
     os.makedirs("output_data", exist_ok=True)
@@ -171,57 +166,92 @@ def preprocess_data(df):
         for col, value in nan_percentage.items():
             f.write(f"{col:<12} {value}%\n")
     print('NaN percentage information saved to output_data/nan_percentage.txt')
-    
-    # drop NaN values 
-    plot_by_nan(df_shallow)
 
-    df_shallow = df_shallow.dropna()
-    after_step3_size = len(df_shallow)
 
-    # STEP 4: drop all samples that have age not in 30-50 
-    df_shallow = df_shallow[df_shallow['AGE'].isin(range(30, 51))]
-    after_step4_size = len(df_shallow)
+def unique_pers(df, alive, columns):
+    """
+    Mask of the rows whose PERS occurs only once among the rows still in the sample.
 
-    # STEP 5: drop duplicates 
-    df_shallow = df_shallow.drop_duplicates(subset=['PERS'], keep=False)
-    after_step5_size = len(df_shallow)
+    Has no side effects; preprocess_data saves the PERS index of these rows to
+    output_data/pers_index.npz and writes the duplicate clusters (see dedup.py).
+    """
+    index = PersIndex.from_values(df['PERS'][alive])
+    duplicated = np.zeros(len(df), dtype=bool)
+    duplicated[alive] = index.duplicated(df['PERS'][alive])
+    return ~duplicated
 
-    # STEP 6: 
-    # Exclude vocational degree 2 
-    #   for calculating propensity scores, and look for common support
-    #   (i.e. propensity scores and the distribution of the covariates should not be too different between treatment groups)
-    df_shallow = df_shallow.query("VOC_DEG != 2")
-    after_step6_size = len(df_shallow)
 
-    # Save sample size information to a text file
-    with open("output_data/sample_sizes.txt", "w") as f:
-        f.write(f"Initial sample size: {initial_sample_size}\n")
-        f.write(f"After removing employment programs: {after_step1_size}\n")
-        f.write(f"After removing cancelled programs: {after_step2_size}\n")
-        f.write(f"After removing NaN values: {after_step3_size}\n")
-        f.write(f"After removing age not in 30-50: {after_step4_size}\n")
-        f.write(f"After removing duplicates: {after_step5_size}\n")
-        f.write(f"After removing vocational degree 2: {after_step6_size}\n")
-        f.write(f"Total samples removed: {initial_sample_size - after_step6_size}\n")
-        f.write(f"Percentage of samples retained: {round((after_step6_size / initial_sample_size) * 100, 2)}%\n")
-    print('Sample size information saved to output_data/sample_sizes.txt')
-    return df_shallow    
+def selection_steps(nan_report=record_nan_statistics):
+    """
+    The sample selection steps of preprocess_data, in order.
+
+    All steps but STEP 5 are row-local; the duplicate check only looks at the rows
+    that survived the steps before it, so moving it changes the result.
+    nan_report is called with the sample before NaN values are dropped.
+    """
+    return [
+        # STEP 1: drop all the samples that are assigned to a employment program
+        # we are only interested in the effect of training program on the outcome
+        # so we drop all the columns that are related to employement program, i.e. PTYPE=3 and PTYPE=4
+        SelectionStep(
+            "After removing employment programs",
+            lambda df, alive, columns: ~df['PTYPE'].isin([3, 4])),
+        # STEP 2: drop all the samples that are assigned to a cancelled program
+        # our instruction did not talk about why and how the assigned program was cancelled
+        # so we drop all the samples that are assigned to a cancelled program
+        # afterwards, drop all the columns that are related to cancelled program
+        SelectionStep(
+            "After removing cancelled programs",
+            lambda df, alive, columns: ~((df['C_T1'] == 1) | (df['C_T2'] == 1) | (df['C_T3'] == 1) | (df['C_T4'] == 1)),
+            drop_columns=['C_T1', 'C_T2', 'C_T3', 'C_T4']),
+        # STEP 3: record the statistics and drop all the samples that have NaN values
+        SelectionStep(
+            "After removing NaN values",
+            lambda df, alive, columns: ~df[columns].isna().any(axis=1),
+            report=nan_report),
+        # STEP 4: drop all samples that have age not in 30-50 
+        SelectionStep(
+            "After removing age not in 30-50",
+            lambda df, alive, columns: df['AGE'].isin(range(30, 51))),
+        # STEP 5: drop duplicates 
+        SelectionStep(
+            "After removing duplicates",
+            unique_pers,
+            row_local=False),
+        # STEP 6: 
+        # Exclude vocational degree 2 
+        #   for calculating propensity scores, and look for common support
+        #   (i.e. propensity scores and the distribution of the covariates should not be too different between treatment groups)
+        SelectionStep(
+            "After removing vocational degree 2",
+            lambda df, alive, columns: df['VOC_DEG'] != 2),
+    ]
 
 
 def check_distribution(df1, df2, column_names):
     # check the distribution of the two dataframes
     # in terms of mean and standard deviation difference in %
     # for all columns
+    write_distribution_comparison(column_names, Moments.of(df1, column_names), Moments.of(df2, column_names))
+
+def write_distribution_comparison(column_names, df1_moments, df2_moments):
+    """
+    Write the mean/std comparison of the (ungrouped) Moments of both samples to output_data/distribution_comparison.txt,
+    and with counts and the SMD of the preprocessed against the raw data to output_data/distribution_comparison.csv
+    """
+    df1_stats, df2_stats = df1_moments.stats(), df2_moments.stats()
+    balance_table(Moments.concat({'raw': df1_moments, 'preprocessed': df2_moments}), 'raw').to_csv(
+        "output_data/distribution_comparison.csv", index=False)
     results = []
     results.append("Distribution comparison, df1 is raw data, df2 is preprocessed data:")
     for col in column_names:
-        df1_mean = df1[col].mean()
-        df2_mean = df2[col].mean()
+        df1_mean = df1_stats.loc[col, 'mean']
+        df2_mean = df2_stats.loc[col, 'mean']
         mean_diff = abs(df1_mean - df2_mean)
         mean_diff_pct = (mean_diff / df1_mean) * 100 if df1_mean != 0 else 0
         
-        df1_std = df1[col].std()
-        df2_std = df2[col].std()
+        df1_std = df1_stats.loc[col, 'std']
+        df2_std = df2_stats.loc[col, 'std']
         std_diff = abs(df1_std - df2_std)
         std_diff_pct = (std_diff / df1_std) * 100 if df1_std != 0 else 0
         
@@ -233,21 +263,164 @@ def check_distribution(df1, df2, column_names):
             f.write(f"{line}\n")
     print('Distribution comparison saved to output_data/distribution_comparison.txt')
 
-def main():
-    df = load_data("CML_public/West.csv")
-    # print(df.columns.tolist())
+def raw_columns(csv_path, config=None, stages=None):
+    """The columns of the raw csv that the preprocessing and the stages need (see Config.columns), in file order"""
+    needed = set((config or load_config()).columns(stages))
+    return [col for col in csv_columns(csv_path) if col in needed]
+
+
+def run_preprocessing(csv_path, streaming=False, chunksize=100_000, config=None, project_columns=False):
+    """
+    Load and preprocess the raw data and write the sample reports; returns the preprocessed sample.
+
+    Every column is read by default. project_columns reads only the columns some stage needs
+    (see raw_columns); the NaN check of the sample selection then only covers these columns,
+    so rows with missing values in unused columns stay in the sample.
+    """
+    config = config or load_config()
+    # the projection covers all stages, so the sample does not depend on the stages that are selected
+    columns = raw_columns(csv_path, config) if project_columns else None
+    if streaming:
+        # bounded-memory mode: the raw csv is never fully loaded, the reports are
+        # written from chunk statistics and only the (much smaller) final sample is read back
+        out_path = preprocess_streaming(csv_path, chunksize=chunksize, config=config, columns=columns)
+        return pd.read_csv(out_path)
+
+    with step('load_data') as record:
+        df = load_data(csv_path, columns=columns)
+        record['rows_out'] = len(df)
+
+    with step('preprocess_data', rows_in=len(df)) as record:
+        df_preprocessed = preprocess_data(df, config)
+        record['rows_out'] = len(df_preprocessed)
+    with step('check_distribution'):
+        check_distribution(df, df_preprocessed, ['AGE', 'SCHOOL', 'SEX'])
+    return df_preprocessed
+
+def main(streaming=False, chunksize=100_000, force=(), use_stage_cache=True, te_workers=2, cores_per_forest=None, crossfit_folds=None,
+         append=None, cprofile=(), csv_path="CML_public/West.csv", stages=None, project_columns=False,
+         partitions=False, regions=None):
+    """
+    Run the pipeline stages (see main.py for the command line).
+
+    stages selects the stages after preprocess (None runs all of them); preprocess always
+    runs because the other stages need its output, as does common_support for
+    matching, aipw, balance and treatment_effect; both are restored from the stage cache when unchanged. The modules of a stage are imported when it runs, so e.g. mcf is
+    only loaded for the treatment effects and matplotlib only for the plots. parameter.json
+    is loaded and validated once and its Config is passed to every stage.
+
+    partitions writes the preprocessed sample as REGION partitions (see partitions.py).
+    regions restricts every stage to the sample of these regions, read from the partitions:
+    when they were written from the same preprocessing inputs the raw data is not touched,
+    otherwise the sample is preprocessed and partitioned first. The preprocessing outputs
+    stay in output_data, the outputs of the other stages go to regions_dir(regions).
+    """
+    selected = lambda stage: stages is None or stage in stages
+    run_dir = '.' if regions is None else regions_dir(regions)
+    os.makedirs('output_data', exist_ok=True)
+    os.makedirs(os.path.join(run_dir, 'output_data'), exist_ok=True)
+    config = load_config()
+    covariates = config.covariates
+
+    # wall time, CPU time, memory and rows of every stage and sub-step go to output_data/profile (see profiling.py)
+    with Profiler(out_dir=os.path.join(run_dir, 'output_data', 'profile'), cprofile_stages=cprofile) as profiler:
+        # every stage is keyed on its input data, the parameters it uses and the source of its modules,
+        # so only stages whose inputs or code changed are recomputed (see stage_cache.py);
+        # regional runs share the cache of the national one
+        cache = StageCache(cache_dir=os.path.abspath('.stage_cache'), force=force, enabled=use_stage_cache)
+        modules = lambda *funcs: [inspect.getmodule(func) for func in funcs]
+
+        preprocess_key_inputs = (file_hash(csv_path), streaming, chunksize, project_columns)
+        preprocess_modules = modules(run_preprocessing, load_cached_csv, compute_outcomes, run_selection, plot_by_nan,
+                                     preprocess_streaming, sample_statistics, load_config)
+        # the partitions remember the preprocessing they were written from; appended samples have no such key
+        source = None if append is not None else cache.key('preprocess', preprocess_key_inputs, config, preprocess_modules)
+        if regions is not None and is_current(source) and not {'preprocess', 'all'} & set(force):
+            # per-region runs read only the partitions of their regions instead of the national sample
+            with step('read_partitions') as record:
+                df_preprocessed = read_partitions(regions=regions)
+                record['rows_out'] = len(df_preprocessed)
+        else:
+            if append is not None:
+                # the incremental state is updated in place, so this stage bypasses the stage cache
+                with step('preprocess') as record:
+                    columns = raw_columns(append, config) if project_columns else None
+                    df_preprocessed = pd.read_csv(append_extract(append, chunksize=chunksize, config=config, columns=columns))
+                    record['rows_out'] = len(df_preprocessed)
+            else:
+                df_preprocessed = cache.run(
+                    'preprocess', run_preprocessing, inputs=(csv_path, streaming, chunksize, config, project_columns),
+                    key_inputs=preprocess_key_inputs, params=config, modules=preprocess_modules,
+                    output_dirs=['output_data'])
+            if partitions or regions is not None:
+                # written outside the stage cache, so no cache entry stores a copy of the sample
+                if not is_current(source):
+                    with step('write_partitions', rows_in=len(df_preprocessed)):
+                        write_partitions(df_preprocessed, source=source)
+                if regions is not None:
+                    with step('read_partitions') as record:
+                        df_preprocessed = read_partitions(regions=regions)
+                        record['rows_out'] = len(df_preprocessed)
 
-    df_preprocessed = preprocess_data(df)
-    check_distribution(df, df_preprocessed, ['AGE', 'SCHOOL', 'SEX'])
+        # the stages of a regional run write to their own directory, e.g. regions=12,40/output_data,
+        # so they do not overwrite the outputs of the national sample
+        with contextlib.chdir(run_dir):
+            print(df_preprocessed.head())
+            print(df_preprocessed.shape)
 
-    print(df_preprocessed.head())
-    print(df_preprocessed.shape)
+            if selected('sample_statistics') and (regions is not None or not streaming and append is None):
+                # the chunked and incremental preprocessing already wrote the statistics of the whole sample
+                cache.run('sample_statistics', sample_statistics, inputs=(df_preprocessed,),
+                          modules=modules(sample_statistics), output_dirs=['output_data'])
+            if selected('propensity_score'):
+                from propensity_score import propensity_score
+                cache.run('propensity_score', propensity_score, inputs=(df_preprocessed, covariates),
+                          modules=modules(propensity_score), output_dirs=['output_data'])
+            if selected('plot_ptype'):
+                from plot_ptype import plot_ptype
+                cache.run('plot_ptype', plot_ptype, inputs=(df_preprocessed,),
+                          modules=modules(plot_ptype), output_dirs=['output_data'])
+            if selected('plot_by_region'):
+                from plot_by_region import plot_by_region
+                cache.run('plot_by_region', plot_by_region, inputs=(df_preprocessed,),
+                          modules=modules(plot_by_region), output_dirs=['output_data'])
+            if any(selected(stage) for stage in ['common_support', 'matching', 'aipw', 'balance', 'treatment_effect']):
+                # the forests are only fitted on the rows on the common support of the propensity scores
+                from common_support import trim_common_support
+                from propensity_score import propensity_matrix
+                df_supported = cache.run('common_support', trim_common_support,
+                                         inputs=(df_preprocessed, covariates, config.common_support),
+                                         modules=modules(trim_common_support, propensity_matrix), output_dirs=['output_data'])
+            if selected('matching'):
+                from matching import run_matching
+                cache.run('matching', run_matching,
+                          inputs=(df_supported, covariates, config.outcome_variables, config.matching),
+                          modules=modules(run_matching, propensity_matrix), output_dirs=['output_data'])
+            if selected('aipw'):
+                # fast doubly robust estimates, to screen specifications before fitting the forests
+                from aipw import run_aipw
+                cache.run('aipw', run_aipw, inputs=(df_supported, config),
+                          modules=modules(run_aipw), output_dirs=['output_data'])
+            if selected('balance'):
+                from balance import run_balance
+                cache.run('balance', run_balance, inputs=(df_supported, covariates),
+                          modules=modules(run_balance, propensity_matrix), output_dirs=['output_data'])
+            if selected('treatment_effect') and crossfit_folds:
+                from treatment_effect import run_crossfit_analysis
+                cache.run('treatment_effect', functools.partial(run_crossfit_analysis, config=config),
+                          inputs=(df_supported, crossfit_folds, None, cores_per_forest),
+                          key_inputs=(df_supported, crossfit_folds), params=config,
+                          modules=modules(run_crossfit_analysis), output_dirs=['output_treatment_effect_crossfit'])
+            elif selected('treatment_effect'):
+                from treatment_effect import run_treatment_effect_analysis
+                cache.run('treatment_effect', run_treatment_effect_analysis, inputs=(df_supported, te_workers, cores_per_forest, config),
+                          key_inputs=(df_supported,), params=config,
+                          modules=modules(run_treatment_effect_analysis),
+                          output_dirs=['output_treatment_effect', 'output_treatment_effect_placebo'])
+    profiler.write()
 
-    sample_statistics(df_preprocessed)
-    propensity_score(df_preprocessed)
-    plot_ptype(df_preprocessed)
-    plot_by_region(df_preprocessed)
-    run_treatment_effect_analysis(df_preprocessed)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # the command line lives in main.py
+    from main import cli
+    cli()
@@ -0,0 +1,256 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from propensity_score import propensity_matrix
+
+# used when parameter.json has no "matching" entry
+DEFAULT_MATCHING = {'metric': 'propensity', 'method': 'nearest', 'n_neighbors': 1, 'caliper': 0.05, 'replace': True}
+
+
+def pair_score(ps, treated, control):
+    """P(D=treated | X, D in {treated, control}), the balancing score of one pair of arms (Lechner 2001)"""
+    return ps[:, treated] / (ps[:, treated] + ps[:, control])
+
+
+def whiten(x, reference, tol=1e-10):
+    """
+    Transform x so that Euclidean distances are Mahalanobis distances under the covariance of reference.
+
+    Uses the inverse square root from the eigendecomposition of the covariance; directions
+    without variance in reference (e.g. a covariate that is constant in a pair of arms)
+    are dropped, as with the pseudo-inverse, so a singular covariance does not fail.
+    """
+    cov = np.atleast_2d(np.cov(reference, rowvar=False))
+    values, vectors = np.linalg.eigh(cov)
+    keep = values > tol * max(values.max(initial=0), tol)
+    if not keep.any():
+        # no covariate varies, every pair of units is at distance 0
+        return np.zeros((len(x), 1))
+    return x @ (vectors[:, keep] / np.sqrt(values[keep]))
+
+
+def _radius_sorted(score_t, score_c, y_c, caliper):
+    """Radius matching on a 1d score: window sums of the sorted controls from prefix sums, O(n log n)"""
+    order = np.argsort(score_c, kind='stable')
+    sorted_c = score_c[order]
+    lo = np.searchsorted(sorted_c, score_t - caliper, side='left')
+    hi = np.searchsorted(sorted_c, score_t + caliper, side='right')
+    count = hi - lo
+    matched = count > 0
+    cum = np.vstack([np.zeros((1, y_c.shape[1])), np.cumsum(y_c[order], axis=0)])
+    counterfactual = (cum[hi[matched]] - cum[lo[matched]]) / count[matched, None]
+    # each treated unit gives weight 1/count to every control in its window (difference arrays over the sorted
+    # controls), for the variance also the sum of the squared weights
+    weights, weights_sq = np.empty(len(score_c)), np.empty(len(score_c))
+    for target, share in [(weights, 1 / count[matched]), (weights_sq, 1 / count[matched] ** 2)]:
+        diff = np.zeros(len(score_c) + 1)
+        np.add.at(diff, lo[matched], share)
+        np.add.at(diff, hi[matched], -share)
+        target[order] = np.cumsum(diff)[:-1]
+    return matched, counterfactual, weights, weights_sq
+
+
+def _radius_tree(tree, x_t, y_c, caliper):
+    neighbours = tree.query_ball_point(x_t, caliper, workers=-1)
+    count = np.array([len(idx) for idx in neighbours])
+    matched = count > 0
+    flat = np.concatenate([idx for idx in neighbours if idx]).astype(np.int64) if matched.any() else np.empty(0, np.int64)
+    owner = np.repeat(np.arange(matched.sum()), count[matched])
+    share = 1 / np.repeat(count[matched], count[matched])
+    counterfactual = np.zeros((matched.sum(), y_c.shape[1]))
+    np.add.at(counterfactual, owner, y_c[flat] * share[:, None])
+    weights = np.bincount(flat, weights=share, minlength=len(y_c))
+    weights_sq = np.bincount(flat, weights=share ** 2, minlength=len(y_c))
+    return matched, counterfactual, weights, weights_sq
+
+
+def _nearest(tree, x_t, n_control, n_neighbors, caliper):
+    """k nearest controls of every treated unit (with replacement); -1 where none lies within the caliper"""
+    dist, idx = tree.query(x_t, k=n_neighbors, distance_upper_bound=caliper, workers=-1)
+    idx = idx.reshape(len(x_t), -1)
+    return np.where(idx < n_control, idx, -1)
+
+
+def _nearest_without_replacement(tree, x_t, n_control, n_neighbors, caliper):
+    """
+    Greedy matching without replacement: treated units with the closest candidates pick first.
+
+    Candidates come from the KD-tree in growing batches, so a unit whose nearest controls
+    are taken is only queried again with more candidates.
+    """
+    matches = np.full((len(x_t), n_neighbors), -1)
+    found = np.zeros(len(x_t), dtype=np.int64)
+    used = np.zeros(n_control, dtype=bool)
+    pending = np.arange(len(x_t))
+    n_candidates = 4 * n_neighbors
+    while len(pending):
+        k = min(n_candidates, n_control)
+        dist, idx = tree.query(x_t[pending], k=k, distance_upper_bound=caliper, workers=-1)
+        dist, idx = dist.reshape(len(pending), -1), idx.reshape(len(pending), -1)
+        retry = []
+        for row in np.argsort(dist[:, 0], kind='stable'):
+            unit = pending[row]
+            for j in idx[row]:
+                if j == n_control:
+                    # no further control within the caliper
+                    break
+                if not used[j]:
+                    used[j] = True
+                    matches[unit, found[unit]] = j
+                    found[unit] += 1
+                    if found[unit] == n_neighbors:
+                        break
+            else:
+                if k < n_control:
+                    retry.append(unit)
+        pending = np.array(retry, dtype=np.int64)
+        n_candidates *= 4
+    return matches
+
+
+def match_arm(x_t, x_c, y_t, y_c, method='nearest', n_neighbors=1, caliper=None, replace=True):
+    """
+    Match the treated units of one arm to the controls and estimate the ATT.
+
+    Args:
+        x_t, x_c (numpy.ndarray): Matching variables of the treated and the controls, (n, d);
+            a 1d score is passed as (n, 1)
+        y_t, y_c (numpy.ndarray): Outcomes of the treated and the controls, (n, n_outcomes)
+        method (str): 'nearest' (n_neighbors nearest controls) or 'radius' (all controls within the caliper)
+        n_neighbors (int): Controls per treated unit of nearest neighbour matching
+        caliper (float): Largest distance of a match, None for no limit (required for radius matching)
+        replace (bool): Whether a control may be matched to more than one treated unit (nearest only)
+
+    Returns:
+        dict: 'att' and its Abadie-Imbens standard error 'se' per outcome (see abadie_imbens_variance),
+            'matched' (mask over the treated units) and 'control_weights' (how often each control
+            is used, as the sum of its weights)
+    """
+    if method == 'radius' and caliper is None:
+        raise ValueError("Radius matching needs a caliper")
+    if method not in ('nearest', 'radius'):
+        raise ValueError(f"Unknown matching method '{method}', choose from nearest, radius")
+
+    if len(x_t) == 0 or len(x_c) == 0:
+        nan = np.full(y_t.shape[1], np.nan)
+        return {'att': nan, 'se': nan, 'matched': np.zeros(len(x_t), dtype=bool), 'control_weights': np.zeros(len(x_c))}
+    tree = cKDTree(x_c)
+    if method == 'radius' and x_t.shape[1] == 1:
+        matched, counterfactual, weights, weights_sq = _radius_sorted(x_t[:, 0], x_c[:, 0], y_c, caliper)
+    elif method == 'radius':
+        matched, counterfactual, weights, weights_sq = _radius_tree(tree, x_t, y_c, caliper)
+    else:
+        upper = np.inf if caliper is None else caliper
+        find = _nearest if replace else _nearest_without_replacement
+        idx = find(tree, x_t, len(x_c), n_neighbors, upper)
+        valid = idx >= 0
+        count = valid.sum(axis=1)
+        matched = count > 0
+        share = np.where(valid, 1 / np.maximum(count, 1)[:, None], 0)[matched]
+        counterfactual = np.einsum('ik,ikj->ij', share, y_c[np.maximum(idx[matched], 0)])
+        used, used_share = idx[matched][valid[matched]], share[valid[matched]]
+        weights = np.bincount(used, weights=used_share, minlength=len(x_c))
+        weights_sq = np.bincount(used, weights=used_share ** 2, minlength=len(x_c))
+
+    diff = y_t[matched] - counterfactual
+    n_matched = int(matched.sum())
+    if n_matched == 0:
+        nan = np.full(y_t.shape[1], np.nan)
+        return {'att': nan, 'se': nan, 'matched': matched, 'control_weights': weights}
+    att = diff.mean(axis=0)
+    se = np.sqrt(abadie_imbens_variance(diff, att, weights, weights_sq, control_variance(tree, x_c, y_c, weights)))
+    return {'att': att, 'se': se, 'matched': matched, 'control_weights': weights}
+
+
+def control_variance(tree, x_c, y_c, weights):
+    """
+    Conditional outcome variance of the used controls, (y_j - y_l)^2 / 2 with l the closest other control.
+
+    The matching estimator of sigma^2(X) of Abadie and Imbens (2006); unused controls
+    (weight 0) get 0, a single control NaN.
+    """
+    variance = np.zeros(y_c.shape)
+    used = np.flatnonzero(weights > 0)
+    if len(x_c) < 2:
+        variance[used] = np.nan
+        return variance
+    _, idx = tree.query(x_c[used], k=2, workers=-1)
+    # the closest point is usually the control itself, unless another control has the same value
+    other = np.where(idx[:, 0] == used, idx[:, 1], idx[:, 0])
+    variance[used] = (y_c[used] - y_c[other]) ** 2 / 2
+    return variance
+
+
+def abadie_imbens_variance(diff, att, weights, weights_sq, variance):
+    """
+    Variance of the matching ATT that accounts for reused controls (Abadie and Imbens 2006).
+
+    V = (sum_i (diff_i - att)^2 + sum_j (w_j^2 - sum_i s_ij^2) sigma_j^2) / N1^2, with diff_i
+    the matched differences of the N1 matched treated units, s_ij the weight treated unit
+    i gives control j, w_j = sum_i s_ij and sigma_j^2 the conditional variance of control j.
+    A control used by a single treated unit adds nothing, one shared by many adds the
+    covariance between their counterfactuals.
+    """
+    n_matched = len(diff)
+    reuse = (weights ** 2 - weights_sq)[:, None] * variance
+    return (((diff - att) ** 2).sum(axis=0) + reuse.sum(axis=0)) / n_matched ** 2
+
+
+def matching_att(df, covariates, outcomes, options=None, ps=None, control=0):
+    """
+    Matched-sample ATT of every treatment arm against the control arm, for all outcomes.
+
+    With metric 'propensity' each arm is matched on its pair score (see pair_score) from
+    the propensity matrix, with 'mahalanobis' on the ordered covariates of parameter.json
+    (the unordered ones are codes without a distance and are left out). The caliper is in
+    the units of the metric, so a caliper for the pair score is far too tight for
+    Mahalanobis distances.
+
+    Args:
+        df (pandas.DataFrame): The sample, e.g. the rows on the common support
+        covariates (dict): 'treatment', 'ord_covariates' and 'unord_covariates' of parameter.json
+        outcomes (list): Outcome columns
+        options (dict): 'metric', 'method', 'n_neighbors', 'caliper' and 'replace' (see match_arm),
+            missing entries are taken from DEFAULT_MATCHING
+        ps (numpy.ndarray): Propensity matrix of df, computed if None
+        control (int): The control arm
+
+    Returns:
+        pandas.DataFrame: One row per arm and outcome with att, se, n_treated, n_matched and
+            n_controls (controls used at least once)
+    """
+    options = {**DEFAULT_MATCHING, **(options or {})}
+    treatment = df[covariates['treatment']].to_numpy()
+    y = df[outcomes].to_numpy(dtype=np.float64)
+    if options['metric'] == 'propensity' and ps is None:
+        ps = propensity_matrix(df, covariates)
+    elif options['metric'] == 'mahalanobis':
+        x = df[covariates['ord_covariates']].to_numpy(dtype=np.float64)
+    elif options['metric'] != 'propensity':
+        raise ValueError(f"Unknown matching metric '{options['metric']}', choose from propensity, mahalanobis")
+
+    is_control = treatment == control
+    rows = []
+    for arm in np.unique(treatment[~is_control]):
+        is_treated = treatment == arm
+        if options['metric'] == 'propensity':
+            score = pair_score(ps, arm, control)[:, None]
+        else:
+            pair = is_treated | is_control
+            score = whiten(x, x[pair])
+        result = match_arm(score[is_treated], score[is_control], y[is_treated], y[is_control], options['method'],
+                           options['n_neighbors'], options['caliper'], options['replace'])
+        for j, outcome in enumerate(outcomes):
+            rows.append({'arm': arm, 'outcome': outcome, 'att': result['att'][j], 'se': result['se'][j],
+                         'n_treated': int(is_treated.sum()), 'n_matched': int(result['matched'].sum()),
+                         'n_controls': int((result['control_weights'] > 0).sum())})
+    return pd.DataFrame(rows)
+
+
+def run_matching(df, covariates, outcomes, options=None, path='output_data/matching_att.csv'):
+    """Estimate the matched ATTs (see matching_att) and write them to path"""
+    table = matching_att(df, covariates, outcomes, options)
+    table.to_csv(path, index=False)
+    print(f'Matching ATTs saved to {path}')
+    return table
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+
+class Moments:
+    """
+    Count, mean and sum of squared deviations (M2) per group and column.
+
+    Moments of disjoint parts of the data (chunks, worker results) are combined with
+    merge, using the pairwise update of Chan et al., so the variance is as accurate as
+    a two-pass computation instead of relying on sums of squares. Ungrouped moments
+    have a single group called 'all'.
+    """
+
+    def __init__(self, count, mean, m2):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def of(cls, df, columns=None, by=None):
+        """Moments of columns (default: all columns except by) of df per value of by, in one groupby"""
+        if columns is None:
+            columns = [col for col in df.columns if col != by]
+        values = df[list(columns)].astype('float64')
+        keys = df[by].to_numpy() if by is not None else np.zeros(len(df), dtype=np.int8)
+        stats = values.groupby(keys).agg(['count', 'mean', 'var'])
+        if by is None:
+            # keep the single group also for empty data
+            stats = stats.reindex([0])
+        count = stats.xs('count', axis=1, level=1).fillna(0)
+        mean = stats.xs('mean', axis=1, level=1)
+        m2 = stats.xs('var', axis=1, level=1).mul(count - 1).fillna(0)
+        if by is None:
+            count.index = mean.index = m2.index = pd.Index(['all'])
+        else:
+            count.index.name = mean.index.name = m2.index.name = by
+        return cls(count, mean, m2)
+
+    def merge(self, other):
+        """Moments of the union of the data behind self and other"""
+        count_a, count_b = self.count, other.count
+        index = count_a.index.union(count_b.index)
+        columns = count_a.columns.union(count_b.columns, sort=False)
+        align = lambda frame, fill: frame.reindex(index=index, columns=columns).fillna(fill)
+        count_a, count_b = align(count_a, 0), align(count_b, 0)
+        mean_a, mean_b = align(self.mean, 0), align(other.mean, 0)
+        m2_a, m2_b = align(self.m2, 0), align(other.m2, 0)
+
+        count = count_a + count_b
+        share_b = (count_b / count).fillna(0)
+        delta = mean_b - mean_a
+        mean = (mean_a + delta * share_b).where(count > 0)
+        m2 = m2_a + m2_b + delta ** 2 * count_a * share_b
+        return Moments(count, mean, m2)
+
+    def remove(self, other):
+        """Moments of the data behind self without the rows behind other (the inverse of merge)"""
+        other = Moments(*(frame.reindex(index=self.count.index, columns=self.count.columns).fillna(0)
+                          for frame in (other.count, other.mean, other.m2)))
+        count = self.count - other.count
+        mean = ((self.count * self.mean.fillna(0) - other.count * other.mean) / count).where(count > 0)
+        delta = other.mean - mean.fillna(0)
+        m2 = (self.m2 - other.m2 - delta ** 2 * count * (other.count / self.count).fillna(0)).where(count > 0, 0)
+        return Moments(count, mean, m2)
+
+    @classmethod
+    def concat(cls, parts):
+        """Moments with one group per entry of parts (name -> ungrouped Moments)"""
+        stack = lambda attr: pd.concat([getattr(moments, attr).set_axis([name]) for name, moments in parts.items()])
+        return cls(stack('count'), stack('mean'), stack('m2'))
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def var(self, ddof=1):
+        return self.m2 / (self.count - ddof).where(self.count > ddof)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.var(ddof))
+
+    def stats(self, group='all'):
+        """'mean' and 'std' per column of one group, the format of the text reports"""
+        return pd.DataFrame({'mean': self.mean.loc[group], 'std': self.std().loc[group]})
+
+    def to_frame(self):
+        """Long table with one row per group and column: group, column, count, mean, std"""
+        table = pd.concat({'count': self.count, 'mean': self.mean, 'std': self.std()}, axis=1)
+        table = table.stack(level=1, future_stack=True).rename_axis(['group', 'column']).reset_index()
+        return table[['group', 'column', 'count', 'mean', 'std']]
+
+
+def smd(a, b):
+    """
+    Standardized mean difference between two samples given as 'mean'/'std' frames
+    (see Moments.stats): (mean_a - mean_b) / sqrt((var_a + var_b) / 2).
+    """
+    return (a['mean'] - b['mean']) / np.sqrt((a['std'] ** 2 + b['std'] ** 2) / 2)
+
+
+def balance_table(moments, reference):
+    """
+    Moments.to_frame with the SMD of every group against the reference group, per column.
+
+    The SMD is the balance metric of the covariates, e.g. of the treated against the
+    non-treated (PTYPE 0). It is NaN for the reference group itself.
+    """
+    table = moments.to_frame()
+    ref = table[table['group'] == reference].set_index('column')
+    ref_stats = ref.loc[table['column']].set_axis(table.index)
+    table['smd'] = smd(table, ref_stats).where(table['group'] != reference)
+    return table
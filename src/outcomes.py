@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+YEARS = range(1, 10)
+QUARTERS = range(1, 5)
+# outcomes are measured from 19X3 onwards, 19X1 and 19X2 are pre-treatment
+OUTCOME_YEARS = range(3, 10)
+
+# registry of outcome definitions, filled by the @outcome decorator in definition order
+OUTCOMES = {}
+
+
+def panel_columns(prefix):
+    """Return the column names of a (year, quarter) panel, e.g. EARNX1_1 ... EARNX9_4"""
+    return [f'{prefix}{year}_{quarter}' for year in YEARS for quarter in QUARTERS]
+
+
+def to_panel(df, prefix, dtype=np.float32):
+    """
+    Reshape the EARNX*/EMPLX* columns into an (n, 9 years, 4 quarters) array.
+
+    Missing values become NaN, so the panel is always a float array.
+    """
+    values = df[panel_columns(prefix)].to_numpy(dtype=dtype, na_value=np.nan)
+    return values.reshape(len(df), len(YEARS), len(QUARTERS))
+
+
+def outcome(name):
+    """
+    Register an outcome definition.
+
+    The decorated function gets the earnings panel and the employment panel
+    (both (n, 9, 4), see to_panel) and returns a dict mapping column names to 1d arrays.
+    To add a new outcome, e.g. the first employment quarter, define a function
+    with this signature and decorate it; compute_outcomes picks it up automatically.
+    """
+    def register(func):
+        OUTCOMES[name] = func
+        return func
+    return register
+
+
+def _year_index(years):
+    return [year - YEARS.start for year in years]
+
+
+@outcome('pre_earnings')
+def pre_earnings(earn, empl):
+    """Average quarterly earnings in the pre-treatment years X1 and X2 (missing quarters ignored)"""
+    pre = earn[:, _year_index([1, 2]), :]
+    observed = ~np.isnan(pre)
+    total = np.nansum(pre, axis=2, dtype=np.float64)
+    count = observed.sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    return {'EARNX1': mean[:, 0], 'EARNX2': mean[:, 1]}
+
+
+@outcome('salary')
+def salary(earn, empl):
+    """Yearly salary SAL_t = 3 * sum of the quarterly average monthly earnings, and its average SAL_AVG"""
+    sal = 3 * np.nansum(earn[:, _year_index(OUTCOME_YEARS), :], axis=2, dtype=np.float64)
+    columns = {f'SAL_{year}': sal[:, i] for i, year in enumerate(OUTCOME_YEARS)}
+    columns['SAL_AVG'] = sal.mean(axis=1)
+    return columns
+
+
+@outcome('employment')
+def employment(earn, empl):
+    """Quarters employed (EMPL_TTL) and number of changes into and out of employment (EMPL_CHGE)"""
+    # explicit shape, -1 cannot be inferred for a frame without rows
+    employed = (empl[:, _year_index(OUTCOME_YEARS), :] == 1).reshape(len(empl), len(OUTCOME_YEARS) * len(QUARTERS))
+    # being employed in the first outcome quarter counts as a change into employment
+    changes = employed[:, 0].astype(np.int64) + (employed[:, 1:] != employed[:, :-1]).sum(axis=1)
+    return {'EMPL_TTL': employed.sum(axis=1), 'EMPL_CHGE': changes}
+
+
+def compute_outcomes(df, outcomes=None):
+    """
+    Compute the outcome variables from the earnings and employment panels.
+
+    Args:
+        df (pandas.DataFrame): Raw data containing the EARNX*_y and EMPLX*_y columns
+        outcomes (list): Names of registered outcome definitions to compute, all if None
+
+    Returns:
+        pandas.DataFrame: The outcome columns, indexed like df
+    """
+    earn = to_panel(df, 'EARNX')
+    empl = to_panel(df, 'EMPLX')
+
+    columns = {}
+    for name in (outcomes or OUTCOMES):
+        columns.update(OUTCOMES[name](earn, empl))
+    return pd.DataFrame(columns, index=df.index)
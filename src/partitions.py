@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+PARTITIONS_DIR = 'output_data/partitions'
+PARTITIONS_VERSION = 1
+
+
+def _scalar(value):
+    """A numpy scalar as a json value, NaN and NA as None"""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def partition_meta(df, by='REGION', counts=('PTYPE',)):
+    """
+    Row count, value counts of the counts columns and min/max of every numeric column per value of by.
+
+    All partitions come from one groupby per statistic instead of a pass per partition.
+
+    Returns:
+        dict: value of by -> metadata of its partition, in sorted order (missing values last)
+    """
+    codes, keys = pd.factorize(df[by], sort=True, use_na_sentinel=False)
+    groups = df.groupby(codes, sort=True)
+    numeric = [col for col in df.columns if pd.api.types.is_numeric_dtype(df[col]) and col != by]
+    low, high = groups[numeric].min(), groups[numeric].max()
+    value_counts = {col: groups[col].value_counts().unstack(fill_value=0) for col in counts if col in df.columns}
+    meta = {}
+    for code, (key, n_rows) in enumerate(zip(keys, groups.size())):
+        meta[key] = {
+            'n_rows': int(n_rows),
+            'counts': {col: {str(_scalar(value)): int(n) for value, n in table.loc[code].items() if n}
+                       for col, table in value_counts.items()},
+            'min': {by: _scalar(key), **{col: _scalar(value) for col, value in low.loc[code].items()}},
+            'max': {by: _scalar(key), **{col: _scalar(value) for col, value in high.loc[code].items()}},
+        }
+    return meta
+
+
+def _as_array(series):
+    """Column values as a numpy array; nullable integers become float with NaN for the missing values"""
+    if pd.api.types.is_extension_array_dtype(series.dtype) and pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    return series.to_numpy()
+
+
+def _write_partition(df, path):
+    """All columns of one partition as arrays of a single uncompressed .npz, so columns can be read on their own"""
+    with open(path, 'wb') as f:
+        np.savez(f, **{col: _as_array(df[col]) for col in df.columns})
+
+
+def write_partitions(df, root=PARTITIONS_DIR, by='REGION', counts=('PTYPE',), max_workers=None, source=None):
+    """
+    Write df as one file per value of by (e.g. root/REGION=12.npz) plus root/meta.json.
+
+    meta.json has the column dtypes and, per partition, the row count, the value counts
+    of the counts columns and the min/max of every numeric column, so loaders can skip
+    partitions without opening them (see select_partitions). The rows keep their order
+    within a partition. The partitions are written in parallel threads and the directory
+    is published atomically, so readers never see a half-written layout. source (e.g. the
+    stage cache key of the preprocessing) is stored in meta.json, see is_current.
+
+    Returns:
+        dict: The metadata
+    """
+    tmp_dir = root + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    codes, keys = pd.factorize(df[by], sort=True, use_na_sentinel=False)
+    rows = pd.Series(np.arange(len(df))).groupby(codes).indices
+    names = [f'{by}={_scalar(key)}.npz' for key in keys]
+    write = lambda code: _write_partition(df.iloc[rows[code]], os.path.join(tmp_dir, names[code]))
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        list(pool.map(write, range(len(keys))))
+
+    meta = {'version': PARTITIONS_VERSION, 'by': by, 'n_rows': len(df), 'source': source,
+            'columns': {col: _as_array(df[col].iloc[:0]).dtype.str for col in df.columns},
+            'partitions': {str(_scalar(key)): dict(file=name, **part)
+                           for name, (key, part) in zip(names, partition_meta(df, by, counts).items())}}
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(root, ignore_errors=True)
+    os.replace(tmp_dir, root)
+    print(f"{len(keys)} {by} partitions of {len(df)} rows saved to {root}")
+    return meta
+
+
+def load_meta(root=PARTITIONS_DIR):
+    with open(os.path.join(root, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != PARTITIONS_VERSION:
+        raise ValueError(f"Partitions in {root} have version {meta['version']}, expected {PARTITIONS_VERSION}; "
+                         f"rerun the preprocessing to rewrite them")
+    return meta
+
+
+def is_current(source, root=PARTITIONS_DIR):
+    """Whether root holds partitions written from source (see write_partitions); never for source None"""
+    if source is None or not os.path.exists(os.path.join(root, 'meta.json')):
+        return False
+    with open(os.path.join(root, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    return meta['version'] == PARTITIONS_VERSION and meta.get('source') == source
+
+
+def regions_dir(regions):
+    """Directory of the outputs of a run on some regions only, e.g. 'regions=12,40' for [40, 12]"""
+    return f"regions={','.join(str(region) for region in sorted(regions))}"
+
+
+def _matches(regions, key):
+    if regions is None:
+        return True
+    if callable(regions):
+        return regions(key)
+    return key in regions
+
+
+def select_partitions(meta, regions=None, ranges=None):
+    """
+    Keys of the partitions that can hold matching rows, from the metadata alone.
+
+    Args:
+        meta (dict): See write_partitions
+        regions: Values of the partition column to keep (e.g. [12, 40]), a predicate on
+            the value (e.g. lambda region: region < 10), or None for all
+        ranges (dict): column -> (low, high), inclusive, None for an open end; partitions
+            whose min/max do not overlap a range are skipped
+
+    Returns:
+        list: The partition keys (as in meta['partitions'])
+    """
+    keys = []
+    for key, part in meta['partitions'].items():
+        value = None if key == 'None' else json.loads(key)
+        if not _matches(regions, value):
+            continue
+        overlaps = True
+        for col, (low, high) in (ranges or {}).items():
+            if col not in part['min']:
+                raise KeyError(f"No min/max of column '{col}' in the partition metadata")
+            if part['min'][col] is None or (low is not None and part['max'][col] < low) or \
+                    (high is not None and part['min'][col] > high):
+                overlaps = False
+                break
+        if overlaps:
+            keys.append(key)
+    return keys
+
+
+def _read_partition(path, columns, ranges):
+    with np.load(path, allow_pickle=True) as data:
+        df = pd.DataFrame({col: data[col] for col in (columns or data.files)})
+    if ranges:
+        keep = np.ones(len(df), dtype=bool)
+        for col, (low, high) in ranges.items():
+            values = df[col].to_numpy()
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+        df = df[keep].reset_index(drop=True)
+    return df
+
+
+def map_partitions(func, root=PARTITIONS_DIR, regions=None, columns=None, ranges=None, max_workers=None):
+    """
+    Apply func(df) to every matching partition in parallel threads.
+
+    Only the partitions selected by select_partitions are opened, and only the
+    requested columns (plus the columns of ranges) are read from them; rows outside
+    ranges are dropped before func is called.
+
+    Returns:
+        dict: partition key -> result of func
+    """
+    meta = load_meta(root)
+    keys = select_partitions(meta, regions, ranges)
+    if columns is not None:
+        missing = [col for col in list(columns) + list(ranges or {}) if col not in meta['columns']]
+        if missing:
+            raise KeyError(f"Columns not in the partitions: {missing}")
+        read = list(dict.fromkeys(list(columns) + list(ranges or {})))
+    else:
+        read = None
+
+    def process(key):
+        df = _read_partition(os.path.join(root, meta['partitions'][key]['file']), read, ranges)
+        return func(df if columns is None else df[list(columns)])
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        return dict(zip(keys, pool.map(process, keys)))
+
+
+def read_partitions(root=PARTITIONS_DIR, regions=None, columns=None, ranges=None, max_workers=None):
+    """
+    Load the rows of the matching partitions (see map_partitions) as one DataFrame, in partition order.
+
+    Example: read_partitions(regions=[12, 40], columns=['PTYPE', 'SAL_AVG'], ranges={'AGE': (30, 40)})
+    """
+    parts = map_partitions(lambda df: df, root, regions, columns, ranges, max_workers)
+    if not parts:
+        meta = load_meta(root)
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in meta['columns'].items()
+                             if columns is None or col in columns})[list(columns or meta['columns'])]
+    return pd.concat(parts.values(), ignore_index=True)
+
+
+def partition_summary(meta, keys=None):
+    """Row count and the value counts of the counts columns per partition, as a table"""
+    rows = []
+    for key in keys if keys is not None else meta['partitions']:
+        part = meta['partitions'][key]
+        row = {meta['by']: key, 'n_rows': part['n_rows']}
+        for col, counts in part['counts'].items():
+            row.update({f'{col}={value}': n for value, n in counts.items()})
+        rows.append(row)
+    return pd.DataFrame(rows).fillna(0)
+
+
+def parse_ranges(values):
+    """['AGE=30:40', 'EARN_X0=:5000'] as {'AGE': (30.0, 40.0), 'EARN_X0': (None, 5000.0)}"""
+    ranges = {}
+    for value in values:
+        col, bounds = value.split('=', 1)
+        low, high = bounds.split(':', 1)
+        ranges[col] = (float(low) if low else None, float(high) if high else None)
+    return ranges
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read the REGION partitions of the preprocessed sample')
+    parser.add_argument('--root', default=PARTITIONS_DIR, help='partition directory written by the preprocessing')
+    parser.add_argument('--regions', default=None, help='comma separated regions, default: all')
+    parser.add_argument('--columns', default=None, help='comma separated columns, default: all')
+    parser.add_argument('--range', action='append', default=[], metavar='COL=LOW:HIGH',
+                        help='keep rows with LOW <= COL <= HIGH (either end may be empty, repeatable)')
+    parser.add_argument('--out', default=None, help='write the selected rows to this csv; without it only the '
+                                                    'partition metadata of the selection is printed')
+    args = parser.parse_args()
+
+    regions = [int(region) for region in args.regions.split(',')] if args.regions else None
+    columns = args.columns.split(',') if args.columns else None
+    ranges = parse_ranges(args.range)
+    meta = load_meta(args.root)
+    print(partition_summary(meta, select_partitions(meta, regions, ranges)).to_string(index=False))
+    if args.out is not None:
+        df = read_partitions(args.root, regions, columns, ranges)
+        df.to_csv(args.out, index=False)
+        print(f'{len(df)} rows saved to {args.out}')
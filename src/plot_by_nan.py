@@ -1,22 +1,42 @@
-import json
+import numpy as np
 
-def plot_by_nan(df):
+from config import load_config
+from moments import Moments, balance_table
+
+def plot_by_nan(df, rows=None, columns=None, covariates=None):
     """
     idea is to plot the boxplot 
+
+    rows is an optional boolean mask of the rows to look at and columns the columns
+    checked for NaN (all rows and columns if None), so callers don't need to copy df.
+    covariates are the columns compared, by default all covariates of parameter.json.
     """
 
-    df_shallow = df.copy()
+    if rows is None:
+        rows = np.ones(len(df), dtype=bool)
+    if columns is None:
+        columns = df.columns
     # if any column has nan
-    nan_data = df_shallow[df_shallow.isna().any(axis=1)]
+    has_nan = df[columns].isna().any(axis=1).to_numpy()
+
+    # covariates
+    X = load_config().x if covariates is None else covariates
+
+    nan_data = df.loc[rows & has_nan, X]
     print(nan_data)
 
-    no_nan_data = df_shallow.dropna()
+    no_nan_data = df.loc[rows & ~has_nan, X]
 
-    # covariates
-    with open('src/parameter.json', 'r') as f:
-        parameter = json.load(f)
-    X = parameter['ord_covariates'] + parameter['unord_covariates']
+    write_nan_statistics(X, Moments.of(nan_data, X), Moments.of(no_nan_data, X))
 
+def write_nan_statistics(X, nan_moments, no_nan_moments):
+    """
+    Write output_data/nan_statistics.txt from the (ungrouped) Moments of the rows with and without NaN,
+    and output_data/nan_statistics.csv with counts and the SMD of the NaN rows against the others
+    """
+    nan_stats, no_nan_stats = nan_moments.stats(), no_nan_moments.stats()
+    balance_table(Moments.concat({'no_nan': no_nan_moments, 'nan': nan_moments}), 'no_nan').to_csv(
+        "output_data/nan_statistics.csv", index=False)
     # Create a table showing statistics for each covariate
     with open("output_data/nan_statistics.txt", "w") as f:
         # Write header
@@ -26,11 +46,11 @@ def plot_by_nan(df):
         # Write statistics for each covariate
         for x in X:
             # Statistics for data with NaN values
-            mean_nan = nan_data[x].mean()
-            std_nan = nan_data[x].std()
+            mean_nan = nan_stats.loc[x, 'mean']
+            std_nan = nan_stats.loc[x, 'std']
             
             # Statistics for data without NaN values
-            mean_no_nan = no_nan_data[x].mean()
-            std_no_nan = no_nan_data[x].std()
+            mean_no_nan = no_nan_stats.loc[x, 'mean']
+            std_no_nan = no_nan_stats.loc[x, 'std']
             
             f.write(f"{x:<15}{mean_nan:<15.4f}{mean_no_nan:<15.4f}|{std_nan:<15.4f}{std_no_nan:<15.4f}\n")
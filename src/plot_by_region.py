@@ -3,19 +3,33 @@ import seaborn as sns
 import pandas as pd
 import numpy as np
 
-def plot_by_region(df):
-    """Create plots of the unemployment rate and sector shares by region"""
-    plot_region_unemployment_rate(df)
-    plot_region_service_sector_share(df)
+from render import PlotJob, render
+from plot_ptype import set_style
+from plot_summary import region_means
 
-def plot_region_unemployment_rate(df):
-    """Create a plot of the unemployment rate by region"""
+def plot_by_region(df, max_workers=None):
+    """
+    Create plots of the unemployment rate and sector shares by region.
+
+    Both plots are drawn from the regional means (plot_summary.region_means), computed
+    in one groupby and rendered in parallel (see render.py).
+    """
+    means = region_means(df)
+    render([
+        PlotJob(plot_region_unemployment_rate, means['REG_AL'], 'output_data/region_unemployment_rate.png',
+                set_style),
+        PlotJob(plot_region_service_sector_share, means[['REG_SER', 'REG_PRO', 'REG_AGRI']],
+                'output_data/region_sector_shares.png', set_style),
+    ], max_workers)
+
+def plot_region_unemployment_rate(unemployment_rate):
+    """Create a plot of the unemployment rate by region from the mean REG_AL per REGION"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # bar plot of unemployment rate by region
-    sns.barplot(x='REGION', y='REG_AL', data=df, ax=ax1, width=0.5)
+    sns.barplot(x=unemployment_rate.index, y=unemployment_rate.values, ax=ax1, width=0.5)
 
     # xaxis rotation 90 degrees
     plt.xticks(rotation=90)
@@ -28,10 +42,11 @@ def plot_region_unemployment_rate(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/region_unemployment_rate.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
 
-def plot_region_service_sector_share(df):
-    """Create a plot of the sector shares by region for service, production, and agriculture sectors"""
+def plot_region_service_sector_share(region_means):
+    """Create a plot of the sector shares by region for service, production, and agriculture sectors from their means per REGION"""
     # Create a figure
     fig = plt.figure(figsize=(20, 8))  # Wider figure to accommodate many regions
     ax1 = fig.add_subplot(111)
@@ -43,12 +58,9 @@ def plot_region_service_sector_share(df):
         {'col': 'REG_AGRI', 'name': 'Agriculture', 'color': '#2ecc71'}
     ]
     
-    # Create a DataFrame to hold all sector data by region
-    sector_data = pd.DataFrame()
-    
-    # Prepare data for each sector
-    for sector in sectors:
-        sector_data[sector['name']] = df.groupby('REGION')[sector['col']].mean()
+    # Name the sector columns
+    sector_data = region_means[[sector['col'] for sector in sectors]]
+    sector_data.columns = [sector['name'] for sector in sectors]
     
     # Plot stacked bar chart with all sectors
     sector_data.plot(kind='bar', ax=ax1, stacked=True, 
@@ -67,4 +79,5 @@ def plot_region_service_sector_share(df):
 
     # Adjust layout and save
     plt.tight_layout()
-    plt.savefig('output_data/region_sector_shares.png', dpi=300, bbox_inches='tight')
\ No newline at end of file
+    plt.savefig('output_data/region_sector_shares.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
\ No newline at end of file
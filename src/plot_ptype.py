@@ -1,7 +1,8 @@
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pandas as pd
-import numpy as np
+
+from render import PlotJob, render
+from plot_summary import summarize
 
 def set_style():
     """Set the style for publication-quality plots"""
@@ -23,65 +24,74 @@ def set_style():
         'axes.spines.right': False,
     })
 
-def add_statistical_annotations(ax, df, x_col, y_col, filter_condition=None):
+def add_statistical_annotations(ax, stats):
     """Add statistical annotations to boxplots
     
     Parameters:
     -----------
     ax : matplotlib.axes.Axes
         The axes to add annotations to
-    df : pandas.DataFrame
-        The dataframe containing the data
-    x_col : str
-        The column name for the x-axis categories
-    y_col : str
-        The column name for the y-axis values
-    filter_condition : callable, optional
-        A function that takes a dataframe and returns a filtered dataframe
+    stats : pandas.DataFrame
+        Boxplot statistics per category, see plot_summary.box_stats
     """
-    # Apply filter if provided
-    data = df if filter_condition is None else filter_condition(df)
-    
     # Add statistical annotations for each category
-    for i, category in enumerate(sorted(data[x_col].unique())):
-        category_data = data[data[x_col] == category][y_col]
-        q1 = category_data.quantile(0.25)
-        median = category_data.median()
-        mean = category_data.mean()
-        q3 = category_data.quantile(0.75)
-        
+    for i, row in enumerate(stats.itertuples()):
         # Position the text next to each boxplot
-        ax.text(i + 0.3, median, 
-                f'Q1: {q1:.1f}\nMean: {mean:.1f}\nMedian: {median:.1f}\nQ3: {q3:.1f}',
+        ax.text(i + 0.3, row.med, 
+                f'Q1: {row.q1:.1f}\nMean: {row.mean:.1f}\nMedian: {row.med:.1f}\nQ3: {row.q3:.1f}',
                 horizontalalignment='left', verticalalignment='center', 
                 size='small', color='black',
                 bbox=dict(facecolor='white', alpha=0.8, edgecolor='gray'))
 
-def plot_ptype(df):
+def draw_boxplot(ax, stats, width=0.5):
+    """Draw one box per category from precomputed statistics, styled like sns.boxplot"""
+    color = sns.desaturate(sns.color_palette()[0], 0.75)
+    ax.bxp(
+        [dict(row._asdict(), label=str(row.Index)) for row in stats.itertuples()],
+        positions=range(len(stats)), widths=width, patch_artist=True,
+        boxprops=dict(facecolor=color, edgecolor='0.25'), medianprops=dict(color='0.25'),
+        whiskerprops=dict(color='0.25'), capprops=dict(color='0.25'),
+        flierprops=dict(marker='d', markerfacecolor='0.25', markeredgecolor='0.25', markersize=5),
+        )
+
+def plot_ptype(df, max_workers=None):
     """Create publication-quality plots for program type analysis
+
+    The plots are drawn from the summary tables of plot_summary.summarize, computed once
+    over the data; they are rendered in parallel and skipped if their table did not change
+    (see render.py).
     """
-    set_style()
-    plot_sex_by_ptype(df)
-    plot_age_by_ptype(df)
-    plot_duration_by_ptype(df)
-    plot_ptype_frequency(df)
-    plot_ptype_past_income(df)
-    plot_ptype_school(df)
-    plot_ptype_vocational_degree(df)
-    plot_ptype_labour_market_prospects(df)
-    plot_ptype_nationality(df)
-    plot_ptype_unemployment_rate_last_occupation(df)
-    plot_ptype_region(df)
-    plot_num_month_unemployed_by_ptype(df)
-    plot_num_month_out_of_labour_force_by_ptype(df)
-
-def plot_ptype_frequency(df):
-    """Create a plot of the frequency of each program type"""
+    summary = summarize(df)
+    counts, box = summary['counts'], summary['box']
+    jobs = [
+        PlotJob(plot_sex_by_ptype, counts['SEX'], 'output_data/sex_by_ptype.png'),
+        PlotJob(plot_age_by_ptype, box['AGE'], 'output_data/age_by_ptype.png'),
+        PlotJob(plot_duration_by_ptype, box['DURAT'], 'output_data/duration_by_ptype.png'),
+        PlotJob(plot_ptype_frequency, summary['ptype_counts'], 'output_data/ptype_frequency.png'),
+        PlotJob(plot_ptype_past_income, box['EARN_X0'], 'output_data/ptype_past_income.png'),
+        PlotJob(plot_ptype_school, counts['SCHOOL'], 'output_data/ptype_school.png'),
+        PlotJob(plot_ptype_vocational_degree, counts['VOC_DEG'], 'output_data/ptype_vocational_degree.png'),
+        PlotJob(plot_ptype_labour_market_prospects, counts['LMP_CW'],
+                'output_data/ptype_labour_market_prospects.png'),
+        PlotJob(plot_ptype_nationality, counts['NATION'], 'output_data/ptype_nationality.png'),
+        PlotJob(plot_ptype_unemployment_rate_last_occupation, box['PROF_AL'],
+                'output_data/ptype_unemployment_rate_last_occupation.png'),
+        PlotJob(plot_ptype_region, summary['region_ptype'], 'output_data/ptype_region.png'),
+        PlotJob(plot_num_month_unemployed_by_ptype, box['UNEM_X0'],
+                'output_data/num_month_unemployed_by_ptype.png'),
+        PlotJob(plot_num_month_out_of_labour_force_by_ptype, box['OLF_X0'],
+                'output_data/num_month_out_of_labour_force_by_ptype.png'),
+    ]
+    for job in jobs:
+        job.style = set_style
+    render(jobs, max_workers)
+
+def plot_ptype_frequency(ptype_frequency):
+    """Create a plot of the frequency of each program type from the counts per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
     # plot bar plot of ptype frequency
-    ptype_frequency = df['PTYPE'].value_counts()
     sns.barplot(x=ptype_frequency.index, y=ptype_frequency.values, ax=ax1, width=0.5)
     ax1.set_title('Frequency of Each Program Type')
     ax1.set_xlabel('Program Type (PTYPE)')
@@ -94,16 +104,15 @@ def plot_ptype_frequency(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_frequency.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
 
-def plot_sex_by_ptype(df):
-    """Create a plot of the sex distribution by program type"""
+def plot_sex_by_ptype(gender_by_ptype):
+    """Create a plot of the sex distribution by program type from the PTYPE x SEX counts"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
     # 1. Gender Distribution by Program Type
-    gender_by_ptype = pd.crosstab(df['PTYPE'], df['SEX'])
-    
     # Calculate percentages for each PTYPE
     gender_pct = gender_by_ptype.div(
         gender_by_ptype.sum(axis=1), axis=0) * 100
@@ -124,25 +133,22 @@ def plot_sex_by_ptype(df):
         labels = [f'{pct:.1f}%' for pct in percentages]
         ax1.bar_label(c, labels=labels, label_type='center')
     
-    # Add sample sizes as text
-    for i, ptype in enumerate(df['PTYPE'].unique()):
-        n = len(df[df['PTYPE'] == ptype])
-    
     # Set x-axis tick labels to horizontal (not tilted)
     plt.xticks(rotation=0)
     
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/sex_by_ptype.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_age_by_ptype(df):
-    """Create a plot of the age distribution by program type"""
+def plot_age_by_ptype(stats):
+    """Create a plot of the age distribution by program type from its boxplot statistics per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
     
     # plot boxplot of age by ptype with reduced width
-    sns.boxplot(x='PTYPE', y='AGE', data=df, ax=ax1, width=0.5)
+    draw_boxplot(ax1, stats)
     
     # Set the title and labels
     ax1.set_title('Age Distribution by Program Type')
@@ -150,23 +156,24 @@ def plot_age_by_ptype(df):
     ax1.set_ylabel('Age (AGE)')
     
     # Add statistical annotations
-    add_statistical_annotations(ax1, df, 'PTYPE', 'AGE')
+    add_statistical_annotations(ax1, stats)
 
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/age_by_ptype.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_duration_by_ptype(df):
-    """Create a plot of the duration distribution by program type"""
+def plot_duration_by_ptype(stats):
+    """Create a plot of the duration distribution by program type from its boxplot statistics per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # Filter out PTYPE 0 as we don't care about it
-    filtered_df = df[df['PTYPE'] != 0]
+    stats = stats[stats.index != 0]
 
     # plot boxplot of duration by ptype
-    sns.boxplot(x='PTYPE', y='DURAT', data=filtered_df, ax=ax1, width=0.5)
+    draw_boxplot(ax1, stats)
 
     # Set the title and labels
     ax1.set_title('Duration Distribution by Program Type (excluding PTYPE 0)')
@@ -174,20 +181,20 @@ def plot_duration_by_ptype(df):
     ax1.set_ylabel('Duration (DURAT)')
 
     # Add statistical annotations
-    add_statistical_annotations(ax1, df, 'PTYPE', 'DURAT', 
-                               filter_condition=lambda df: df[df['PTYPE'] != 0])
+    add_statistical_annotations(ax1, stats)
 
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/duration_by_ptype.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_ptype_past_income(df):
-    """Create a plot of the past income distribution by program type"""
+def plot_ptype_past_income(stats):
+    """Create a plot of the past income distribution by program type from its boxplot statistics per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
     # plot boxplot of past income by ptype
-    sns.boxplot(x='PTYPE', y='EARN_X0', data=df, ax=ax1, width=0.5)
+    draw_boxplot(ax1, stats)
 
     # Set the title and labels
     ax1.set_title('Past Income Distribution by Program Type')
@@ -195,23 +202,21 @@ def plot_ptype_past_income(df):
     ax1.set_ylabel('Past Income (EARN_X0)')
 
     # Add statistical annotations
-    add_statistical_annotations(ax1, df, 'PTYPE', 'EARN_X0')
+    add_statistical_annotations(ax1, stats)
 
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_past_income.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_ptype_school(df):
-    """Create a plot of the school distribution by program type"""
+def plot_ptype_school(degree_by_ptype):
+    """Create a plot of the school distribution by program type from the PTYPE x SCHOOL counts"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # degree in years, 8: no degree
     # bar plot of degree by ptype
-    # Calculate counts by program type and school
-    degree_by_ptype = pd.crosstab(df['PTYPE'], df['SCHOOL'])
-    
     # Calculate percentages for each PTYPE
     degree_by_ptype_pct = degree_by_ptype.div(
         degree_by_ptype.sum(axis=1), axis=0) * 100
@@ -235,16 +240,15 @@ def plot_ptype_school(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_school.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_ptype_vocational_degree(df):
-    """Create a plot of the vocational degree distribution by program type"""
+def plot_ptype_vocational_degree(vocational_degree_by_ptype):
+    """Create a plot of the vocational degree distribution by program type from the PTYPE x VOC_DEG counts"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # bar plot of vocational degree by ptype
-    vocational_degree_by_ptype = pd.crosstab(df['PTYPE'], df['VOC_DEG'])
-    
     # Calculate percentages for each PTYPE
     vocational_degree_pct = vocational_degree_by_ptype.div(
         vocational_degree_by_ptype.sum(axis=1), axis=0) * 100
@@ -270,16 +274,15 @@ def plot_ptype_vocational_degree(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_vocational_degree.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_ptype_labour_market_prospects(df):
-    """Create a plot of the labour market prospects distribution by program type"""
+def plot_ptype_labour_market_prospects(labour_market_prospects_by_ptype):
+    """Create a plot of the labour market prospects distribution by program type from the PTYPE x LMP_CW counts"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # bar plot of labour market prospects by ptype
-    labour_market_prospects_by_ptype = pd.crosstab(df['PTYPE'], df['LMP_CW'])
-    
     # Calculate percentages for each PTYPE
     labour_market_prospects_pct = labour_market_prospects_by_ptype.div(
         labour_market_prospects_by_ptype.sum(axis=1), axis=0) * 100
@@ -305,16 +308,15 @@ def plot_ptype_labour_market_prospects(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_labour_market_prospects.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
     
-def plot_ptype_nationality(df):
-    """Create a plot of the nationality distribution by program type"""
+def plot_ptype_nationality(nationality_by_ptype):
+    """Create a plot of the nationality distribution by program type from the PTYPE x NATION counts"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # bar plot of nationality by ptype
-    nationality_by_ptype = pd.crosstab(df['PTYPE'], df['NATION'])
-    
     # Calculate percentages for each PTYPE
     nationality_pct = nationality_by_ptype.div(
         nationality_by_ptype.sum(axis=1), axis=0) * 100
@@ -342,15 +344,16 @@ def plot_ptype_nationality(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_nationality.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_ptype_unemployment_rate_last_occupation(df):
-    """Create a plot of the unemployment rate in the last occupation by program type"""
+def plot_ptype_unemployment_rate_last_occupation(stats):
+    """Create a plot of the unemployment rate in the last occupation by program type from its boxplot statistics per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # box plot of unemployment rate in the last occupation by ptype
-    sns.boxplot(x='PTYPE', y='PROF_AL', data=df, ax=ax1, width=0.5)
+    draw_boxplot(ax1, stats)
 
     # Set the title and labels
     ax1.set_title('Unemployment Rate in the Last Occupation by Program Type (PROF_AL)')
@@ -358,20 +361,20 @@ def plot_ptype_unemployment_rate_last_occupation(df):
     ax1.set_ylabel('Unemployment Rate in the Last Occupation (PROF_AL)')
 
     # Add statistical annotations
-    add_statistical_annotations(ax1, df, 'PTYPE', 'PROF_AL')
+    add_statistical_annotations(ax1, stats)
 
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_unemployment_rate_last_occupation.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_ptype_region(df):
-    """Create a plot of the region distribution by program type"""
+def plot_ptype_region(region_by_ptype):
+    """Create a plot of the region distribution by program type from the REGION x PTYPE counts"""
     # Create a figure
     fig = plt.figure(figsize=(20, 8))  # Wider figure to accommodate many regions
     ax1 = fig.add_subplot(111)
 
     # bar plot with region on x-axis and count of different ptypes
-    region_by_ptype = pd.crosstab(df['REGION'], df['PTYPE'])
     region_by_ptype.plot(kind='bar', ax=ax1, stacked=True,
                          color=['#2ecc71', '#3498db', '#f39c12'], width=0.9)
     ax1.set_title('Program Type Distribution by Region')
@@ -388,15 +391,16 @@ def plot_ptype_region(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/ptype_region.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_num_month_unemployed_by_ptype(df):
-    """Create a plot of the number of months employed by program type"""
+def plot_num_month_unemployed_by_ptype(stats):
+    """Create a plot of the number of months employed by program type from its boxplot statistics per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # box plot of num_month_employed by ptype
-    sns.boxplot(x='PTYPE', y='UNEM_X0', data=df, ax=ax1, width=0.5)
+    draw_boxplot(ax1, stats)
 
     # Set the title and labels
     ax1.set_title('Number of Months Employed by Program Type (UNEM_X0)')
@@ -406,15 +410,16 @@ def plot_num_month_unemployed_by_ptype(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/num_month_unemployed_by_ptype.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
-def plot_num_month_out_of_labour_force_by_ptype(df):
-    """Create a plot of the number of months out of labour force by program type"""
+def plot_num_month_out_of_labour_force_by_ptype(stats):
+    """Create a plot of the number of months out of labour force by program type from its boxplot statistics per PTYPE"""
     # Create a figure
     fig = plt.figure(figsize=(15, 6))
     ax1 = fig.add_subplot(111)
 
     # box plot of num_month_out_of_labour_force by ptype
-    sns.boxplot(x='PTYPE', y='OLF_X0', data=df, ax=ax1, width=0.5)
+    draw_boxplot(ax1, stats)
 
     # Set the title and labels
     ax1.set_title('Number of Months Out of Labour Force by Program Type (OLF_X0)')
@@ -424,3 +429,4 @@ def plot_num_month_out_of_labour_force_by_ptype(df):
     # Adjust layout and save
     plt.tight_layout()
     plt.savefig('output_data/num_month_out_of_labour_force_by_ptype.png', dpi=300, bbox_inches='tight')
+    plt.close(fig)
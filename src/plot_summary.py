@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+# columns shown per program type, as stacked bar counts and as boxplots
+PTYPE_COUNT_COLUMNS = ['SEX', 'SCHOOL', 'VOC_DEG', 'LMP_CW', 'NATION']
+PTYPE_BOX_COLUMNS = ['AGE', 'DURAT', 'EARN_X0', 'PROF_AL', 'UNEM_X0', 'OLF_X0']
+REGION_MEAN_COLUMNS = ['REG_AL', 'REG_SER', 'REG_PRO', 'REG_AGRI']
+
+
+def count_table(df, by, column):
+    """Counts of each value of column per group (the pd.crosstab of by and column)"""
+    return df.groupby(by)[column].value_counts().unstack(fill_value=0).rename_axis(index=by, columns=column)
+
+
+def box_stats(df, by, columns, whis=1.5):
+    """
+    Boxplot statistics of several columns per group, computed with one groupby.
+
+    The quantiles are interpolated linearly and the whiskers reach the most extreme
+    values within whis * IQR of the box, like matplotlib's boxplot. Outliers are
+    stored as their distinct values, which is all a boxplot can show of them.
+
+    Returns:
+        dict: Per column a DataFrame indexed by group with the columns
+            n, mean, q1, med, q3, whislo, whishi and fliers
+    """
+    grouped = df.groupby(by)[columns]
+    quantiles = grouped.quantile([0.25, 0.5, 0.75])
+    n, mean = grouped.count(), grouped.mean()
+    q1, med, q3 = (quantiles.xs(q, level=-1) for q in [0.25, 0.5, 0.75])
+
+    # whisker fences per row, the extreme values inside them per group
+    groups = df[by]
+    low = (q1 - whis * (q3 - q1)).reindex(groups).set_axis(df.index)
+    high = (q3 + whis * (q3 - q1)).reindex(groups).set_axis(df.index)
+    values = df[columns]
+    inside = (values >= low) & (values <= high)
+    whislo = values.where(inside).groupby(groups).min()
+    whishi = values.where(inside).groupby(groups).max()
+    outside = values.notna() & ~inside
+
+    stats = {}
+    for col in columns:
+        fliers = values.loc[outside[col], col].groupby(groups[outside[col]]).unique()
+        stats[col] = pd.DataFrame({
+            'n': n[col], 'mean': mean[col], 'q1': q1[col], 'med': med[col], 'q3': q3[col],
+            'whislo': whislo[col], 'whishi': whishi[col],
+            # tuples, so the tables stay hashable for the plot cache
+            'fliers': fliers.reindex(n.index).apply(lambda v: tuple(np.sort(v)) if isinstance(v, np.ndarray) else ()),
+        })
+    return stats
+
+
+def region_means(df):
+    """Means of REGION_MEAN_COLUMNS per REGION, the table of the region plots (see plot_by_region.py)"""
+    return df.groupby('REGION')[REGION_MEAN_COLUMNS].mean()
+
+
+def summarize(df):
+    """
+    All tables the program type plots are drawn from.
+
+    Returns:
+        dict: 'ptype_counts' (Series), 'counts' (crosstab per PTYPE_COUNT_COLUMNS column),
+            'box' (box_stats per PTYPE_BOX_COLUMNS column) and 'region_ptype' (crosstab of
+            REGION and PTYPE)
+    """
+    return {
+        'ptype_counts': df['PTYPE'].value_counts().sort_index(),
+        'counts': {col: count_table(df, 'PTYPE', col) for col in PTYPE_COUNT_COLUMNS},
+        'box': box_stats(df, 'PTYPE', PTYPE_BOX_COLUMNS),
+        'region_ptype': count_table(df, 'REGION', 'PTYPE'),
+    }
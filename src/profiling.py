@@ -0,0 +1,196 @@
+import cProfile
+import csv
+import io
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+_active = None
+
+
+def _rss_bytes():
+    """Current resident set size, 0 where /proc is not available"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def _maxrss_bytes(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+def _child_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _RssSampler(threading.Thread):
+    """Samples the RSS in the background, so every open record sees the peak of its own time span"""
+
+    def __init__(self, profiler, interval):
+        super().__init__(daemon=True)
+        self.profiler = profiler
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.profiler._observe_rss()
+
+
+class Profiler:
+    """
+    Timing and memory trace of the pipeline stages and their sub-steps.
+
+    Every record holds the wall time, the CPU time of this process and of finished child
+    processes (worker pools), the peak RSS sampled during the record, the process RSS
+    high-water mark at its end and the rows going in and out. Records nest: a sub-step
+    opened inside a stage is named 'stage/sub-step'. Jobs running in worker processes
+    report their own timing (see timed and record_job). Stages listed in cprofile_stages
+    are additionally run under cProfile and their stats are written next to the trace.
+    """
+
+    def __init__(self, out_dir='output_data/profile', cprofile_stages=(), sample_interval=0.05):
+        self.out_dir = out_dir
+        self.cprofile_stages = set(cprofile_stages)
+        self.sample_interval = sample_interval
+        self.records = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        if self.sample_interval:
+            self._sampler = _RssSampler(self, self.sample_interval)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        if self._sampler is not None:
+            self._sampler.stopped.set()
+            self._sampler.join()
+        return False
+
+    def _observe_rss(self):
+        rss = _rss_bytes()
+        with self._lock:
+            for record in self._open:
+                record['peak_rss_mb'] = max(record['peak_rss_mb'], rss / 1024 ** 2)
+
+    def add(self, name, timing, rows_in=None, rows_out=None):
+        """Add a finished record measured elsewhere (see timed), below the innermost open record"""
+        with self._lock:
+            if self._open:
+                name = f"{self._open[-1]['name']}/{name}"
+            self.records.append({'name': name, 'depth': len(self._open), 'rows_in': rows_in, 'rows_out': rows_out,
+                                 'child_cpu_s': 0.0, **timing})
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Record the enclosed block; set record['rows_out'] (or other fields) on the yielded dict"""
+        if self._open:
+            name = f"{self._open[-1]['name']}/{name}"
+        record = {'name': name, 'depth': len(self._open), 'rows_in': rows_in, 'rows_out': None,
+                  'peak_rss_mb': _rss_bytes() / 1024 ** 2}
+        with self._lock:
+            self._open.append(record)
+            self.records.append(record)
+
+        profile = cProfile.Profile() if name.split('/')[0] in self.cprofile_stages and record['depth'] == 0 else None
+        wall, cpu, child_cpu = time.perf_counter(), time.process_time(), _child_cpu()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            record['child_cpu_s'] = _child_cpu() - child_cpu
+            record['maxrss_mb'] = _maxrss_bytes() / 1024 ** 2
+            self._observe_rss()
+            with self._lock:
+                self._open.remove(record)
+            if profile is not None:
+                self._write_cprofile(name, profile)
+
+    def _write_cprofile(self, name, profile):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f'{name}.prof')
+        profile.dump_stats(path)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(20)
+        with open(os.path.join(self.out_dir, f'{name}.prof.txt'), 'w') as f:
+            f.write(text.getvalue())
+        print(f'cProfile stats of {name} saved to {path} (top functions in {path}.txt)')
+
+    def summary(self):
+        """The trace as an aligned text table"""
+        lines = [f"{'Stage':<45}{'Wall [s]':>10}{'CPU [s]':>10}{'Child CPU':>10}{'Peak RSS':>10}{'Rows in':>10}{'Rows out':>10}"]
+        lines.append('-' * len(lines[0]))
+        for record in self.records:
+            label = '  ' * record['depth'] + record['name'].split('/')[-1]
+            rows = [f"{record[key]:>10}" if record[key] is not None else f"{'':>10}" for key in ['rows_in', 'rows_out']]
+            lines.append(f"{label[:44]:<45}{record.get('wall_s', float('nan')):>10.3f}{record.get('cpu_s', float('nan')):>10.3f}"
+                         f"{record.get('child_cpu_s', float('nan')):>10.3f}{record['peak_rss_mb']:>9.0f}M" + ''.join(rows))
+        return '\n'.join(lines)
+
+    def write(self):
+        """Write trace.json, trace.csv and the summary table to out_dir"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, 'trace.json'), 'w') as f:
+            json.dump(self.records, f, indent=2)
+        fields = ['name', 'depth', 'wall_s', 'cpu_s', 'child_cpu_s', 'peak_rss_mb', 'maxrss_mb', 'rows_in', 'rows_out', 'cached']
+        with open(os.path.join(self.out_dir, 'trace.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.records)
+        summary = self.summary()
+        with open(os.path.join(self.out_dir, 'summary.txt'), 'w') as f:
+            f.write(summary + '\n')
+        print(summary)
+        print(f'Profile trace saved to {self.out_dir}')
+
+
+@contextmanager
+def step(name, rows_in=None):
+    """Record a block in the active Profiler; a no-op (yielding a throwaway dict) when none is active"""
+    if _active is None:
+        yield {}
+        return
+    with _active.stage(name, rows_in) as record:
+        yield record
+
+
+def timed(func, *args):
+    """
+    Run func(*args) and return its result together with its timing in this process.
+
+    For jobs in worker processes, whose time and memory the Profiler of the parent
+    cannot see: the worker returns the timing and the parent records it with record_job.
+    peak_rss_mb is the high-water mark of the worker process.
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    maxrss = _maxrss_bytes() / 1024 ** 2
+    return result, {'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu,
+                    'peak_rss_mb': maxrss, 'maxrss_mb': maxrss}
+
+
+def record_job(name, timing, rows_in=None, rows_out=None):
+    """Record the timing of a worker job (see timed) in the active Profiler; a no-op when none is active"""
+    if _active is not None:
+        _active.add(name, timing, rows_in, rows_out)
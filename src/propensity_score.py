@@ -2,72 +2,116 @@ from sklearn.linear_model import LogisticRegression
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
-import json
-def propensity_score(df):
+import os
+import pickle
+
+from stage_cache import fingerprint
+
+def _save(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def fit_propensity_model(df_x, df_t, cache_dir='.cache/propensity'):
+    """
+    Fit the multinomial logistic regression of the treatment on the covariates, or load it from cache_dir.
+
+    Models are cached under a hash of the data and the feature names. A model is always
+    fitted from scratch, never warm-started from an earlier fit, so it only depends on the
+    data (as the stage cache key assumes) and not on what ran before.
+
+    Args:
+        df_x (pandas.DataFrame): Covariates
+        df_t (pandas.Series): Treatment
+        cache_dir (str): Cache location, None disables the cache
+
+    Returns:
+        LogisticRegression: The fitted model
+    """
+    if cache_dir is None:
+        return LogisticRegression(solver='lbfgs').fit(df_x, df_t)
+
+    key = fingerprint([fingerprint(df_x), fingerprint(df_t)])
+    path = os.path.join(cache_dir, f'{key}.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)['model']
+
+    ps_model = LogisticRegression(solver='lbfgs').fit(df_x, df_t)
+    os.makedirs(cache_dir, exist_ok=True)
+    _save({'model': ps_model}, path)
+    return ps_model
+
+def propensity_matrix(df, covariates, cache_dir='.cache/propensity'):
+    """
+    Propensity scores of all treatment types.
+
+    Args:
+        df (pandas.DataFrame): Input dataframe containing treatment and covariate data
+        covariates (dict): 'treatment', 'ord_covariates' and 'unord_covariates' of parameter.json
+        cache_dir (str): Model cache, see fit_propensity_model
+
+    Returns:
+        numpy.ndarray: float32 array of shape (n, n_treatments), column j is P(D=j|X)
+    """
+    X = covariates['ord_covariates'] + covariates['unord_covariates']
+    df_x = df[X]
+    ps_model = fit_propensity_model(df_x, df[covariates['treatment']], cache_dir)
+    return ps_model.predict_proba(df_x).astype(np.float32)
+
+def propensity_score(df, covariates):
     """
     Calculate propensity scores for each treatment type and visualize their distributions.
     
     This function:
-    1. Prepares features for propensity score modeling
-    2. Fits a multinomial logistic regression model
-    3. Generates propensity scores for each treatment type
-    4. Creates visualization plots comparing propensity score distributions
-    5. Saves the plots to output files
+    1. Fits (or loads) a multinomial logistic regression model
+    2. Predicts the propensity scores of all treatment types at once
+    3. Creates visualization plots comparing propensity score distributions
+    4. Saves the plots to output files
     
     Args:
         df (pandas.DataFrame): Input dataframe containing treatment and covariate data
-    """
+        covariates (dict): 'treatment', 'ord_covariates' and 'unord_covariates' of parameter.json
 
-    # import parameter json
-    with open('src/parameter.json', 'r') as f:
-        parameter = json.load(f)
-    
-    # Define features for propensity score model
-    X = parameter['ord_covariates'] + parameter['unord_covariates']
-    T = parameter['treatment']
-    
-    df_x = df[X]
-    df_t = df[T]
-    
-    # Fit propensity score model
-    ps_model = LogisticRegression(multi_class='multinomial', solver='lbfgs').fit(df_x, df_t)
-    
-    # Generate propensity scores for each treatment type
-    df_ps_0 = df.assign(propensity_score=ps_model.predict_proba(df[X])[:, 0])
-    df_ps_1 = df.assign(propensity_score=ps_model.predict_proba(df[X])[:, 1])
-    df_ps_2 = df.assign(propensity_score=ps_model.predict_proba(df[X])[:, 2])
+    Returns:
+        numpy.ndarray: The propensity scores, shape (n, n_treatments)
+    """
+    ps = propensity_matrix(df, covariates)
+    treatment = df[covariates['treatment']].to_numpy()
         
     # Create visualizations
     treatment_labels = ['Non Treated', 'Training Program 1', 'Training Program 2']
-    df_ps_list = [df_ps_0, df_ps_1, df_ps_2]
     
     # Plot propensity scores by subsamples
-    create_propensity_plot(df_ps_list, treatment_labels, by_subsample=True, 
+    create_propensity_plot(ps, treatment, treatment_labels, by_subsample=True, 
                           filename='output_data/propensity_score_subsample.png')
     
     # Plot propensity scores for whole sample
-    create_propensity_plot(df_ps_list, treatment_labels, by_subsample=False,
+    create_propensity_plot(ps, treatment, treatment_labels, by_subsample=False,
                           filename='output_data/propensity_score_whole_sample.png')
+    return ps
 
 
-def create_propensity_plot(df_ps_list, treatment_labels, by_subsample=True, filename=None):
+def create_propensity_plot(ps, treatment, treatment_labels, by_subsample=True, filename=None):
     """
     Create and save propensity score distribution plots.
     
     Args:
-        df_ps_list (list): List of dataframes with propensity scores for each treatment type
+        ps (numpy.ndarray): Propensity scores, one column per treatment type
+        treatment (numpy.ndarray): Treatment of each row
         treatment_labels (list): Labels for each treatment type
         by_subsample (bool): If True, plot distributions by treatment subsamples
         filename (str): Path to save the output figure
     """
     fig, axes = plt.subplots(1, 3, figsize=(12, 6))
     
-    for i, (df_ps, ax) in enumerate(zip(df_ps_list, axes)):
+    for i, ax in enumerate(axes):
         if by_subsample:
             # Plot propensity score distributions by treatment subsamples
             for j, label in enumerate(treatment_labels):
                 sns.histplot(
-                    df_ps.query(f"PTYPE == {j}")["propensity_score"], 
+                    ps[treatment == j, i], 
                     kde=True, 
                     label=f"Subsample of {label}", 
                     bins=30, 
@@ -76,7 +120,7 @@ def create_propensity_plot(df_ps_list, treatment_labels, by_subsample=True, file
         else:
             # Plot propensity score distribution for whole sample
             sns.histplot(
-                df_ps["propensity_score"], 
+                ps[:, i], 
                 kde=True, 
                 bins=30, 
                 label="Whole Sample", 
@@ -89,4 +133,5 @@ def create_propensity_plot(df_ps_list, treatment_labels, by_subsample=True, file
     plt.tight_layout()
     
     if filename:
-        plt.savefig(filename, dpi=300, bbox_inches='tight')
\ No newline at end of file
+        plt.savefig(filename, dpi=300, bbox_inches='tight')
+    plt.close(fig)
\ No newline at end of file
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# columns that only depend on the REGION of a person
+REGIONAL_COLUMNS = ['REG_SER', 'REG_PRO', 'REG_AGRI', 'REG_AL']
+SECTOR_COLUMNS = ['REG_SER', 'REG_PRO', 'REG_AGRI']
+
+
+def region_lookup(df, columns=REGIONAL_COLUMNS):
+    """
+    Table of the regional values per REGION, from the persons of each region (one groupby).
+
+    The values are equal for all persons of a region, so the first observed value is taken;
+    a region without any observed value of a column gets NaN there.
+    """
+    return df.groupby('REGION')[columns].first()
+
+
+def merge_lookups(lookup, other):
+    """Combine the lookup tables of two parts of the data (e.g. chunks or extracts)"""
+    if lookup is None:
+        return other
+    return lookup.combine_first(other)
+
+
+def impute_regional_values(df, lookup=None):
+    """
+    Fill missing regional values in place from the values of the same REGION.
+
+    Every missing value of the REGIONAL_COLUMNS is taken from the lookup table with one
+    indexed take per column. A sector share that is still missing afterwards (its region has
+    no observed value) is set to 100 minus the other two shares when it is the only one
+    missing in its row.
+
+    Args:
+        df (pandas.DataFrame): Data with REGION and the REGIONAL_COLUMNS
+        lookup (pandas.DataFrame): region_lookup table, built from df if None
+            (the chunked modes pass the table of the whole data)
+
+    Returns:
+        pandas.DataFrame: Number of filled values per REGION and column
+    """
+    if lookup is None:
+        lookup = region_lookup(df)
+
+    codes = lookup.index.get_indexer(df['REGION'])
+    known = codes >= 0
+    values = lookup.to_numpy(dtype='float64')[np.where(known, codes, 0)]
+    filled = pd.DataFrame(False, index=df.index, columns=REGIONAL_COLUMNS)
+    for i, col in enumerate(REGIONAL_COLUMNS):
+        fill = (df[col].isna().to_numpy() & known & ~np.isnan(values[:, i]))
+        if fill.any():
+            df.loc[fill, col] = values[fill, i]
+            filled[col] = fill
+
+    # the sector shares add up to 100
+    only_one_missing = (df[SECTOR_COLUMNS].isna().sum(axis=1) == 1).to_numpy()
+    if only_one_missing.any():
+        rest = 100 - df[SECTOR_COLUMNS].fillna(0).sum(axis=1).to_numpy()
+        for col in SECTOR_COLUMNS:
+            fill = only_one_missing & df[col].isna().to_numpy()
+            df.loc[fill, col] = rest[fill]
+            filled[col] |= fill
+
+    return filled.groupby(df['REGION'], dropna=False).sum()
+
+
+def write_fill_counts(fill_counts, path='output_data/regional_imputation.csv'):
+    """Write the number of imputed values per REGION (rows with any imputed value only) and print the totals"""
+    # counts summed over chunks come back as floats, as does REGION when read from a csv with missing values
+    fill_counts = fill_counts[fill_counts.sum(axis=1) > 0].astype(np.int64)
+    fill_counts.index = fill_counts.index.astype('Int64')
+    fill_counts.to_csv(path)
+    totals = ', '.join(f'{col}: {int(n)}' for col, n in fill_counts.sum().items())
+    print(f'Imputed regional values ({totals}), counts per region saved to {path}')
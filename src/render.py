@@ -0,0 +1,105 @@
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import matplotlib
+
+from profiling import record_job, step, timed
+from stage_cache import declare_outputs, fingerprint
+
+
+@dataclass
+class PlotJob:
+    """
+    One figure: func(data) draws it and saves it to filename.
+
+    data should only hold what the plot needs (the columns it uses or a summary
+    table), it is sent to the worker process and hashed to detect changes.
+    style is called before func, e.g. to set the rcParams of the plot module.
+    """
+    func: Callable
+    data: object
+    filename: str
+    style: Optional[Callable] = None
+
+
+def job_hash(job):
+    """Hash of the plot input and the code drawing it (the whole module, so shared helpers count too)"""
+    code = inspect.getsource(inspect.getmodule(job.func))
+    if job.style is not None:
+        code += inspect.getsource(inspect.getmodule(job.style))
+    return fingerprint([fingerprint(job.data), fingerprint(code)])
+
+
+def render_job(job):
+    """Render one job with the Agg backend and close its figures, also if drawing fails"""
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    try:
+        if job.style is not None:
+            job.style()
+        job.func(job.data)
+    finally:
+        plt.close('all')
+    return job.filename
+
+
+def render(jobs, max_workers=None, manifest_path='output_data/.plot_manifest.json'):
+    """
+    Render plot jobs in parallel worker processes.
+
+    A job is skipped if its file exists and its input and code hash equals the one
+    recorded in the manifest when the file was last rendered. All target files,
+    skipped or not, are declared as outputs of the running stage (see stage_cache.py).
+
+    Args:
+        jobs (list): PlotJob objects
+        max_workers (int): Worker processes, defaults to one per job up to the number of cores;
+            1 renders in the calling process
+        manifest_path (str): json file with the hash of every rendered file
+
+    Returns:
+        list: The files of all jobs
+    """
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    hashes = {job.filename: job_hash(job) for job in jobs}
+    todo = [job for job in jobs
+            if not os.path.exists(job.filename) or manifest.get(job.filename) != hashes[job.filename]]
+    print(f'Rendering {len(todo)} of {len(jobs)} plots, the others are unchanged')
+
+    if max_workers is None:
+        max_workers = min(len(todo), os.cpu_count() or 1)
+    # every plot is a record of the active profiler, named after its file
+    names = [os.path.basename(job.filename) for job in todo]
+    if max_workers <= 1:
+        rendered = []
+        for name, job in zip(names, todo):
+            with step(name):
+                rendered.append(render_job(job))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            rendered = []
+            for name, (filename, timing) in zip(names, pool.map(functools.partial(timed, render_job), todo)):
+                record_job(name, timing)
+                rendered.append(filename)
+
+    # re-read, the manifest is shared by all plot stages
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    manifest.update({filename: hashes[filename] for filename in rendered})
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    targets = [job.filename for job in jobs]
+    declare_outputs(targets)
+    return targets
@@ -0,0 +1,112 @@
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from profiling import step as profile_step
+
+
+@dataclass
+class SelectionStep:
+    """
+    One step of the sample selection.
+
+    mask(df, alive, columns) returns a boolean array over all rows of df marking the rows
+    the step keeps. alive marks the rows that survived the previous steps and columns
+    the columns still in the sample; row-local steps can ignore both.
+    report(df, alive, columns) is called before the mask is evaluated, e.g. to record
+    statistics of the sample at that point.
+    row_local is False for steps whose mask depends on other rows (like the duplicate
+    check), which the chunked mode in streaming.py has to handle in a separate pass.
+    """
+    label: str
+    mask: Callable
+    drop_columns: list = field(default_factory=list)
+    report: Optional[Callable] = None
+    enabled: bool = True
+    row_local: bool = True
+
+
+class SelectionLedger:
+    """Masks of all evaluated steps; sample sizes are derived from them on demand"""
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.labels = []
+        self.masks = []
+
+    def add(self, label, mask):
+        self.labels.append(label)
+        self.masks.append(mask)
+
+    def alive(self, upto=None):
+        """Rows surviving all steps (or the first `upto` steps)"""
+        alive = np.ones(self.n_rows, dtype=bool)
+        for mask in self.masks[:upto]:
+            alive &= mask
+        return alive
+
+    def sizes(self):
+        """Sample size after each step, in step order"""
+        alive = np.ones(self.n_rows, dtype=bool)
+        sizes = []
+        for mask in self.masks:
+            alive &= mask
+            sizes.append(int(alive.sum()))
+        return sizes
+
+    def write(self, path):
+        """Write the sample sizes in the format of output_data/sample_sizes.txt"""
+        write_sample_sizes(path, self.n_rows, self.labels, self.sizes())
+
+
+def write_sample_sizes(path, initial_size, labels, sizes):
+    """Write the initial sample size and the size after each step"""
+    final_size = sizes[-1] if sizes else initial_size
+    with open(path, "w") as f:
+        f.write(f"Initial sample size: {initial_size}\n")
+        for label, size in zip(labels, sizes):
+            f.write(f"{label}: {size}\n")
+        f.write(f"Total samples removed: {initial_size - final_size}\n")
+        f.write(f"Percentage of samples retained: {round((final_size / initial_size) * 100, 2)}%\n")
+
+
+def as_mask(values):
+    """Turn a boolean Series (possibly nullable) into a plain numpy mask, missing counts as False"""
+    if isinstance(values, pd.Series):
+        return values.fillna(False).to_numpy(dtype=bool)
+    return np.asarray(values, dtype=bool)
+
+
+def run_selection(df, steps):
+    """
+    Apply the selection steps to df.
+
+    All masks are evaluated against the original index and combined once, so the
+    surviving rows and remaining columns are only materialized at the very end.
+
+    Args:
+        df (pandas.DataFrame): Data to select from
+        steps (list): SelectionStep objects, in order; disabled steps are skipped
+
+    Returns:
+        tuple: The selected data (a new DataFrame) and the SelectionLedger
+    """
+    ledger = SelectionLedger(len(df))
+    alive = np.ones(len(df), dtype=bool)
+    columns = list(df.columns)
+
+    for step in steps:
+        if not step.enabled:
+            continue
+        with profile_step(step.label, rows_in=int(alive.sum())) as record:
+            if step.report is not None:
+                step.report(df, alive, columns)
+            mask = as_mask(step.mask(df, alive, columns))
+            ledger.add(step.label, mask)
+            alive &= mask
+            columns = [col for col in columns if col not in step.drop_columns]
+            record['rows_out'] = int(alive.sum())
+
+    return df.loc[alive, columns], ledger
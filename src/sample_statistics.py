@@ -1,28 +1,27 @@
+from moments import Moments, balance_table
+
 def sample_statistics(df):
-    # ptype 0, no program
-    df_ptype_0 = df[df['PTYPE'] == 0]
-    # ptype 1, program 1
-    df_ptype_1 = df[df['PTYPE'] == 1]
-    # ptype 2, program 2
-    df_ptype_2 = df[df['PTYPE'] == 2]
+    # mean and std of every column for ptype 0 (no program), 1 and 2 (programs 1 and 2) in one pass
+    moments = Moments.of(df, list(df.columns), by='PTYPE')
+    write_sample_statistics(df.columns, moments)
+
+
+def write_sample_statistics(columns, moments):
+    """
+    Write the per-PTYPE means and stds (Moments grouped by PTYPE) to output_data/sample_statistics.txt,
+    and with counts and the SMD of each program against PTYPE 0 to output_data/sample_statistics.csv
+    """
+    means, stds = moments.mean.reindex([0, 1, 2]), moments.std().reindex([0, 1, 2])
+    mean_ptype_0, mean_ptype_1, mean_ptype_2 = (means.loc[ptype] for ptype in [0, 1, 2])
+    std_ptype_0, std_ptype_1, std_ptype_2 = (stds.loc[ptype] for ptype in [0, 1, 2])
+    balance_table(moments, 0).to_csv("output_data/sample_statistics.csv", index=False)
 
-    # Calculate mean and std for each ptype
-    mean_ptype_0 = df_ptype_0.mean()
-    std_ptype_0 = df_ptype_0.std()
-    mean_ptype_1 = df_ptype_1.mean()
-    std_ptype_1 = df_ptype_1.std()
-    mean_ptype_2 = df_ptype_2.mean()
-    std_ptype_2 = df_ptype_2.std()
-    
     # output the results under output_data/statistics.txt in a columnar format
     with open("output_data/sample_statistics.txt", "w") as f:
         # Write header
         f.write(f"{'Variable':<15}{'PTYPE 0':<20}{'PTYPE 1':<20}{'PTYPE 2':<20}\n")
         f.write(f"{'-'*15}{'-'*20}{'-'*20}{'-'*20}\n")
         
-        # Get all column names from the dataframe
-        columns = df.columns
-        
         # Write mean values for each variable
         f.write(f"{'MEANS:':<15}\n")
         for col in columns:
@@ -0,0 +1,246 @@
+import ast
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from profiling import step
+
+
+def fingerprint(obj):
+    """
+    Return a stable hash of a stage input.
+
+    DataFrames and Series are hashed by content (values, index, column names and dtypes),
+    arrays by their bytes, everything else through its json (or repr) representation.
+    """
+    sha = hashlib.sha256()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        sha.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        if isinstance(obj, pd.DataFrame):
+            sha.update(repr(list(zip(obj.columns, obj.dtypes.astype(str)))).encode())
+        else:
+            sha.update(repr((obj.name, str(obj.dtype))).encode())
+    elif isinstance(obj, np.ndarray):
+        sha.update(repr((obj.shape, obj.dtype.str)).encode())
+        sha.update(np.ascontiguousarray(obj).tobytes())
+    else:
+        try:
+            sha.update(json.dumps(obj, sort_keys=True, default=repr).encode())
+        except TypeError:
+            sha.update(repr(obj).encode())
+    return sha.hexdigest()
+
+
+def _imported_names(module):
+    """Names of the modules imported at the top level of module (import x, from x import y)"""
+    names = []
+    for node in ast.parse(inspect.getsource(module)).body:
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names.append(node.module)
+    return names
+
+
+def local_modules(modules):
+    """
+    The given modules and, transitively, the modules of the same directory they import at their top level.
+
+    A stage then depends on e.g. render.py through plot_ptype.py without listing it.
+    Imports inside functions (the lazy stage imports of main) are not followed.
+    """
+    found = {}
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module.__name__ in found:
+            continue
+        found[module.__name__] = module
+        directory = os.path.dirname(os.path.abspath(module.__file__))
+        for name in _imported_names(module):
+            imported = sys.modules.get(name)
+            if imported is not None and getattr(imported, '__file__', None) \
+                    and os.path.dirname(os.path.abspath(imported.__file__)) == directory:
+                pending.append(imported)
+    return [found[name] for name in sorted(found)]
+
+
+def code_version(modules):
+    """Hash of the source code of the given modules and the local modules they import (see local_modules)"""
+    sha = hashlib.sha256()
+    for module in local_modules(modules):
+        sha.update(module.__name__.encode())
+        sha.update(inspect.getsource(module).encode())
+    return sha.hexdigest()
+
+
+# files declared by the stage currently computed by StageCache.run (see declare_outputs), None outside a stage
+_declared = None
+
+
+def declare_outputs(paths):
+    """
+    Mark files as outputs of the running stage, so they are stored in its cache entry.
+
+    The cache stores the files a stage modified; a stage that leaves up-to-date files
+    untouched (e.g. render skipping unchanged plots) declares them, so they are restored
+    on a hit even if they were deleted since. Does nothing outside a stage.
+    """
+    if _declared is not None:
+        _declared.update(paths)
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def _snapshot(dirs):
+    """Modification times of all files below dirs"""
+    files = {}
+    for directory in dirs:
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                files[path] = os.stat(path).st_mtime_ns
+    return files
+
+
+def _copy(src, dst):
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    shutil.copy2(src, dst)
+
+
+class StageCache:
+    """
+    Disk cache for the stages of main().
+
+    A stage result is stored under a key built from the stage name, the fingerprints of
+    its inputs, the parameter.json entries it uses and the source code of the modules
+    implementing it (and the local modules they import). Files a stage writes into its
+    output directories (plots, txt reports, MCF output folders) are stored with the
+    result and restored on a hit.
+    Entries are evicted least-recently-used once the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir='.stage_cache', max_bytes=5 * 1024 ** 3, force=(), enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.force = set(force)
+        self.enabled = enabled
+        self.index_path = os.path.join(cache_dir, 'index.json')
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _save_index(self, index):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def key(self, stage, inputs, params, modules):
+        sha = hashlib.sha256(stage.encode())
+        for value in inputs:
+            sha.update(fingerprint(value).encode())
+        sha.update(fingerprint(params).encode())
+        sha.update(code_version(modules).encode())
+        return f'{stage}-{sha.hexdigest()[:24]}'
+
+    def run(self, stage, func, inputs=(), key_inputs=None, params=None, modules=(), output_dirs=()):
+        """
+        Run func(*inputs) or restore its cached result.
+
+        Args:
+            stage (str): Stage name, also used by --force
+            func (callable): Function computing the stage
+            inputs (tuple): Positional arguments of func
+            key_inputs (tuple): Values identifying the input data in the cache key,
+                defaults to inputs (e.g. a file hash instead of a path)
+            params (dict): parameter.json entries the stage depends on
+            modules (tuple): Modules implementing the stage, their source is part of the key
+            output_dirs (tuple): Directories func writes its output files to
+
+        Returns:
+            The (possibly cached) return value of func
+        """
+        # every stage is a record of the active profiler (see profiling.py)
+        rows_in = len(inputs[0]) if inputs and isinstance(inputs[0], pd.DataFrame) else None
+        with step(stage, rows_in) as record:
+            result, record['cached'] = self._run(stage, func, inputs, key_inputs, params, modules, output_dirs)
+            if isinstance(result, pd.DataFrame):
+                record['rows_out'] = len(result)
+        return result
+
+    def _run(self, stage, func, inputs, key_inputs, params, modules, output_dirs):
+        """run without the profiling record; returns the result and whether it came from the cache"""
+        if not self.enabled:
+            return func(*inputs), False
+
+        key = self.key(stage, inputs if key_inputs is None else key_inputs, params, modules)
+        entry_dir = os.path.join(self.cache_dir, key)
+        index = self._load_index()
+
+        if key in index and stage not in self.force and 'all' not in self.force:
+            start = time.time()
+            for path in index[key]['outputs']:
+                _copy(os.path.join(entry_dir, 'outputs', path), path)
+            with open(os.path.join(entry_dir, 'result.pkl'), 'rb') as f:
+                result = pickle.load(f)
+            index[key]['last_used'] = time.time()
+            self._save_index(index)
+            print(f'Stage {stage}: loaded from cache in {time.time() - start:.3f}s')
+            return result, True
+
+        global _declared
+        before = _snapshot(output_dirs)
+        previous, _declared = _declared, set()
+        try:
+            result = func(*inputs)
+            declared = _declared
+        finally:
+            _declared = previous
+        after = _snapshot(output_dirs)
+        outputs = [path for path, mtime in after.items() if before.get(path) != mtime]
+        outputs += sorted(path for path in declared if path not in outputs and os.path.isfile(path))
+
+        tmp_dir = entry_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, 'result.pkl'), 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for path in outputs:
+            _copy(path, os.path.join(tmp_dir, 'outputs', path))
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+
+        # the index may have changed while func ran (e.g. in another process), re-read it
+        index = self._load_index()
+        index[key] = {'stage': stage, 'size': _path_size(entry_dir), 'last_used': time.time(), 'outputs': outputs}
+        self._evict(index)
+        self._save_index(index)
+        return result, False
+
+    def _evict(self, index):
+        """Drop least recently used entries until the cache fits into max_bytes"""
+        total = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= index[key]['size']
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            del index[key]
@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from config import load_config
+from dedup import PersIndex, write_cluster_report
+from moments import Moments
+from outcomes import compute_outcomes
+from regional_imputation import REGIONAL_COLUMNS, impute_regional_values, merge_lookups, region_lookup, write_fill_counts
+from sample_selection import as_mask, write_sample_sizes
+from plot_by_nan import write_nan_statistics
+from profiling import step as profile_step
+from sample_statistics import write_sample_statistics
+
+
+def _merge(total, part):
+    """Add the Moments of a chunk to the running total (None before the first chunk)"""
+    return part if total is None else total + part
+
+
+class NanStatistics:
+    """Streaming replacement for record_nan_statistics: NaN counts and NaN vs no-NaN covariate moments"""
+
+    def __init__(self, X):
+        self.X = X
+        self.n_rows = 0
+        self.nan_counts = None
+        self.nan_moments = None
+        self.no_nan_moments = None
+
+    def __call__(self, df, alive, columns):
+        in_sample = df.loc[alive, columns]
+        nan_counts = in_sample.isna().sum()
+        self.nan_counts = nan_counts if self.nan_counts is None else self.nan_counts.add(nan_counts, fill_value=0)
+        self.n_rows += len(in_sample)
+
+        has_nan = in_sample.isna().any(axis=1)
+        self.nan_moments = _merge(self.nan_moments, Moments.of(in_sample.loc[has_nan, self.X], self.X))
+        self.no_nan_moments = _merge(self.no_nan_moments, Moments.of(in_sample.loc[~has_nan, self.X], self.X))
+
+
+def _append_csv(df, path, first):
+    df.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+
+def apply_steps(chunk, steps, alive=None):
+    """Evaluate row-local selection steps on a chunk; returns the surviving mask, the per-step survivor counts and remaining columns"""
+    if alive is None:
+        alive = np.ones(len(chunk), dtype=bool)
+    columns = list(chunk.columns)
+    sizes = []
+    for step in steps:
+        if step.report is not None:
+            step.report(chunk, alive, columns)
+        alive &= as_mask(step.mask(chunk, alive, columns))
+        sizes.append(int(alive.sum()))
+        columns = [col for col in columns if col not in step.drop_columns]
+    return alive, sizes, columns
+
+
+def preprocess_streaming(csv_path, out_path='output_data/preprocessed.csv', chunksize=100_000,
+                         distribution_columns=('AGE', 'SCHOOL', 'SEX'), config=None, columns=None):
+    """
+    Chunked version of load_data + preprocess_data + check_distribution + sample_statistics.
+
+    A first cheap pass reads only the regional columns to build the per-REGION lookup
+    table of the imputation. Pass 1 reads the raw csv in chunks, computes the outcomes,
+    imputes the regional values and applies the row-local selection steps before the duplicate check,
+    appending the survivors to a temporary csv while counting PERS occurrences in a PersIndex.
+    Pass 2 reads the survivors back in chunks, drops every PERS seen more than once
+    (keep=False) and applies the remaining steps. All reports (sample_sizes.txt,
+    nan_percentage.txt, nan_statistics.txt, distribution_comparison.txt and
+    sample_statistics.txt) are built from statistics accumulated per chunk, so memory
+    is bounded by the chunk size plus one counter entry per surviving PERS.
+
+    Args:
+        csv_path (str): Path to the raw csv file
+        out_path (str): Where the preprocessed sample is written
+        chunksize (int): Number of rows per chunk
+        distribution_columns (tuple): Columns compared by the distribution check
+        config (Config): The model specification, loaded from parameter.json if None
+        columns (list): Raw columns to read (see raw_columns in main_data_preprocess), all if None
+
+    Returns:
+        str: out_path
+    """
+    # imported here, main_data_preprocess imports this module for main()
+    from main_data_preprocess import selection_steps, write_distribution_comparison, write_nan_percentage
+
+    X = (config or load_config()).x
+
+    nan_stats = NanStatistics(X)
+    steps = [step for step in selection_steps(nan_report=nan_stats) if step.enabled]
+    split = next((i for i, step in enumerate(steps) if not step.row_local), len(steps))
+    if any(not step.row_local for step in steps[split + 1:]):
+        raise ValueError("Only one non row-local selection step is supported in streaming mode")
+    first_steps, dedup_step, last_steps = steps[:split], steps[split:split + 1], steps[split + 1:]
+
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    survivors_path = out_path + '.pass1.csv'
+
+    # the regional lookup table needs all rows, build it from the regional columns first
+    lookup = None
+    with profile_step('region_lookup'):
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=['REGION'] + REGIONAL_COLUMNS):
+            lookup = merge_lookups(lookup, region_lookup(chunk))
+
+    # pass 1: row-local steps up to the duplicate check
+    initial_size = 0
+    sizes = np.zeros(len(steps), dtype=np.int64)
+    raw_moments = None
+    pers_index = PersIndex()
+    sal_total = None
+    fill_counts = None
+    first = True
+    with profile_step('pass1') as record:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=columns):
+            initial_size += len(chunk)
+            raw_moments = _merge(raw_moments, Moments.of(chunk, list(distribution_columns)))
+
+            chunk = pd.concat([chunk, compute_outcomes(chunk)], axis=1)
+            sal = chunk.groupby('PTYPE')['SAL_AVG'].agg(['sum', 'count'])
+            sal_total = sal if sal_total is None else sal_total.add(sal, fill_value=0)
+            counts = impute_regional_values(chunk, lookup)
+            fill_counts = counts if fill_counts is None else fill_counts.add(counts, fill_value=0)
+
+            alive, chunk_sizes, kept_columns = apply_steps(chunk, first_steps)
+            sizes[:split] += chunk_sizes
+            survivors = chunk.loc[alive, kept_columns]
+            _append_csv(survivors, survivors_path, first)
+            first = False
+
+            if dedup_step:
+                pers_index.update(survivors['PERS'])
+        n_survivors = int(sizes[split - 1]) if split else initial_size
+        record.update(rows_in=initial_size, rows_out=n_survivors)
+
+    print("\nAverage Salary by Program Type:")
+    print(sal_total['sum'] / sal_total['count'])
+    write_fill_counts(fill_counts)
+
+    # pass 2: duplicate check (keep=False) and the remaining steps
+    if dedup_step:
+        pers_index.save()
+        write_cluster_report(pers_index)
+    processed_moments = None
+    ptype_moments = None
+    first = True
+    with profile_step('pass2', rows_in=n_survivors) as record:
+        for chunk in pd.read_csv(survivors_path, chunksize=chunksize):
+            alive = np.ones(len(chunk), dtype=bool)
+            if dedup_step:
+                alive = ~pers_index.duplicated(chunk['PERS'])
+                sizes[split] += int(alive.sum())
+            alive, chunk_sizes, sample_columns = apply_steps(chunk, last_steps, alive)
+            sizes[split + 1:] += chunk_sizes
+            chunk = chunk.loc[alive, sample_columns]
+            _append_csv(chunk, out_path, first)
+            first = False
+
+            processed_moments = _merge(processed_moments, Moments.of(chunk, list(distribution_columns)))
+            ptype_moments = _merge(ptype_moments, Moments.of(chunk, list(chunk.columns), by='PTYPE'))
+        record['rows_out'] = int(sizes[-1]) if len(sizes) else n_survivors
+    os.remove(survivors_path)
+
+    with profile_step('reports'):
+        write_nan_percentage(nan_stats.nan_counts, nan_stats.n_rows)
+        write_nan_statistics(X, nan_stats.nan_moments, nan_stats.no_nan_moments)
+        write_sample_sizes("output_data/sample_sizes.txt", initial_size, [step.label for step in steps], sizes.tolist())
+        print('Sample size information saved to output_data/sample_sizes.txt')
+        write_distribution_comparison(list(distribution_columns), raw_moments, processed_moments)
+        write_sample_statistics(sample_columns, ptype_moments)
+    return out_path
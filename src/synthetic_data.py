@@ -0,0 +1,166 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from outcomes import QUARTERS, YEARS, panel_columns
+
+N_REGIONS = 85
+# shares of PTYPE 0-4 (no programme, T1, T2, E1, E2) before cancellations
+PTYPE_SHARES = [0.60, 0.15, 0.10, 0.10, 0.05]
+NATION_SHARES = [0.60, 0.15, 0.10, 0.10, 0.05]
+# share of programme participants whose course was cancelled (C_T* = 1, PTYPE = 0)
+CANCELLED_SHARE = 0.25
+# share of rows that reuse the PERS of another row
+DUPLICATE_SHARE = 0.02
+# share of missing values per column; the sector shares are mostly complete
+NAN_RATE = 0.01
+SECTOR_NAN_RATE = 0.0002
+COLUMNS = (['PERS', 'AGE', 'SEX', 'SCHOOL', 'VOC_DEG', 'NATION', 'REGION', 'REG_AL', 'REG_PRG', 'REG_SER', 'REG_PRO',
+            'REG_AGRI', 'SECT_AL', 'PROF_AL', 'SPECIA_CW', 'SHP_CW_1', 'SHP_CW_2', 'SHP_CW_3', 'SHP_CW_4', 'UNEM_X0',
+            'OLF_X0', 'EMPL_X0', 'EARN_X0'] + panel_columns('EMPLX') + panel_columns('EARNX')
+           + ['LMP_CW', 'PTYPE', 'C_T1', 'C_T2', 'C_T3', 'C_T4', 'DURAT', 'PROF_XL'])
+# columns without missing values
+COMPLETE_COLUMNS = ['PERS', 'PTYPE', 'C_T1', 'C_T2', 'C_T3', 'C_T4']
+
+
+def region_table(seed=0):
+    """Regional values (REG_*) of the regions 1-85, constant for all persons of a region"""
+    rng = np.random.default_rng([seed, 0])
+    sectors = rng.dirichlet([6, 4, 1.5], N_REGIONS) * 100
+    return pd.DataFrame({
+        'REG_AL': rng.uniform(2, 10, N_REGIONS),
+        'REG_PRG': rng.uniform(0, 1, N_REGIONS),
+        'REG_SER': sectors[:, 0],
+        'REG_PRO': sectors[:, 1],
+        'REG_AGRI': sectors[:, 2],
+    }, index=pd.RangeIndex(1, N_REGIONS + 1, name='REGION'))
+
+
+def _employment_panel(rng, employability, treated, n):
+    """EMPLX panel (n, 9, 4) as a persistent Markov chain; programmes raise employment from 19X3 onwards"""
+    states = np.empty((n, len(YEARS), len(QUARTERS)), dtype=np.int8)
+    state = None
+    for y, year in enumerate(YEARS):
+        p_employed = 1 / (1 + np.exp(-(employability + 0.4 * treated * (year >= 3))))
+        for q in range(len(QUARTERS)):
+            u = rng.uniform(size=n)
+            draw = np.where(u < p_employed, 1, np.where(u < p_employed + (1 - p_employed) * 0.6, 2, 3))
+            state = draw if state is None else np.where(rng.uniform(size=n) < 0.8, state, draw)
+            states[:, y, q] = state
+    return states
+
+
+def synthetic_chunk(n, seed=0, first_pers=1, chunk=0):
+    """
+    n synthetic rows with the columns of West.csv (see load_data), PERS numbered from first_pers.
+
+    Program assignment depends on the labour market prospects and age, employment and
+    earnings on schooling, vocational degree and sex, so the propensity scores and
+    treatment effects are not trivial. Duplicated PERS reuse the id of another row
+    (not necessarily of the same chunk); the rest of such a row is an independent draw.
+    """
+    rng = np.random.default_rng([seed, chunk + 1])
+    regions = region_table(seed)
+    cols = {}
+
+    pers = np.arange(first_pers, first_pers + n, dtype=np.int64)
+    duplicate = rng.uniform(size=n) < DUPLICATE_SHARE
+    pers[duplicate] = rng.integers(1, first_pers + n, duplicate.sum())
+    cols['PERS'] = pers
+    age = rng.integers(25, 56, n)
+    sex = rng.integers(1, 3, n)
+    school = rng.choice([8, 9, 10, 11, 12], n, p=[0.1, 0.25, 0.3, 0.2, 0.15])
+    voc_deg = rng.choice([0, 1, 2], n, p=[0.35, 0.45, 0.2])
+    lmp = rng.integers(1, 5, n)
+    cols.update(AGE=age, SEX=sex, SCHOOL=school, VOC_DEG=voc_deg,
+                NATION=rng.choice(np.arange(1, 6), n, p=NATION_SHARES))
+    region = rng.integers(1, N_REGIONS + 1, n)
+    cols['REGION'] = region
+    for col in regions.columns:
+        cols[col] = regions[col].to_numpy()[region - 1]
+    cols['SECT_AL'] = rng.gamma(4, 1.5, n)
+    cols['PROF_AL'] = rng.gamma(4, 1.5, n)
+    cols['SPECIA_CW'] = rng.uniform(0, 100, n)
+    shares = rng.dirichlet([3, 2, 2, 1, 1], n) * 100
+    for k in range(4):
+        cols[f'SHP_CW_{k + 1}'] = shares[:, k]
+
+    # months per year in the 10 years before 19X1
+    employability = 0.5 * (lmp - 2.5) + 0.15 * (school - 10) + 0.3 * voc_deg - 0.03 * (age - 40) + rng.normal(0, 0.5, n)
+    months = rng.dirichlet([2, 1, 1], n) * 12
+    months[:, 0] = np.clip(months[:, 0] * np.exp(0.3 * employability), 0, 12)
+    rest = months[:, 1] + months[:, 2]
+    scale = np.divide(12 - months[:, 0], rest, out=np.zeros(n), where=rest > 0)
+    cols['UNEM_X0'] = months[:, 1] * scale
+    cols['OLF_X0'] = months[:, 2] * scale
+    cols['EMPL_X0'] = months[:, 0]
+    wage = np.exp(7.7 + 0.08 * (school - 8) + 0.15 * voc_deg - 0.15 * (sex == 2) + rng.normal(0, 0.35, n))
+    cols['EARN_X0'] = wage * months[:, 0] / 12
+
+    # persons with bad prospects are sent to programmes more often, older persons less
+    logits = np.log(PTYPE_SHARES) + np.outer(-0.3 * (lmp - 2.5) - 0.02 * (age - 40), [0, 1, 1, 0.5, 0.5])
+    probs = np.exp(logits)
+    probs /= probs.sum(axis=1, keepdims=True)
+    ptype = (rng.uniform(size=(n, 1)) > probs.cumsum(axis=1)).sum(axis=1).clip(max=4)
+    cancelled = (ptype > 0) & (rng.uniform(size=n) < CANCELLED_SHARE)
+
+    empl = _employment_panel(rng, employability, np.isin(ptype, [1, 2]) & ~cancelled, n)
+    growth = np.exp(np.cumsum(rng.normal(0.005, 0.02, (n, len(YEARS) * len(QUARTERS))), axis=1))
+    earn = np.where(empl.reshape(n, -1) == 1, wage[:, None] * growth, 0.0)
+    for name, value in zip(panel_columns('EMPLX'), empl.reshape(n, -1).T):
+        cols[name] = value
+    for name, value in zip(panel_columns('EARNX'), earn.T):
+        cols[name] = value
+
+    cols['LMP_CW'] = lmp
+    for k in range(1, 5):
+        cols[f'C_T{k}'] = (cancelled & (ptype == k)).astype(np.int8)
+    cols['PTYPE'] = np.where(cancelled, 0, ptype)
+    cols['DURAT'] = rng.integers(1, 12, n)
+    cols['PROF_XL'] = rng.uniform(0, 10, n)
+
+    df = pd.DataFrame(cols)[COLUMNS]
+    for col in df.columns:
+        if col in COMPLETE_COLUMNS:
+            continue
+        rate = SECTOR_NAN_RATE if col in ('REG_SER', 'REG_PRO', 'REG_AGRI') else NAN_RATE
+        missing = rng.uniform(size=n) < rate
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype('Int64').mask(missing)
+        else:
+            # 2 decimals are enough for shares and earnings and make the csv smaller and faster to write
+            df[col] = df[col].round(2).mask(missing)
+    return df
+
+
+def generate(n, seed=0):
+    """n synthetic rows in memory (use write_synthetic_csv for large n)"""
+    return synthetic_chunk(n, seed)
+
+
+def write_synthetic_csv(path, n, seed=0, chunksize=500_000):
+    """
+    Write n synthetic rows to path in chunks, so 10^7 rows need no more memory than one chunk.
+
+    The same n, seed and chunksize always give the same file.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    for chunk, start in enumerate(range(0, n, chunksize)):
+        df = synthetic_chunk(min(chunksize, n - start), seed, first_pers=start + 1, chunk=chunk)
+        df.to_csv(tmp_path, mode='w' if chunk == 0 else 'a', header=chunk == 0, index=False)
+    os.replace(tmp_path, path)
+    print(f'{n} synthetic rows saved to {path}')
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic register extract with the schema of West.csv')
+    parser.add_argument('rows', type=int, help='number of rows, e.g. 10000 or 10000000')
+    parser.add_argument('--out', default='CML_public/synthetic.csv', help='output csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=500_000, help='rows generated at a time')
+    args = parser.parse_args()
+    write_synthetic_csv(args.out, args.rows, args.seed, args.chunksize)
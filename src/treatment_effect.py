@@ -1,103 +1,389 @@
 from mcf.mcf_functions import ModifiedCausalForest
 from mcf.reporting import McfOptPolReport
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version
+import multiprocessing
 import matplotlib
+import numpy as np
 import pandas as pd
-import json
+import argparse
 import os
+import pickle
 import shutil
 
-def run_treatment_effect_analysis(df):
+from config import load_config
+from profiling import record_job, step, timed
+from stage_cache import fingerprint
+
+MODEL_FILE = 'forest.pkl'
+
+def forest_fingerprint(forest_kwargs):
+    """Hash of the forest specification and the mcf version a model was trained with"""
+    return fingerprint({'forest_kwargs': forest_kwargs, 'mcf': version('mcf')})
+
+def save_forest(mymcf, forest_kwargs, path):
+    """Pickle a trained forest together with its specification and fingerprint"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'fingerprint': forest_fingerprint(forest_kwargs), 'forest_kwargs': forest_kwargs, 'mcf': mymcf},
+                    f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_forest(path, forest_kwargs):
     """
-    Run treatment effect analysis using ModifiedCausalForest on the input dataframe.
-    
-    Args:
-        df (pd.DataFrame): Input dataframe containing the preprocessed data
-        
-    Returns:
-        tuple: Results from the analysis and the MCF model
+    Load a forest saved by save_forest.
+
+    Raises a ValueError if the model was trained with other variables than forest_kwargs
+    (e.g. parameter.json changed since training) or with another mcf version.
     """
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved['fingerprint'] != forest_fingerprint(forest_kwargs):
+        mismatched = {key: (saved['forest_kwargs'].get(key), value) for key, value in forest_kwargs.items()
+                      if saved['forest_kwargs'].get(key) != value}
+        raise ValueError(f"Forest in {path} does not match the current specification "
+                         f"(trained, current): {mismatched or 'mcf version changed'}")
+    return saved['mcf']
 
-    for dir_name in ['output_treatment_effect', 'output_treatment_effect_placebo']:
-        if os.path.exists(dir_name):
-            shutil.rmtree(dir_name)
+def fit_forest(training_df, prediction_df, forest_kwargs, outpath, mp_parallel=None):
+    """
+    Train a ModifiedCausalForest, predict on prediction_df and write the report to outpath.
 
-    # Split data into training and prediction sets
-    df_shuffled = df.sample(frac=1, random_state=42).reset_index(drop=True)
-    split_idx = len(df_shuffled) // 2
-    training_df = df_shuffled.iloc[:split_idx]
-    print(f"Training set size: {len(training_df)}")
-    prediction_df = df_shuffled.iloc[split_idx:]
-    print(f"Prediction set size: {len(prediction_df)}")
+    The trained forest is saved to outpath/forest.pkl, see predict_treatment_effect.
+    Runs as a standalone job (see run_treatment_effect_analysis), so it only uses its arguments.
 
-    # import parameter json
-    with open('src/parameter.json', 'r') as f:
-        parameter = json.load(f)
-    
-    # Parameters of the ModifiedCausalForest
-    VAR_D_NAME = parameter['treatment']  # Name of treatment variable
-    VAR_Y_NAME = parameter['outcome_variables']
-    VAR_X_NAME_ORD = parameter['ord_covariates']
-    VAR_X_NAME_UNORD = parameter['unord_covariates']
-    VAR_Z_NAME_ORD = parameter['ord_Z']
-    VAR_Z_NAME_UNORD = parameter['unord_Z']
+    Args:
+        training_df (pd.DataFrame): Data the forest is trained on
+        prediction_df (pd.DataFrame): Data the effects are predicted for
+        forest_kwargs (dict): Variable names passed to ModifiedCausalForest
+        outpath (str): Output directory of this forest
+        mp_parallel (int): Number of processes the forest may use, None for the mcf default
+
+    Returns:
+        dict: The prediction results of mcf
+    """
+    matplotlib.use('Agg') # to avoid that plots show up and stop the execution
 
     mymcf = ModifiedCausalForest(
-        var_d_name=VAR_D_NAME,
-        var_y_name=VAR_Y_NAME,
-        var_x_name_ord=VAR_X_NAME_ORD,
-        var_x_name_unord=VAR_X_NAME_UNORD,
-        var_z_name_ord=VAR_Z_NAME_ORD,
-        var_z_name_unord=VAR_Z_NAME_UNORD,
+        **forest_kwargs,
         _int_show_plots=False,
         gen_output_type=2,
-        gen_outpath='output_treatment_effect'
+        gen_mp_parallel=mp_parallel,
+        gen_outpath=outpath
         )
 
-    matplotlib.use('Agg') # to avoid that plots show up and stop the execution 
     mymcf.train(training_df)
-    results, _ = mymcf.predict(prediction_df) 
-    
+    save_forest(mymcf, forest_kwargs, os.path.join(outpath, MODEL_FILE))
+    results, _ = mymcf.predict(prediction_df)
+
     try:
         results_with_cluster_id_df, _ = mymcf.analyse(results)
     except TypeError:
         pass
-    
-    my_report = McfOptPolReport(mcf=mymcf, outputfile='Modified-Causal-Forest_Report', outputpath='output_treatment_effect')
+
+    my_report = McfOptPolReport(mcf=mymcf, outputfile='Modified-Causal-Forest_Report', outputpath=outpath)
     my_report.report()
-    print('End of computations.')
+    return results
 
+def forest_jobs(config):
+    """
+    Forest specifications of the analysis: the main forest and the placebo forest.
 
-    # palcebo test 
-    # the idea is to check if the treatment effect has effect on past earnings
-    # if it does, then the treatment effect is not due to the fact that the program is effective
-    # we hope that the treatment effect is not due to past earnings
-    
-    # so we remove past earnings from the model and see if the treatment effect is still significant
-    VAR_X_NAME_ORD.remove('EARN_X0')
+    Returns:
+        list: (name, forest_kwargs, outpath) per forest
+    """
+    # Parameters of the ModifiedCausalForest
+    VAR_D_NAME = config.treatment  # Name of treatment variable
+    VAR_Y_NAME = config.outcome_variables
+    VAR_X_NAME_ORD = config.ord_covariates
+    VAR_X_NAME_UNORD = config.unord_covariates
+    VAR_Z_NAME_ORD = config.ord_z
+    VAR_Z_NAME_UNORD = config.unord_z
 
-    mymcf = ModifiedCausalForest(
+    main_forest = dict(
         var_d_name=VAR_D_NAME,
-        var_y_name=['EARN_X0'],
+        var_y_name=VAR_Y_NAME,
         var_x_name_ord=VAR_X_NAME_ORD,
         var_x_name_unord=VAR_X_NAME_UNORD,
         var_z_name_ord=VAR_Z_NAME_ORD,
         var_z_name_unord=VAR_Z_NAME_UNORD,
-        _int_show_plots=False,
-        gen_output_type=2,
-        gen_outpath='output_treatment_effect_placebo'
         )
 
-    matplotlib.use('Agg') # to avoid that plots show up and stop the execution 
-    mymcf.train(training_df)
-    results, _ = mymcf.predict(prediction_df) 
-    
+    # palcebo test
+    # the idea is to check if the treatment effect has effect on past earnings
+    # if it does, then the treatment effect is not due to the fact that the program is effective
+    # we hope that the treatment effect is not due to past earnings
+
+    # so we remove past earnings from the model and see if the treatment effect is still significant
+    placebo_forest = dict(
+        main_forest,
+        var_y_name=['EARN_X0'],
+        var_x_name_ord=[x for x in VAR_X_NAME_ORD if x != 'EARN_X0'],
+        )
+
+    return [
+        ('main', main_forest, 'output_treatment_effect'),
+        ('placebo', placebo_forest, 'output_treatment_effect_placebo'),
+    ]
+
+def split_sample(df, seed=42):
+    """Shuffle df and split it in half into a training and a prediction set"""
+    # Split data into training and prediction sets
+    df_shuffled = df.sample(frac=1, random_state=seed).reset_index(drop=True)
+    split_idx = len(df_shuffled) // 2
+    training_df = df_shuffled.iloc[:split_idx]
+    print(f"Training set size: {len(training_df)}")
+    prediction_df = df_shuffled.iloc[split_idx:]
+    print(f"Prediction set size: {len(prediction_df)}")
+    return training_df, prediction_df
+
+def run_treatment_effect_analysis(df, max_workers=2, cores_per_forest=None, config=None):
+    """
+    Run treatment effect analysis using ModifiedCausalForest on the input dataframe.
+
+    The main forest and the placebo forest are independent, so they run as separate
+    jobs in a process pool, each writing to its own output directory.
+
+    Args:
+        df (pd.DataFrame): Input dataframe containing the preprocessed data
+        max_workers (int): Number of forests fitted at the same time, 1 runs them one after another
+        cores_per_forest (int): Processes each forest may use; defaults to the
+            available cores divided by max_workers so the forests don't oversubscribe the machine
+        config (Config): The model specification, loaded from parameter.json if None
+
+    Returns:
+        dict: Prediction results per forest ('main', 'placebo')
+    """
+
+    for dir_name in ['output_treatment_effect', 'output_treatment_effect_placebo']:
+        if os.path.exists(dir_name):
+            shutil.rmtree(dir_name)
+
+    training_df, prediction_df = split_sample(df)
+
+    jobs = forest_jobs(config or load_config())
+    if cores_per_forest is None:
+        cores_per_forest = max(1, (os.cpu_count() or 1) // max(1, min(max_workers, len(jobs))))
+
+    # every forest is a record of the active profiler (see profiling.py)
+    results = {}
+    if max_workers <= 1:
+        for name, forest_kwargs, outpath in jobs:
+            with step(name, rows_in=len(training_df)):
+                results[name] = fit_forest(training_df, prediction_df, forest_kwargs, outpath, cores_per_forest)
+    else:
+        # spawn instead of fork: every forest starts its own ray/numba runtime in a clean process
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {name: pool.submit(timed, fit_forest, training_df, prediction_df, forest_kwargs, outpath,
+                                         cores_per_forest)
+                       for name, forest_kwargs, outpath in jobs}
+            for name, future in futures.items():
+                results[name], timing = future.result()
+                record_job(name, timing, rows_in=len(training_df))
+
+    print('End of computations (main forest and placebo test).')
+    return results
+
+def predict_treatment_effect(prediction_df, forest='main', outpath=None, config=None):
+    """
+    Predict the treatment effects of new data with a forest saved by a previous run.
+
+    The forest is only reused if its variables still match parameter.json.
+
+    Args:
+        prediction_df (pd.DataFrame): Data the effects are predicted for
+        forest (str): Name of the forest in forest_jobs ('main' or 'placebo')
+        outpath (str): Where the IATEs are written, defaults to <forest output>/predict
+        config (Config): The model specification, loaded from parameter.json if None
+
+    Returns:
+        dict: The prediction results of mcf
+    """
+    matplotlib.use('Agg')
+
+    forest_kwargs, model_dir = next((kwargs, path) for name, kwargs, path in forest_jobs(config or load_config())
+                                    if name == forest)
+    mymcf = load_forest(os.path.join(model_dir, MODEL_FILE), forest_kwargs)
+
+    results, _ = mymcf.predict(prediction_df)
     try:
         results_with_cluster_id_df, _ = mymcf.analyse(results)
     except TypeError:
         pass
-    
-    my_report = McfOptPolReport(mcf=mymcf, outputfile='Modified-Causal-Forest_Report', outputpath='output_treatment_effect_placebo')
-    my_report.report()
-    print('End of computations placebo test.')
-    
-    return 
\ No newline at end of file
+
+    if outpath is None:
+        outpath = os.path.join(model_dir, 'predict')
+    os.makedirs(outpath, exist_ok=True)
+    results['iate_data_df'].to_csv(os.path.join(outpath, 'iate.csv'), index=False)
+    print(f'Predictions of the saved {forest} forest saved to {outpath}')
+    return results
+
+def effect_names(results):
+    """Names like '1vs0' for the effects in the mcf ate array"""
+    return [f'{treated}vs{control}' for treated, control in results['ate_effect_list']]
+
+def ate_table(ate, outcomes, effects, ate_se=None):
+    """Long table (outcome, effect, ate[, ate_se]) from (n_outcomes, n_effects) arrays"""
+    return pd.DataFrame([
+        {'outcome': outcome, 'effect': effect, 'ate': ate[o, e], **({} if ate_se is None else {'ate_se': ate_se[o, e]})}
+        for o, outcome in enumerate(outcomes) for e, effect in enumerate(effects)
+    ])
+
+def pool_folds(estimates, ses, sizes):
+    """
+    Cross-fitted estimate and standard error from the held-out estimates of the folds.
+
+    The estimate is the size weighted mean of the fold estimates. Its variance is the
+    variance of the pooled out-of-fold scores divided by N: mcf does not export the scores,
+    but their within-fold variance is n_k se_k^2, so by the law of total variance
+    Var = (sum_k n_k^2 se_k^2 + sum_k n_k (theta_k - theta)^2) / N^2. The second term is
+    the dispersion between the folds, which also picks up differences between their forests.
+    Folds with size 0 (e.g. a Z value missing from a held-out part) get no weight.
+
+    Args:
+        estimates, ses (numpy.ndarray): Fold estimates and standard errors, (n_folds, ...)
+        sizes (numpy.ndarray): Held-out sizes, broadcastable to estimates
+
+    Returns:
+        tuple: Estimate and standard error, shaped like estimates[0]
+    """
+    sizes = np.broadcast_to(np.asarray(sizes, dtype=float), np.shape(estimates))
+    n = sizes.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = sizes / n
+        estimates, ses = np.where(sizes > 0, estimates, 0), np.where(sizes > 0, ses, 0)
+        estimate = (weights * estimates).sum(axis=0)
+        variance = ((sizes * ses) ** 2).sum(axis=0) / n ** 2 + (sizes * (estimates - estimate) ** 2).sum(axis=0) / n ** 2
+    return np.where(n > 0, estimate, np.nan), np.where(n > 0, np.sqrt(variance), np.nan)
+
+def gate_table(fold_results, held_out, outcomes, effects):
+    """
+    Cross-fitted GATEs per value of each Z variable (see pool_folds), as a long table
+    (z_name, z_value, outcome, effect, gate, gate_se, n).
+
+    Each fold contributes the GATEs mcf estimated on its held-out part, weighted by the
+    number of held-out rows with that Z value; values mcf binned (continuous Z) are
+    weighted by the held-out size and have no n.
+    """
+    if fold_results[0].get('gate') is None:
+        return pd.DataFrame(columns=['z_name', 'z_value', 'outcome', 'effect', 'gate', 'gate_se', 'n'])
+    rows = []
+    for j, z in enumerate(fold_results[0]['gate_names_values']['z_names_list']):
+        # mcf lower-cases the variable names
+        z_name = next((col for col in held_out[0].columns if col.lower() == z.lower()), z)
+        values = sorted(set().union(*(r['gate_names_values'][z] for r in fold_results)))
+        gate = np.full((len(fold_results), len(values), len(outcomes), len(effects)), np.nan)
+        gate_se, sizes = gate.copy(), np.zeros((len(fold_results), len(values), 1, 1))
+        counted = np.zeros(len(values), dtype=bool)
+        for k, (r, df) in enumerate(zip(fold_results, held_out)):
+            counts = df[z_name].value_counts() if z_name in df.columns else pd.Series(dtype=float)
+            for v, value in enumerate(r['gate_names_values'][z]):
+                i = values.index(value)
+                gate[k, i] = np.asarray(r['gate'][j])[v, :len(outcomes), 0, :len(effects)]
+                gate_se[k, i] = np.asarray(r['gate_se'][j])[v, :len(outcomes), 0, :len(effects)]
+                counted[i] |= value in counts.index
+                sizes[k, i] = counts.get(value, len(df))
+        estimate, se = pool_folds(gate, gate_se, sizes)
+        n = np.where(counted, sizes[:, :, 0, 0].sum(axis=0), np.nan)
+        rows += [{'z_name': z_name, 'z_value': value, 'outcome': outcome, 'effect': effect,
+                  'gate': estimate[i, o, e], 'gate_se': se[i, o, e], 'n': n[i]}
+                 for i, value in enumerate(values) for o, outcome in enumerate(outcomes)
+                 for e, effect in enumerate(effects)]
+    return pd.DataFrame(rows)
+
+def aggregate_folds(fold_results, held_out, outcomes):
+    """
+    Combine the results of the cross-fitting folds.
+
+    Every fold estimated the ATE and the GATEs on its held-out part; they are pooled with
+    the out-of-fold score variance (see pool_folds). The out-of-fold IATEs are stacked.
+
+    Args:
+        fold_results (list): mcf prediction results per fold
+        held_out (list): Held-out part of every fold (pd.DataFrame)
+        outcomes (list): Outcome variables, in the order of the mcf arrays
+
+    Returns:
+        tuple: ATE table, GATE table and the pooled IATEs (pd.DataFrame)
+    """
+    effects = effect_names(fold_results[0])
+    sizes = np.array([len(df) for df in held_out], dtype=float)[:, None, None]
+    ate, ate_se = pool_folds(np.stack([np.asarray(r['ate'])[:, 0, :len(effects)] for r in fold_results]),
+                             np.stack([np.asarray(r['ate_se'])[:, 0, :len(effects)] for r in fold_results]), sizes)
+    ate_df = ate_table(ate, outcomes, effects, ate_se)
+    gate_df = gate_table(fold_results, held_out, outcomes, effects)
+    iate_df = pd.concat([r['iate_data_df'].assign(fold=k) for k, r in enumerate(fold_results)], ignore_index=True)
+    return ate_df, gate_df, iate_df
+
+def run_crossfit_analysis(df, n_folds=5, max_workers=None, cores_per_forest=None, seed=42,
+                          outpath='output_treatment_effect_crossfit', config=None):
+    """
+    K-fold cross-fitting version of run_treatment_effect_analysis.
+
+    Every fold trains a forest on the other K-1 parts and predicts the IATEs of its
+    held-out part, so each observation gets an out-of-fold IATE and no data is only
+    used for training. Folds run as parallel jobs; the fold split and the forest seed
+    of every fold are derived from seed, so reruns are reproducible.
+
+    Args:
+        df (pd.DataFrame): Input dataframe containing the preprocessed data
+        n_folds (int): Number of folds K
+        max_workers (int): Folds fitted at the same time, defaults to n_folds
+        cores_per_forest (int): Processes each forest may use, defaults to cores / max_workers
+        seed (int): Seed of the fold split and the forests
+        outpath (str): Output directory; fold reports go to fold_<k> below it
+        config (Config): The model specification, loaded from parameter.json if None
+
+    Returns:
+        tuple: ATE and GATE tables aggregated over all folds, with standard errors
+    """
+    if os.path.exists(outpath):
+        shutil.rmtree(outpath)
+    os.makedirs(outpath)
+
+    config = config or load_config()
+    _, forest_kwargs, _ = forest_jobs(config)[0]
+
+    df = df.reset_index(drop=True)
+    fold_of_row = np.random.default_rng(seed).permutation(len(df)) % n_folds
+
+    if max_workers is None:
+        max_workers = n_folds
+    if cores_per_forest is None:
+        cores_per_forest = max(1, (os.cpu_count() or 1) // max(1, min(max_workers, n_folds)))
+
+    jobs = []
+    for k in range(n_folds):
+        held_out = fold_of_row == k
+        jobs.append((df[~held_out], df[held_out],
+                     dict(forest_kwargs, _int_seed_sample_split=seed + k),
+                     os.path.join(outpath, f'fold_{k}'), cores_per_forest))
+    print(f"Cross-fitting with {n_folds} folds, held-out sizes: {[len(job[1]) for job in jobs]}")
+
+    fold_results = []
+    if max_workers <= 1:
+        for k, job in enumerate(jobs):
+            with step(f'fold_{k}', rows_in=len(job[0])):
+                fold_results.append(fit_forest(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for k, (job, (result, timing)) in enumerate(zip(jobs, pool.map(timed, [fit_forest] * n_folds, *zip(*jobs)))):
+                record_job(f'fold_{k}', timing, rows_in=len(job[0]))
+                fold_results.append(result)
+
+    ate_df, gate_df, iate_df = aggregate_folds(fold_results, [job[1] for job in jobs], config.outcome_variables)
+    ate_df.to_csv(os.path.join(outpath, 'ate_crossfit.csv'), index=False)
+    gate_df.to_csv(os.path.join(outpath, 'gate_crossfit.csv'), index=False)
+    iate_df.to_csv(os.path.join(outpath, 'iate_crossfit.csv'), index=False)
+    print(ate_df)
+    print(f'Cross-fitted results saved to {outpath}')
+    return ate_df, gate_df
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Predict treatment effects with a saved forest (no retraining)')
+    parser.add_argument('data', help='csv with the covariates of the observations to score')
+    parser.add_argument('--forest', default='main', choices=['main', 'placebo'])
+    parser.add_argument('--outpath', default=None, help='output directory, default: <forest output>/predict')
+    args = parser.parse_args()
+    predict_treatment_effect(pd.read_csv(args.data), args.forest, args.outpath)
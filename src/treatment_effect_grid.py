@@ -0,0 +1,197 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import load_config
+from treatment_effect import effect_names, fit_forest, split_sample
+
+
+def default_grid(config):
+    """
+    Grid used when no grid file is given.
+
+    Outcome sets: all outcomes, the salary outcomes and the employment outcomes.
+    Covariate sets: all covariates and all covariates without EARN_X0.
+    Z sets: the Z variables of parameter.json.
+    All outcome sets share the tree outcome of the main forest, so they need one forest per covariate set.
+    """
+    outcomes = config.outcome_variables
+    return {
+        'tree_outcome': outcomes[0],
+        'outcome_sets': {
+            'all': outcomes,
+            'salary': [y for y in outcomes if y.startswith('SAL_')],
+            'employment': [y for y in outcomes if y.startswith('EMPL_')],
+        },
+        'covariate_sets': {
+            'full': {'ord': config.ord_covariates, 'unord': config.unord_covariates},
+            'no_earn_x0': {'ord': [x for x in config.ord_covariates if x != 'EARN_X0'],
+                           'unord': config.unord_covariates},
+        },
+        'z_sets': {
+            'default': {'ord': config.ord_z, 'unord': config.unord_z},
+        },
+    }
+
+
+def grid_specs(grid):
+    """All (spec name, outcomes, covariate set, Z set) combinations of a grid"""
+    return [
+        (f'{y_name}/{x_name}/{z_name}', outcomes, x_set, z_set)
+        for (y_name, outcomes), (x_name, x_set), (z_name, z_set) in itertools.product(
+            grid['outcome_sets'].items(), grid['covariate_sets'].items(), grid['z_sets'].items())
+    ]
+
+
+def plan_forests(grid, treatment):
+    """
+    Group the specifications of a grid by forest structure.
+
+    Only the tree outcome, the covariates and the Z variables change the forest, the
+    other outcomes are evaluated with the weights of the trained forest. Specifications
+    that agree on these share one forest, which is fitted with the union of their outcomes.
+    The tree outcome is grid['tree_outcome'] if set, otherwise the first outcome of each set.
+
+    Returns:
+        list: (forest_kwargs, [(spec name, outcomes), ...]) per forest
+    """
+    forests = {}
+    for spec, outcomes, x_set, z_set in grid_specs(grid):
+        tree_outcome = grid.get('tree_outcome') or outcomes[0]
+        key = (tree_outcome, tuple(x_set['ord']), tuple(x_set['unord']), tuple(z_set['ord']), tuple(z_set['unord']))
+        if key not in forests:
+            forests[key] = {'outcomes': [tree_outcome], 'specs': []}
+        forests[key]['outcomes'] += [y for y in outcomes if y not in forests[key]['outcomes']]
+        forests[key]['specs'].append((spec, outcomes))
+
+    plan = []
+    for (tree_outcome, x_ord, x_unord, z_ord, z_unord), forest in forests.items():
+        forest_kwargs = dict(
+            var_d_name=treatment,
+            var_y_name=forest['outcomes'],
+            var_y_tree_name=tree_outcome,
+            var_x_name_ord=list(x_ord),
+            var_x_name_unord=list(x_unord),
+            var_z_name_ord=list(z_ord),
+            var_z_name_unord=list(z_unord),
+            )
+        plan.append((forest_kwargs, forest['specs']))
+    return plan
+
+
+def spec_estimates(results, forest_kwargs, spec, outcomes, n):
+    """
+    ATE and GATE rows of one specification with their standard errors, taken from the results of its forest.
+
+    mcf reports the GATEs per Z variable as arrays indexed like the ATE with the Z values
+    in front, (z value, outcome, reference population, effect); the values are listed in
+    results['gate_names_values'].
+    """
+    effects = effect_names(results)
+    forest_outcomes = forest_kwargs['var_y_name']
+    index = [(outcome, forest_outcomes.index(outcome)) for outcome in outcomes]
+    ate = np.asarray(results['ate'])
+    ate_se = np.asarray(results['ate_se'])
+    rows = [{'spec': spec, 'outcome': outcome, 'effect': effect, 'estimand': 'ATE',
+             'z_name': None, 'z_value': None, 'estimate': ate[o, 0, e], 'se': ate_se[o, 0, e], 'n': n}
+            for outcome, o in index for e, effect in enumerate(effects)]
+
+    if results.get('gate') is None:
+        return rows
+    names_values = results['gate_names_values']
+    # mcf lower-cases the variable names
+    z_names = {z.lower(): z for z in forest_kwargs['var_z_name_ord'] + forest_kwargs['var_z_name_unord']}
+    iate_df = results['iate_data_df']
+    for j, z in enumerate(names_values['z_names_list']):
+        gate, gate_se = np.asarray(results['gate'][j]), np.asarray(results['gate_se'][j])
+        z_name = z_names.get(z.lower(), z)
+        counts = iate_df[z].value_counts() if z in iate_df.columns else pd.Series(dtype=float)
+        rows += [{'spec': spec, 'outcome': outcome, 'effect': effect, 'estimand': 'GATE',
+                  'z_name': z_name, 'z_value': value, 'estimate': gate[v, o, 0, e], 'se': gate_se[v, o, 0, e],
+                  'n': counts.get(value, np.nan)}
+                 for outcome, o in index for e, effect in enumerate(effects)
+                 for v, value in enumerate(names_values[z])]
+    return rows
+
+
+def run_outcome_grid(df, grid=None, max_workers=2, cores_per_forest=None, outpath='output_treatment_effect_grid',
+                     config=None):
+    """
+    Estimate the treatment effects of every specification of an outcome x covariate x Z grid.
+
+    Specifications sharing a forest structure (see plan_forests) are fitted once; the
+    remaining forests run as parallel jobs like in run_treatment_effect_analysis, on the
+    same training/prediction split. The ATEs and GATEs of all specifications are collected
+    in outpath/estimates.csv, outpath/forests.csv lists which forest each specification used.
+
+    Args:
+        df (pd.DataFrame): Input dataframe containing the preprocessed data
+        grid (dict): outcome_sets, covariate_sets, z_sets and optionally tree_outcome,
+            defaults to default_grid(config)
+        max_workers (int): Forests fitted at the same time
+        cores_per_forest (int): Processes each forest may use, defaults to cores / max_workers
+        outpath (str): Output directory; the mcf reports go to forest_<i> below it
+        config (Config): The model specification, loaded from parameter.json if None
+
+    Returns:
+        pd.DataFrame: The consolidated estimates
+    """
+    if os.path.exists(outpath):
+        shutil.rmtree(outpath)
+    os.makedirs(outpath)
+
+    config = config or load_config()
+    if grid is None:
+        grid = default_grid(config)
+
+    plan = plan_forests(grid, config.treatment)
+    n_specs = sum(len(specs) for _, specs in plan)
+    print(f'Outcome grid: {n_specs} specifications, {len(plan)} forests')
+
+    training_df, prediction_df = split_sample(df)
+    if cores_per_forest is None:
+        cores_per_forest = max(1, (os.cpu_count() or 1) // max(1, min(max_workers, len(plan))))
+
+    jobs = [(training_df, prediction_df, forest_kwargs, os.path.join(outpath, f'forest_{i}'), cores_per_forest)
+            for i, (forest_kwargs, _) in enumerate(plan)]
+    if max_workers <= 1:
+        forest_results = [fit_forest(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            forest_results = list(pool.map(fit_forest, *zip(*jobs)))
+
+    rows = []
+    forest_rows = []
+    for i, ((forest_kwargs, specs), results) in enumerate(zip(plan, forest_results)):
+        for spec, outcomes in specs:
+            rows += spec_estimates(results, forest_kwargs, spec, outcomes, len(prediction_df))
+            forest_rows.append({'spec': spec, 'forest': f'forest_{i}', 'tree_outcome': forest_kwargs['var_y_tree_name']})
+
+    estimates = pd.DataFrame(rows)
+    estimates.to_csv(os.path.join(outpath, 'estimates.csv'), index=False)
+    pd.DataFrame(forest_rows).to_csv(os.path.join(outpath, 'forests.csv'), index=False)
+    print(estimates[estimates['estimand'] == 'ATE'])
+    print(f'Grid estimates saved to {outpath}/estimates.csv')
+    return estimates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the treatment effect analysis for a grid of specifications')
+    parser.add_argument('--grid', default=None, help='json file with outcome_sets, covariate_sets, z_sets (and tree_outcome)')
+    parser.add_argument('--data', default='output_data/preprocessed.csv', help='preprocessed data (written by --stream preprocessing)')
+    parser.add_argument('--workers', type=int, default=2, help='forests fitted at the same time')
+    parser.add_argument('--cores-per-forest', type=int, default=None, help='processes per forest')
+    args = parser.parse_args()
+
+    grid = None
+    if args.grid is not None:
+        with open(args.grid, 'r') as f:
+            grid = json.load(f)
+    run_outcome_grid(pd.read_csv(args.data), grid, args.workers, args.cores_per_forest)
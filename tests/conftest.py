@@ -0,0 +1,21 @@
+import matplotlib
+import pytest
+
+from synthetic_data import write_synthetic_csv
+
+# the preprocessing draws the NaN plots, no display is needed
+matplotlib.use('Agg')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A fresh working directory with output_data/, the stages write their reports relative to it"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'output_data').mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def register_csv(workdir):
+    """A synthetic register extract of 4000 rows, with PERS duplicated across its chunks"""
+    return write_synthetic_csv(str(workdir / 'data' / 'register.csv'), 4000, seed=1, chunksize=1000)
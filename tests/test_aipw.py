@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aipw import _fit_fold, aipw_scores, design_matrix, estimate_aipw
+
+
+@pytest.fixture
+def scores_input():
+    rng = np.random.default_rng(0)
+    n, arms = 300, np.array([0, 1, 2])
+    treatment = rng.choice(arms, n)
+    ps = rng.dirichlet([3, 3, 3], n)
+    mu = rng.normal(size=(n, 3, 2))
+    y = rng.normal(size=(n, 2))
+    return y, treatment, arms, ps, mu
+
+
+def test_aipw_scores_equal_direct_computation(scores_input):
+    y, treatment, arms, ps, mu = scores_input
+    aipw, _ = aipw_scores(y, treatment, arms, ps, mu, clip=0.05)
+    for i in range(len(y)):
+        for a, arm in enumerate(arms):
+            p = min(max(ps[i, a], 0.05), 0.95)
+            expected = mu[i, a] + (treatment[i] == arm) / p * (y[i] - mu[i, a])
+            np.testing.assert_allclose(aipw[i, a], expected)
+
+
+def test_ipw_scores_average_to_the_hajek_mean(scores_input):
+    y, treatment, arms, ps, mu = scores_input
+    _, ipw = aipw_scores(y, treatment, arms, ps, mu, clip=0.0)
+    for a, arm in enumerate(arms):
+        weights = (treatment == arm) / ps[:, a]
+        hajek = (weights[:, None] * y).sum(axis=0) / weights.sum()
+        np.testing.assert_allclose(ipw[:, a].mean(axis=0), hajek)
+
+
+def test_fit_fold_needs_every_arm():
+    rng = np.random.default_rng(1)
+    x = np.hstack([np.ones((60, 1)), rng.normal(size=(60, 2))])
+    y = rng.normal(size=(60, 1))
+    treatment = np.repeat([0, 1, 2], 20)
+    train, test = treatment != 2, np.ones(60, dtype=bool)
+    with pytest.raises(ValueError, match=r'Arms \[2\] are missing'):
+        _fit_fold(x, y, treatment, np.array([0, 1, 2]), train, test)
+    ps, mu = _fit_fold(x, y, treatment, np.array([0, 1, 2]), np.ones(60, dtype=bool), test)
+    assert ps.shape == (60, 3) and mu.shape == (60, 3, 1)
+    np.testing.assert_allclose(ps.sum(axis=1), 1)
+
+
+def test_design_matrix():
+    df = pd.DataFrame({'age': [20.0, 30.0, 40.0, 40.0], 'const': [1.0] * 4, 'region': [1, 2, 3, 1]})
+    x = design_matrix(df, ['age', 'const'], ['region'])
+    assert x.shape == (4, 5)
+    np.testing.assert_allclose(x[:, 0], 1)
+    np.testing.assert_allclose(x[:, 1].mean(), 0, atol=1e-12)
+    # a constant covariate is centred, not divided by a zero standard deviation
+    np.testing.assert_allclose(x[:, 2], 0)
+
+
+def test_estimate_aipw_recovers_the_effects():
+    rng = np.random.default_rng(2)
+    n = 6000
+    age = rng.normal(40, 10, n)
+    region = rng.integers(1, 4, n)
+    logits = np.column_stack([np.zeros(n), 0.05 * (age - 40), -0.03 * (age - 40) + 0.3 * (region == 2)])
+    probs = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    ptype = np.array([rng.choice(3, p=p) for p in probs])
+    y = 100 + 5 * ptype - 10 * (ptype == 2) + 2 * age + 3 * region + rng.normal(0, 5, n)
+    df = pd.DataFrame({'PTYPE': ptype, 'age': age, 'region': region, 'SAL_AVG': y})
+    config = SimpleNamespace(treatment='PTYPE', ord_covariates=['age'], unord_covariates=['region'],
+                             outcome_variables=['SAL_AVG'])
+    table = estimate_aipw(df, config, n_folds=3, max_workers=1)
+    assert set(table['effect']) == {'1vs0', '2vs0', '2vs1'}
+    aipw = table[table['estimator'] == 'aipw'].set_index('effect')
+    truth = pd.Series({'1vs0': 5.0, '2vs0': 0.0, '2vs1': -5.0})
+    assert (abs(aipw['ate'] - truth) < 4 * aipw['ate_se']).all()
+    # the outcome model is correct, so AIPW is more precise than IPW
+    ipw = table[table['estimator'] == 'ipw'].set_index('effect')
+    assert (aipw['ate_se'] < ipw['ate_se']).all()
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from balance import balance_diagnostics, ipw_weights
+
+
+@pytest.fixture
+def sample():
+    rng = np.random.default_rng(0)
+    n = 900
+    df = pd.DataFrame({
+        'PTYPE': rng.integers(0, 3, n),
+        'AGE': rng.integers(18, 65, n).astype(np.float64),
+        'INCOME': rng.lognormal(10, 1, n),
+        'NATION': rng.integers(1, 4, n),
+    })
+    covariates = {'treatment': 'PTYPE', 'ord_covariates': ['AGE', 'INCOME'], 'unord_covariates': ['NATION']}
+    return df, covariates, rng.uniform(0.2, 5, n)
+
+
+def direct(values, arm, weights, treated, control):
+    """SMD, variance ratio and KS of one covariate, computed arm by arm"""
+    def moments(a, w):
+        x, w = values[arm == a], w[arm == a]
+        mean = np.average(x, weights=w)
+        return mean, np.average((x - mean) ** 2, weights=w)
+
+    def cdf(a, w, at):
+        x, w = values[arm == a], w[arm == a]
+        return np.array([w[x <= v].sum() for v in at]) / w.sum()
+
+    ones = np.ones(len(values))
+    mean_t, var_t = moments(treated, weights)
+    mean_c, var_c = moments(control, weights)
+    # the SMD divides by the unweighted standard deviations
+    raw_var_t, raw_var_c = moments(treated, ones)[1], moments(control, ones)[1]
+    at = np.unique(values)
+    ks = np.abs(cdf(treated, weights, at) - cdf(control, weights, at)).max()
+    return (mean_t - mean_c) / np.sqrt((raw_var_t + raw_var_c) / 2), var_t / var_c, ks
+
+
+def test_diagnostics_equal_direct_computation(sample):
+    df, covariates, weights = sample
+    table = balance_diagnostics(df, covariates, weights)
+    assert set(table['effect']) == {'1vs0', '2vs0', '2vs1'}
+    assert set(table['covariate']) == {'AGE', 'INCOME', 'NATION=1', 'NATION=2', 'NATION=3'}
+    arm = df['PTYPE'].to_numpy()
+    for row in table.itertuples():
+        treated, control = map(int, row.effect.split('vs'))
+        if '=' in row.covariate:
+            column, level = row.covariate.split('=')
+            values = (df[column] == int(level)).to_numpy(dtype=np.float64)
+        else:
+            values = df[row.covariate].to_numpy()
+        w = weights if row.weighting == 'weighted' else np.ones(len(df))
+        expected = direct(values, arm, w, treated, control)
+        np.testing.assert_allclose([row.smd, row.variance_ratio, row.ks], expected, rtol=1e-9, atol=1e-12)
+
+
+def test_unweighted_only(sample):
+    df, covariates, _ = sample
+    table = balance_diagnostics(df, covariates)
+    assert set(table['weighting']) == {'unweighted'}
+    assert len(table) == 3 * 5
+
+
+def test_ipw_weights():
+    ps = np.array([[0.2, 0.8], [0.5, 0.5], [0.9, 0.1]])
+    np.testing.assert_allclose(ipw_weights(ps, np.array([1, 0, 1]), np.array([0, 1])), [1 / 0.8, 2, 10])
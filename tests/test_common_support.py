@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import common_support
+from common_support import support_mask, trim_common_support
+
+
+@pytest.fixture
+def ps():
+    rng = np.random.default_rng(0)
+    raw = rng.dirichlet([2, 2, 2], 500)
+    treatment = np.array([rng.choice(3, p=p) for p in raw])
+    return raw, treatment
+
+
+def test_minmax_equals_loop(ps):
+    ps, treatment = ps
+    lower = np.array([max(ps[treatment == arm, j].min() for arm in range(3)) for j in range(3)])
+    upper = np.array([min(ps[treatment == arm, j].max() for arm in range(3)) for j in range(3)])
+    expected = [all(lower[j] <= row[j] <= upper[j] for j in range(3)) for row in ps]
+    np.testing.assert_array_equal(support_mask(ps, treatment, 'minmax'), expected)
+
+
+def test_threshold_overlap_and_none(ps):
+    ps, treatment = ps
+    np.testing.assert_array_equal(support_mask(ps, treatment, 'threshold', low=0.05, high=0.9),
+                                  [(row >= 0.05).all() and (row <= 0.9).all() for row in ps])
+    np.testing.assert_array_equal(support_mask(ps, treatment, 'overlap', min_overlap=0.1),
+                                  [1 / sum(1 / p for p in row) >= 0.1 for row in ps])
+    assert support_mask(ps, treatment, 'none').all()
+    # a zero propensity score has no overlap
+    assert not support_mask(np.array([[0.0, 0.5, 0.5]]), np.array([1]), 'overlap', min_overlap=0.01)[0]
+
+
+def test_unknown_rule(ps):
+    with pytest.raises(ValueError, match='Unknown common support rule'):
+        support_mask(*ps, rule='trim')
+
+
+def test_trimming_report_is_rewritten(workdir, ps, monkeypatch):
+    ps, treatment = ps
+    df = pd.DataFrame({'PTYPE': treatment})
+    monkeypatch.setattr(common_support, 'propensity_matrix', lambda df, covariates: ps[df.index])
+    covariates = {'treatment': 'PTYPE'}
+    trimmed = trim_common_support(df, covariates, {'rule': 'threshold', 'low': 0.05, 'high': 0.9})
+    trim_common_support(df.iloc[:100], covariates, {'rule': 'threshold', 'low': 0.05, 'high': 0.9})
+    with open('output_data/common_support.txt', 'r') as f:
+        report = f.read().splitlines()
+    # only the second run is in the report
+    assert report[0] == 'Initial sample size: 100'
+    assert sum(line.startswith('After trimming') for line in report) == 1
+    assert report[-1].startswith('Removed off support per PTYPE: 0: ')
+    assert len(trimmed) == support_mask(ps, treatment, 'threshold', low=0.05, high=0.9).sum()
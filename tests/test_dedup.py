@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from dedup import PersIndex
+from main_data_preprocess import unique_pers
+
+
+def test_duplicated_equals_pandas():
+    pers = np.random.default_rng(0).integers(1, 500, 1000)
+    index = PersIndex.from_values(pers)
+    expected = pd.Series(pers).duplicated(keep=False).to_numpy()
+    np.testing.assert_array_equal(index.duplicated(pers), expected)
+    # values that are not in the index, below and above its range, are no duplicates
+    assert not index.duplicated([0, 10_000]).any()
+
+
+def test_chunked_updates_equal_one_index():
+    chunks = np.array_split(np.random.default_rng(1).integers(1, 300, 900), 4)
+    index = PersIndex()
+    seen = pd.Series(dtype=np.int64)
+    for chunk in chunks:
+        # update reports the PERS that occurred exactly once before and occur again in the chunk
+        expected = sorted(set(seen[seen == 1].index) & set(chunk))
+        np.testing.assert_array_equal(index.update(chunk), expected)
+        seen = seen.add(pd.Series(chunk).value_counts(), fill_value=0)
+    direct = PersIndex.from_values(np.concatenate(chunks))
+    np.testing.assert_array_equal(index.keys, direct.keys)
+    np.testing.assert_array_equal(index.counts, direct.counts)
+
+
+def test_clusters_and_round_trip(workdir):
+    index = PersIndex.from_values([5, 3, 5, 7, 3, 5, 9])
+    clusters = index.clusters()
+    pd.testing.assert_frame_equal(clusters, pd.DataFrame({'PERS': np.array([3, 5]), 'count': np.array([2, 3])}))
+    index.save('index.npz')
+    loaded = PersIndex.load('index.npz')
+    np.testing.assert_array_equal(loaded.keys, index.keys)
+    np.testing.assert_array_equal(loaded.counts, index.counts)
+
+
+def test_unique_pers_mask():
+    df = pd.DataFrame({'PERS': [1, 2, 2, 3, 4, 4, 4]})
+    alive = np.array([True, True, True, True, True, True, False])
+    mask = np.asarray(unique_pers(df, alive, list(df.columns)))
+    # keep=False among the rows that are still in the sample
+    np.testing.assert_array_equal(mask[alive], [True, False, False, True, False, False])
+    assert df['PERS'].tolist() == [1, 2, 2, 3, 4, 4, 4]
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from incremental import append_extract
+
+REPORTS = ['sample_statistics.csv', 'distribution_comparison.csv', 'nan_statistics.csv', 'regional_imputation.csv']
+
+
+def run_appends(paths, name):
+    """Append the extracts in order to a fresh state; returns the sample, sample_sizes.txt and the csv reports"""
+    for path in paths:
+        append_extract(path, state_dir=f'{name}/state', out_path=f'{name}/preprocessed.csv', chunksize=700)
+    with open('output_data/sample_sizes.txt', 'r') as f:
+        sizes = f.read()
+    reports = {report: pd.read_csv(f'output_data/{report}') for report in REPORTS}
+    return pd.read_csv(f'{name}/preprocessed.csv'), sizes, reports
+
+
+def test_two_appends_equal_one(register_csv, workdir):
+    raw = pd.read_csv(register_csv)
+    # the split falls inside a chunk of the generator, so PERS of the first part reappear in the second
+    raw.iloc[:2500].to_csv('data/part1.csv', index=False)
+    raw.iloc[2500:].to_csv('data/part2.csv', index=False)
+
+    single, single_sizes, single_reports = run_appends([register_csv], 'single')
+    parts, parts_sizes, parts_reports = run_appends(['data/part1.csv', 'data/part2.csv'], 'parts')
+
+    assert np.isin(pd.read_csv('data/part2.csv')['PERS'], raw['PERS'].iloc[:2500]).any()
+    pd.testing.assert_frame_equal(parts, single)
+    assert parts_sizes == single_sizes
+    for report in REPORTS:
+        left, right = parts_reports[report], single_reports[report]
+        numeric = left.select_dtypes('number').columns
+        pd.testing.assert_frame_equal(left.drop(columns=numeric), right.drop(columns=numeric))
+        np.testing.assert_allclose(left[numeric].to_numpy(float), right[numeric].to_numpy(float), rtol=1e-12)
+
+
+def test_empty_extract_changes_nothing(register_csv, workdir):
+    append_extract(register_csv, state_dir='state', out_path='preprocessed.csv', chunksize=700)
+    before = pd.read_csv('preprocessed.csv')
+    pd.read_csv(register_csv, nrows=0).to_csv('data/empty.csv', index=False)
+    append_extract('data/empty.csv', state_dir='state', out_path='preprocessed.csv', chunksize=700)
+    pd.testing.assert_frame_equal(pd.read_csv('preprocessed.csv'), before)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from matching import _nearest_without_replacement, match_arm, whiten
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    x_t, x_c = rng.normal(0.3, 1, (60, 2)), rng.normal(0, 1, (200, 2))
+    y_t, y_c = rng.normal(1, 1, (60, 2)), rng.normal(0, 1, (200, 2))
+    return x_t, x_c, y_t, y_c
+
+
+def brute_force(x_t, x_c, y_t, y_c, method, n_neighbors=1, caliper=None):
+    """Matches from the full distance matrix and the Abadie-Imbens variance written out per treated unit"""
+    dist = np.linalg.norm(x_t[:, None, :] - x_c[None, :, :], axis=2)
+    caliper = np.inf if caliper is None else caliper
+    share = np.zeros(dist.shape)
+    for i, row in enumerate(dist):
+        matches = np.flatnonzero(row <= caliper) if method == 'radius' else \
+            [j for j in np.argsort(row)[:n_neighbors] if row[j] <= caliper]
+        share[i, matches] = 1 / max(len(matches), 1)
+    matched = share.sum(axis=1) > 0
+    diff = y_t[matched] - share[matched] @ y_c
+    att = diff.mean(axis=0)
+
+    # sigma_j^2 from the nearest other control, only needed for the controls that are used
+    control_dist = np.linalg.norm(x_c[:, None, :] - x_c[None, :, :], axis=2)
+    np.fill_diagonal(control_dist, np.inf)
+    sigma2 = (y_c - y_c[control_dist.argmin(axis=1)]) ** 2 / 2
+    variance = ((diff - att) ** 2).sum(axis=0)
+    for j in np.flatnonzero(share.sum(axis=0)):
+        s = share[:, j]
+        variance += (s.sum() ** 2 - (s ** 2).sum()) * sigma2[j]
+    return {'att': att, 'se': np.sqrt(variance) / matched.sum(), 'matched': matched, 'control_weights': share.sum(axis=0)}
+
+
+def assert_same(result, expected):
+    np.testing.assert_array_equal(result['matched'], expected['matched'])
+    for key in ['att', 'se', 'control_weights']:
+        np.testing.assert_allclose(result[key], expected[key], rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('n_neighbors, caliper', [(1, None), (3, None), (2, 0.3)])
+def test_nearest_with_replacement(data, n_neighbors, caliper):
+    result = match_arm(*data, method='nearest', n_neighbors=n_neighbors, caliper=caliper)
+    assert_same(result, brute_force(*data, 'nearest', n_neighbors, caliper))
+
+
+@pytest.mark.parametrize('dims', [1, 2])
+def test_radius(data, dims):
+    # a 1d score takes the sorted prefix-sum path, more dimensions the KD-tree
+    x_t, x_c, y_t, y_c = data
+    data = (x_t[:, :dims], x_c[:, :dims], y_t, y_c)
+    result = match_arm(*data, method='radius', caliper=0.2)
+    assert_same(result, brute_force(*data, 'radius', caliper=0.2))
+
+
+def test_nearest_without_replacement(data):
+    x_t, x_c, _, _ = data
+    idx = _nearest_without_replacement(cKDTree(x_c), x_t, len(x_c), 2, 0.5)
+    used = idx[idx >= 0]
+    # every control is used at most once and every match lies within the caliper
+    assert len(np.unique(used)) == len(used)
+    rows = np.nonzero(idx >= 0)[0]
+    assert (np.linalg.norm(x_t[rows] - x_c[used], axis=1) <= 0.5).all()
+    # a treated unit without matches has no free control within the caliper
+    free = np.setdiff1d(np.arange(len(x_c)), used)
+    for unit in np.flatnonzero((idx < 0).any(axis=1)):
+        assert (np.linalg.norm(x_c[free] - x_t[unit], axis=1) > 0.5).all()
+
+
+def test_whiten_gives_mahalanobis_distances(data):
+    x_t, x_c, _, _ = data
+    reference = np.vstack([x_t, x_c])
+    inverse = np.linalg.inv(np.cov(reference, rowvar=False))
+    delta = x_t[:5] - x_c[:5]
+    white = whiten(x_t[:5], reference) - whiten(x_c[:5], reference)
+    np.testing.assert_allclose((white ** 2).sum(axis=1), np.einsum('ij,jk,ik->i', delta, inverse, delta), rtol=1e-10)
+
+
+def test_whiten_drops_constant_covariates(data):
+    x_t, x_c, _, _ = data
+    reference = np.column_stack([x_c, np.ones(len(x_c))])
+    white = whiten(np.column_stack([x_t, np.ones(len(x_t))]), reference)
+    assert white.shape[1] == 2
+    assert np.isfinite(white).all()
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from moments import Moments
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    n = 1000
+    df = pd.DataFrame({'group': rng.integers(0, 4, n), 'x': rng.normal(1e4, 50, n), 'y': rng.exponential(3, n)})
+    df.loc[rng.uniform(size=n) < 0.1, 'y'] = np.nan
+    return df
+
+
+def assert_moments_equal(actual, expected):
+    for attr in ['count', 'mean', 'm2']:
+        left = getattr(actual, attr).sort_index()
+        right = getattr(expected, attr).reindex(index=left.index, columns=left.columns)
+        np.testing.assert_allclose(left.to_numpy(), right.to_numpy(), rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize('by', [None, 'group'])
+def test_merge_of_chunks_equals_direct(df, by):
+    chunks = [df.iloc[start:start + 150] for start in range(0, len(df), 150)]
+    merged = Moments.of(chunks[0], ['x', 'y'], by=by)
+    for chunk in chunks[1:]:
+        merged = merged.merge(Moments.of(chunk, ['x', 'y'], by=by))
+    assert_moments_equal(merged, Moments.of(df, ['x', 'y'], by=by))
+    np.testing.assert_allclose(merged.std().sort_index().to_numpy(),
+                               df.groupby(by if by else np.zeros(len(df)))[['x', 'y']].std().to_numpy(), rtol=1e-12)
+
+
+@pytest.mark.parametrize('by', [None, 'group'])
+def test_remove_equals_direct(df, by):
+    drop = np.random.default_rng(1).uniform(size=len(df)) < 0.3
+    remaining = Moments.of(df, ['x', 'y'], by=by).remove(Moments.of(df[drop], ['x', 'y'], by=by))
+    assert_moments_equal(remaining, Moments.of(df[~drop], ['x', 'y'], by=by))
+
+
+def test_remove_a_whole_group(df):
+    remaining = Moments.of(df, ['x', 'y'], by='group').remove(Moments.of(df[df['group'] == 2], ['x', 'y'], by='group'))
+    assert (remaining.count.loc[2] == 0).all()
+    assert remaining.mean.loc[2].isna().all()
+    assert (remaining.m2.loc[2] == 0).all()
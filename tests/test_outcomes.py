@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from outcomes import compute_outcomes
+from synthetic_data import generate
+
+
+def baseline_outcomes(df):
+    """The column-by-column loops compute_outcomes replaced"""
+    df = df.copy()
+    df['EARNX1'] = df[['EARNX1_1', 'EARNX1_2', 'EARNX1_3', 'EARNX1_4']].mean(axis=1)
+    df['EARNX2'] = df[['EARNX2_1', 'EARNX2_2', 'EARNX2_3', 'EARNX2_4']].mean(axis=1)
+    for period in range(3, 10):
+        df[f'SAL_{period}'] = 3 * df[[f'EARNX{period}_{quarter}' for quarter in range(1, 5)]].sum(axis=1)
+    df['SAL_AVG'] = df[[f'SAL_{period}' for period in range(3, 10)]].mean(axis=1)
+    empl_cols = [f'EMPLX{period}_{quarter}' for period in range(3, 10) for quarter in range(1, 5)]
+    df['EMPL_TTL'] = (df[empl_cols] == 1).sum(axis=1)
+    is_employed = df[empl_cols].eq(1)
+    to_employed = is_employed & ~is_employed.shift(axis=1).fillna(False)
+    from_employed = ~is_employed & is_employed.shift(axis=1).fillna(False)
+    df['EMPL_CHGE'] = to_employed.sum(axis=1) + from_employed.sum(axis=1)
+    return df
+
+
+# the baseline relies on the fillna downcasting pandas deprecated
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_outcomes_equal_baseline_loops():
+    # parsed like the raw csv, so missing employment quarters are float NaN as in the baseline
+    df = pd.read_csv(io.StringIO(generate(2000, seed=3).to_csv(index=False)))
+    df.loc[df.index[::7], 'EARNX1_2'] = np.nan
+    df.loc[df.index[::11], 'EMPLX5_3'] = np.nan
+    outcomes = compute_outcomes(df)
+    expected = baseline_outcomes(df)[outcomes.columns]
+    # the panel holds the earnings as float32
+    pd.testing.assert_frame_equal(outcomes, expected, check_dtype=False, rtol=1e-6)
+
+
+def test_outcomes_of_an_empty_frame():
+    outcomes = compute_outcomes(generate(10).iloc[:0])
+    assert len(outcomes) == 0
+    assert {'SAL_AVG', 'EMPL_TTL', 'EMPL_CHGE'} <= set(outcomes.columns)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from partitions import (is_current, load_meta, map_partitions, parse_ranges, read_partitions, regions_dir,
+                        select_partitions, write_partitions)
+
+
+@pytest.fixture
+def sample():
+    rng = np.random.default_rng(0)
+    n = 1000
+    return pd.DataFrame({
+        'PERS': np.arange(n),
+        'REGION': rng.choice([12, 3, 40, 7], n),
+        'PTYPE': rng.integers(0, 3, n),
+        'AGE': rng.integers(18, 65, n),
+        'SAL_AVG': rng.normal(3000, 500, n),
+    })
+
+
+@pytest.fixture
+def root(workdir, sample):
+    write_partitions(sample, root='partitions', source='key', max_workers=2)
+    return 'partitions'
+
+
+def test_round_trip(root, sample):
+    df = read_partitions(root)
+    expected = sample.sort_values('REGION', kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, expected)
+    meta = load_meta(root)
+    assert meta['n_rows'] == len(sample)
+    assert sum(part['n_rows'] for part in meta['partitions'].values()) == len(sample)
+    part = meta['partitions']['12']
+    assert part['counts']['PTYPE'] == {str(k): int(v) for k, v in
+                                       sample.loc[sample['REGION'] == 12, 'PTYPE'].value_counts().items()}
+    assert part['min']['AGE'] == sample.loc[sample['REGION'] == 12, 'AGE'].min()
+
+
+def test_select_partitions(root, sample):
+    meta = load_meta(root)
+    assert select_partitions(meta) == ['3', '7', '12', '40']
+    assert select_partitions(meta, regions=[40, 12, 99]) == ['12', '40']
+    assert select_partitions(meta, regions=lambda region: region < 10) == ['3', '7']
+    # a range that no partition reaches prunes all of them, an open end none
+    assert select_partitions(meta, ranges={'AGE': (70, None)}) == []
+    assert select_partitions(meta, ranges={'AGE': (None, 90)}) == ['3', '7', '12', '40']
+    meta['partitions']['7']['max']['SAL_AVG'] = 1000.0
+    assert select_partitions(meta, ranges={'SAL_AVG': (2000, None)}) == ['3', '12', '40']
+    with pytest.raises(KeyError, match='No min/max'):
+        select_partitions(meta, ranges={'NOPE': (0, 1)})
+
+
+def test_read_columns_and_ranges(root, sample):
+    df = read_partitions(root, regions=[12, 40], columns=['PERS', 'SAL_AVG'], ranges={'AGE': (30, 40)})
+    keep = sample['REGION'].isin([12, 40]) & sample['AGE'].between(30, 40)
+    expected = sample[keep].sort_values('REGION', kind='stable')[['PERS', 'SAL_AVG']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, expected)
+    with pytest.raises(KeyError, match='not in the partitions'):
+        read_partitions(root, columns=['NOPE'])
+    empty = read_partitions(root, regions=[99], columns=['AGE', 'PERS'])
+    assert list(empty.columns) == ['AGE', 'PERS'] and len(empty) == 0
+    sizes = map_partitions(len, root, regions=[3, 7])
+    assert sizes == {'3': (sample['REGION'] == 3).sum(), '7': (sample['REGION'] == 7).sum()}
+
+
+def test_is_current(root):
+    assert is_current('key', root)
+    assert not is_current('other', root)
+    assert not is_current(None, root)
+    assert not is_current('key', 'missing')
+
+
+def test_regions_dir_and_parse_ranges():
+    assert regions_dir([40, 12]) == 'regions=12,40'
+    assert parse_ranges(['AGE=30:40', 'EARN_X0=:5000']) == {'AGE': (30.0, 40.0), 'EARN_X0': (None, 5000.0)}
@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stage_cache
+from stage_cache import StageCache, code_version, declare_outputs, fingerprint, local_modules
+
+
+class Stage:
+    """A stage function that counts its calls and writes one output file"""
+
+    def __init__(self, path='output_data/report.txt'):
+        self.path = path
+        self.calls = 0
+
+    def __call__(self, df, factor=1):
+        self.calls += 1
+        with open(self.path, 'w') as f:
+            f.write(f'{self.calls}\n')
+        return df * factor
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'a': np.arange(5), 'b': np.linspace(0, 1, 5)})
+
+
+def test_hit_restores_result_and_outputs(workdir, df):
+    stage = Stage()
+    first = StageCache().run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    os.remove(stage.path)
+    second = StageCache().run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    assert stage.calls == 1
+    pd.testing.assert_frame_equal(second, first)
+    with open(stage.path, 'r') as f:
+        assert f.read() == '1\n'
+
+
+def test_key_changes_with_inputs_params_and_force(workdir, df):
+    stage = Stage()
+    cache = StageCache()
+    cache.run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    cache.run('stage', stage, inputs=(df, 2), output_dirs=['output_data'])
+    changed = df.copy()
+    changed.loc[0, 'b'] = 0.5
+    cache.run('stage', stage, inputs=(changed,), output_dirs=['output_data'])
+    cache.run('stage', stage, inputs=(df,), params={'caliper': 0.1}, output_dirs=['output_data'])
+    assert stage.calls == 4
+    StageCache(force=['stage']).run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    assert stage.calls == 5
+    StageCache(enabled=False).run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    assert stage.calls == 6
+
+
+def test_key_inputs_replace_inputs(workdir, df):
+    stage = Stage()
+    cache = StageCache()
+    cache.run('stage', stage, inputs=(df,), key_inputs=('v1',), output_dirs=['output_data'])
+    cache.run('stage', stage, inputs=(df * 2,), key_inputs=('v1',), output_dirs=['output_data'])
+    assert stage.calls == 1
+
+
+def test_declared_outputs_are_restored(workdir, df):
+    with open('output_data/untouched.txt', 'w') as f:
+        f.write('kept')
+
+    def stage(df):
+        declare_outputs(['output_data/untouched.txt'])
+        return len(df)
+
+    StageCache().run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    os.remove('output_data/untouched.txt')
+    StageCache().run('stage', stage, inputs=(df,), output_dirs=['output_data'])
+    with open('output_data/untouched.txt', 'r') as f:
+        assert f.read() == 'kept'
+    assert stage_cache._declared is None
+
+
+def test_least_recently_used_entries_are_evicted(workdir):
+    stage = Stage()
+    big = lambda seed: pd.DataFrame({'a': np.random.default_rng(seed).normal(size=20_000)})
+    cache = StageCache(max_bytes=400_000)
+    cache.run('stage', stage, inputs=(big(0),), output_dirs=['output_data'])
+    cache.run('stage', stage, inputs=(big(1),), output_dirs=['output_data'])
+    # using the first entry again makes the second the least recently used one
+    cache.run('stage', stage, inputs=(big(0),), output_dirs=['output_data'])
+    cache.run('stage', stage, inputs=(big(2),), output_dirs=['output_data'])
+    assert stage.calls == 3
+    cache.run('stage', stage, inputs=(big(0),), output_dirs=['output_data'])
+    assert stage.calls == 3
+    cache.run('stage', stage, inputs=(big(1),), output_dirs=['output_data'])
+    assert stage.calls == 4
+    assert len(cache._load_index()) == 2
+
+
+def test_fingerprint_is_content_based():
+    df = pd.DataFrame({'a': [1, 2, 3]})
+    assert fingerprint(df) == fingerprint(df.copy())
+    assert fingerprint(df) != fingerprint(df.astype('int32'))
+    assert fingerprint(df) != fingerprint(df.set_axis([1, 2, 3]))
+    assert fingerprint(np.arange(3)) != fingerprint(np.arange(3.0))
+
+
+def test_code_version_follows_local_imports():
+    import plot_ptype
+    import render
+    names = [module.__name__ for module in local_modules([plot_ptype])]
+    assert {'plot_ptype', 'render', 'plot_summary'} <= set(names)
+    assert 'pandas' not in names
+    assert code_version([plot_ptype]) != code_version([render])
@@ -0,0 +1,18 @@
+import numpy as np
+
+from main_data_preprocess import run_preprocessing
+
+
+def test_stream_equals_in_memory(register_csv, workdir):
+    in_memory = run_preprocessing(register_csv)
+    with open('output_data/sample_sizes.txt', 'r') as f:
+        in_memory_sizes = f.read()
+    streamed = run_preprocessing(register_csv, streaming=True, chunksize=700)
+    with open('output_data/sample_sizes.txt', 'r') as f:
+        streamed_sizes = f.read()
+
+    assert streamed_sizes == in_memory_sizes
+    assert list(streamed.columns) == list(in_memory.columns)
+    np.testing.assert_array_equal(streamed['PERS'].to_numpy(), in_memory['PERS'].to_numpy())
+    # the in-memory path reads the earnings through the float32 columnar cache (see data_cache.py)
+    np.testing.assert_allclose(streamed.to_numpy(float), in_memory.to_numpy(float), rtol=1e-6, equal_nan=True)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+try:
+    from treatment_effect import aggregate_folds, pool_folds
+except (ImportError, SyntaxError) as error:
+    # mcf is missing, or was installed for the Python version pyproject.toml asks for
+    pytest.skip(f'mcf is not importable: {error}', allow_module_level=True)
+
+
+def test_pooled_se_is_the_out_of_fold_score_variance():
+    rng = np.random.default_rng(0)
+    scores = [rng.normal(mean, 2, n) for mean, n in [(1.0, 300), (1.4, 250), (0.7, 280)]]
+    estimates = np.array([s.mean() for s in scores])
+    ses = np.array([s.std() / np.sqrt(len(s)) for s in scores])
+    estimate, se = pool_folds(estimates, ses, [len(s) for s in scores])
+    pooled = np.concatenate(scores)
+    np.testing.assert_allclose(estimate, pooled.mean(), rtol=1e-12)
+    np.testing.assert_allclose(se, pooled.std() / np.sqrt(len(pooled)), rtol=1e-12)
+
+
+def test_empty_folds_get_no_weight():
+    estimate, se = pool_folds(np.array([[1.0, 2.0], [np.nan, 4.0]]), np.array([[0.1, 0.2], [np.nan, 0.2]]),
+                              np.array([[10, 10], [0, 10]]))
+    assert estimate[0] == 1.0 and se[0] == pytest.approx(0.1)
+    assert estimate[1] == 3.0
+
+
+def fold_result(rng, z_values):
+    """mcf prediction results of one fold: 2 outcomes, effects 1vs0 and 2vs0, GATEs for one Z"""
+    ate = rng.normal(size=(2, 1, 2))
+    gate = rng.normal(size=(len(z_values), 2, 1, 2))
+    return {'ate': ate, 'ate_se': np.full(ate.shape, 0.1), 'ate_effect_list': [(1, 0), (2, 0)],
+            'gate': [gate], 'gate_se': [np.full(gate.shape, 0.2)],
+            'gate_names_values': {'z_names_list': ['sex'], 'sex': z_values},
+            'iate_data_df': pd.DataFrame({'y_iate': rng.normal(size=4)})}
+
+
+def test_aggregate_folds():
+    rng = np.random.default_rng(1)
+    held_out = [pd.DataFrame({'SEX': [1, 1, 2]}), pd.DataFrame({'SEX': [1, 2, 2, 2]})]
+    results = [fold_result(rng, [1, 2]), fold_result(rng, [1, 2])]
+    ate_df, gate_df, iate_df = aggregate_folds(results, held_out, ['Y1', 'Y2'])
+    assert len(ate_df) == 4 and len(iate_df) == 8
+    row = gate_df[(gate_df['z_value'] == 2) & (gate_df['outcome'] == 'Y2') & (gate_df['effect'] == '2vs0')].iloc[0]
+    assert row['z_name'] == 'SEX' and row['n'] == 4
+    expected = (1 * results[0]['gate'][0][1, 1, 0, 1] + 3 * results[1]['gate'][0][1, 1, 0, 1]) / 4
+    assert row['gate'] == pytest.approx(expected)
+    assert row['gate_se'] > 0